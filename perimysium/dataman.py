@@ -7,10 +7,16 @@
 # changes that need to be made to the model file.
 # TODO allow specifying which cycles to manage.
 
-import csv
+import collections
+import copy
 import difflib
 import filecmp
+import hashlib
+import itertools
+import multiprocessing
+import operator
 import os
+import pickle
 import shutil
 import sys
 import re
@@ -23,9 +29,6 @@ except ImportError, e: print e.message
 try: import numpy as np
 except ImportError, e: print e.message
 
-try: from numpy.lib.recfunctions import append_fields
-except ImportError, e: print e.message
-
 if sys.version_info[0] == 2 and sys.version_info[1] < 6:
     # Taken from /usr/lib/python2.7/posixpath.py
     # This method does not exist prior to python2.6.
@@ -52,32 +55,396 @@ def remove_fields_from_structured_ndarray(ndarray, fields, copy=True):
 
     Parameters
     ----------
-    ndarray: numpy.ndarray
+    ndarray: numpy.ndarray or ColumnArray
         The structured ndarray from which to remove a field (and corresponding
         data).
     fields: list of str's, or a single str.
         e.g., 'F2X'.
     copy: bool, optional
-        NumPy doesn't like it if you tamper with the returned ndarray, since we
-        used array indexing to give it to you. It prefers we return a copy
-        of the array. This takes more time/memory, though. So if you are not
-        going to tamper with the returned value, you may want `copy` to be
-        False.
+        If False, return a view of `ndarray` that skips the removed fields
+        (no data is copied, but the rows still take up as much memory as in
+        `ndarray`). If True (default), return a compact copy.
 
     Returns
     -------
-    new_ndarray: numpy.ndarray
+    new_ndarray: numpy.ndarray or ColumnArray
+        A ColumnArray if `ndarray` is one; it always shares memory with
+        `ndarray`.
 
     """
-    names = list(ndarray.dtype.names)
     if type(fields) != list:
         fields = [fields]
+    if isinstance(ndarray, ColumnArray):
+        return ndarray.remove_fields(fields)
+    names = list(ndarray.dtype.names)
     for field in fields:
         names.remove(field)
+    # A dtype with only the remaining fields, but at their original offsets.
+    view = ndarray.view(np.dtype({'names': names,
+        'formats': [ndarray.dtype.fields[name][0] for name in names],
+        'offsets': [ndarray.dtype.fields[name][1] for name in names],
+        'itemsize': ndarray.dtype.itemsize}))
     if copy:
-        return ndarray[names].copy()
+        return _select_fields(view, names)
     else:
-        return ndarray[names]
+        return view
+
+class ColumnArray(object):
+    """A table of float64 columns, stored as one homogeneous 2-D array (one
+    contiguous row of the array per column) plus a map from column name to
+    row index. Compared to a structured ndarray:
+
+    - a column is a contiguous, zero-copy view (`col(name)`);
+    - removing fields returns a ColumnArray that shares memory
+      (`remove_fields`);
+    - adding columns reallocates only when capacity runs out, and capacity
+      grows geometrically, so adding many columns one at a time is cheap
+      (`add_column`).
+
+    Use `from_structured()` and `to_structured()` to convert to and from the
+    structured ndarrays used elsewhere (e.g., `TRCFile.data`).
+
+    """
+    def __init__(self, n_rows, names=None, values=None, capacity=None):
+        """
+        Parameters
+        ----------
+        n_rows : int
+            Length of every column.
+        names : list of str's, optional
+            Names of the initial columns.
+        values : array_like, optional
+            (n_rows, len(names)) initial data.
+        capacity : int, optional
+            Number of columns for which to allocate memory up front.
+
+        """
+        if names is None:
+            names = list()
+        self.n_rows = n_rows
+        self.names = list()
+        self._index = dict()
+        self._buffer = np.empty((max(capacity or 0, len(names), 1), n_rows))
+        self._n_used = 0
+        self._shared = False
+        if len(names) > 0:
+            values = np.asarray(values, dtype=float).reshape(n_rows,
+                    len(names))
+            self.add_columns(names, values.T)
+
+    @classmethod
+    def from_structured(cls, ndarray, capacity=None):
+        """A ColumnArray with a copy of each field of the structured
+        `ndarray`.
+
+        """
+        names = list(ndarray.dtype.names)
+        columns = cls(len(ndarray), capacity=max(capacity or 0, len(names)))
+        columns.add_columns(names, [ndarray[name] for name in names])
+        return columns
+
+    def to_structured(self):
+        """A structured ndarray (float64 fields) with a copy of the data."""
+        data = np.empty(self.n_rows, dtype=[(name, 'float64')
+            for name in self.names])
+        # All fields are float64, so data can be filled as a 2-D array.
+        data.view(np.float64).reshape(self.n_rows, len(self.names))[:] = \
+                self.values
+        return data
+
+    def __len__(self):
+        return self.n_rows
+
+    def __contains__(self, name):
+        return name in self._index
+
+    def __getitem__(self, name):
+        """See `col()`."""
+        return self.col(name)
+
+    def col(self, name):
+        """The data in column `name`; a view, not a copy."""
+        return self._buffer[self._index[name]]
+
+    @property
+    def values(self):
+        """The data, as an (n_rows, n_columns) array. This is a view if the
+        columns are stored in order without gaps (e.g., no fields have been
+        removed); otherwise, a copy.
+
+        """
+        rows = [self._index[name] for name in self.names]
+        if rows == list(range(len(rows))):
+            return self._buffer[:len(rows)].T
+        return self._buffer[rows].T
+
+    def add_column(self, name, values):
+        """Appends a column.
+
+        Parameters
+        ----------
+        name : str
+        values : array_like
+            Length `n_rows`.
+
+        """
+        self.add_columns([name], [values])
+
+    def add_columns(self, names, columns):
+        """Appends columns, reallocating at most once.
+
+        Parameters
+        ----------
+        names : list of str's
+        columns : list of array_like's
+            Each has length `n_rows`.
+
+        """
+        for name in names:
+            if name in self._index:
+                raise Exception("Column '%s' already exists." % name)
+        n_needed = self._n_used + len(names)
+        # If the buffer is shared (see `remove_fields`), its unused part may
+        # be claimed by another ColumnArray, so we reallocate.
+        if n_needed > len(self._buffer) or self._shared:
+            # Double the capacity, so adding columns one at a time costs
+            # amortized O(n_rows) each.
+            buf = np.empty((max(n_needed, 2 * len(self._buffer)),
+                self.n_rows))
+            rows = [self._index[name] for name in self.names]
+            buf[:len(rows)] = self._buffer[rows]
+            self._buffer = buf
+            self._index = dict((name, i) for i, name in enumerate(self.names))
+            self._n_used = len(rows)
+            self._shared = False
+        for name, values in zip(names, columns):
+            if len(values) != self.n_rows:
+                raise Exception("Column '%s' has length %i, not %i." % (name,
+                    len(values), self.n_rows))
+            self._buffer[self._n_used] = values
+            self._index[name] = self._n_used
+            self.names.append(name)
+            self._n_used += 1
+
+    def remove_fields(self, fields):
+        """A ColumnArray without `fields`, sharing memory with this one; no
+        data is copied.
+
+        """
+        if type(fields) != list:
+            fields = [fields]
+        for field in fields:
+            if field not in self._index:
+                raise Exception("No column '%s'." % field)
+        new = ColumnArray.__new__(ColumnArray)
+        new.n_rows = self.n_rows
+        new.names = [name for name in self.names if name not in fields]
+        new._index = dict((name, self._index[name]) for name in new.names)
+        new._buffer = self._buffer
+        new._n_used = self._n_used
+        # Neither may write to the unused part of the shared buffer.
+        new._shared = True
+        self._shared = True
+        return new
+
+def _rename_into_place(tmp_fpath, fpath):
+    """Renames `tmp_fpath` to `fpath`, replacing `fpath` if it exists."""
+    if os.name == 'nt' and os.path.exists(fpath):
+        os.remove(fpath)
+    os.rename(tmp_fpath, fpath)
+
+class ParseCache(object):
+    """An on-disk cache of parsed data files (Storage, TRC, ANC). The parsed
+    structured ndarray is saved as an '.npy' file in `cache_dir`, along with a
+    small pickle of the file's metadata (e.g., TRC header entries). Warm loads
+    are memory-mapped (copy-on-write), so they are nearly free and can be
+    modified in memory without touching the cache.
+
+    An entry is valid as long as the source file has the same mtime and size
+    as when it was parsed (or the same size and SHA-1 hash, if `check_hash`).
+    When the cache grows beyond `max_size` bytes, the least recently used
+    entries are evicted.
+
+    Usually, you do not create this yourself; use `enable_parse_cache()`.
+
+    """
+    def __init__(self, cache_dir, max_size=2 * 1024**3, check_hash=False):
+        """
+        Parameters
+        ----------
+        cache_dir : str
+            Directory in which to store the cache. Created if it doesn't
+            exist.
+        max_size : int, optional
+            Maximum total size of the cache, in bytes.
+        check_hash : bool, optional (default: False)
+            Decide whether a cache entry is stale by comparing a SHA-1 hash of
+            the source file, rather than its mtime. This costs a read of the
+            source file, but no parsing, and avoids re-parsing files that were
+            touched or copied without being changed.
+
+        """
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.check_hash = check_hash
+        if not os.path.exists(cache_dir): os.makedirs(cache_dir)
+
+    def _entry_fpaths(self, fpath, kind, args):
+        key = hashlib.sha1(repr((os.path.abspath(fpath), kind,
+            args))).hexdigest()
+        base = os.path.join(self.cache_dir, key)
+        return base + '.npy', base + '.pkl'
+
+    def load(self, fpath, kind, parse, args=()):
+        """Returns the parsed contents of `fpath`, from the cache if possible.
+        Otherwise, `parse` is called and its result is stored in the cache.
+
+        Parameters
+        ----------
+        fpath : str
+            The source data file.
+        kind : str
+            The type of file (e.g., 'storage'); part of the cache key.
+        parse : callable
+            Takes no arguments and returns a tuple (data, meta): the parsed
+            structured ndarray and a picklable dict of metadata.
+        args : tuple, optional
+            Any parsing options that affect the result (e.g.,
+            `excess_header_entries`); part of the cache key.
+
+        Returns
+        -------
+        data : numpy.ndarray
+        meta : dict
+
+        """
+        npy_fpath, meta_fpath = self._entry_fpaths(fpath, kind, args)
+        source = self._source_signature(fpath)
+        if os.path.exists(meta_fpath) and os.path.exists(npy_fpath):
+            with open(meta_fpath, 'rb') as f:
+                entry = pickle.load(f)
+            if self._is_valid(entry['source'], source):
+                # Mark as recently used.
+                os.utime(meta_fpath, None)
+                return np.load(npy_fpath, mmap_mode='c'), entry['meta']
+
+        data, meta = parse()
+        self._store(npy_fpath, meta_fpath, data,
+                {'source': source, 'meta': meta})
+        self._evict()
+        return data, meta
+
+    def _source_signature(self, fpath):
+        stat = os.stat(fpath)
+        source = {'mtime': stat.st_mtime, 'size': stat.st_size}
+        if self.check_hash:
+            sha1 = hashlib.sha1()
+            with open(fpath, 'rb') as f:
+                for chunk in iter(lambda: f.read(2**20), ''):
+                    sha1.update(chunk)
+            source['sha1'] = sha1.hexdigest()
+        return source
+
+    def _is_valid(self, cached, current):
+        if cached['size'] != current['size']:
+            return False
+        if self.check_hash:
+            return cached.get('sha1') == current['sha1']
+        return cached['mtime'] == current['mtime']
+
+    def _store(self, npy_fpath, meta_fpath, data, entry):
+        # Write to temporary files, then rename, so that other processes
+        # never see a partially-written entry.
+        tmp_suffix = '.tmp%i' % os.getpid()
+        with open(npy_fpath + tmp_suffix, 'wb') as f:
+            np.save(f, data)
+        with open(meta_fpath + tmp_suffix, 'wb') as f:
+            pickle.dump(entry, f, 2)
+        for fpath in [npy_fpath, meta_fpath]:
+            _rename_into_place(fpath + tmp_suffix, fpath)
+
+    def _entries(self):
+        """List of (last use, size in bytes, [file paths]) for each entry."""
+        entries = list()
+        for fname in os.listdir(self.cache_dir):
+            if fname.endswith('.pkl'):
+                meta_fpath = os.path.join(self.cache_dir, fname)
+                npy_fpath = meta_fpath[:-4] + '.npy'
+                fpaths = [fp for fp in [meta_fpath, npy_fpath]
+                        if os.path.exists(fp)]
+                entries.append((os.path.getmtime(meta_fpath),
+                    sum(os.path.getsize(fp) for fp in fpaths), fpaths))
+        return entries
+
+    def size(self):
+        """Total size of the cache, in bytes."""
+        return sum(entry[1] for entry in self._entries())
+
+    def _evict(self):
+        entries = sorted(self._entries())
+        total_size = sum(entry[1] for entry in entries)
+        for last_use, entry_size, fpaths in entries:
+            if total_size <= self.max_size:
+                break
+            for fpath in fpaths:
+                os.remove(fpath)
+            total_size -= entry_size
+
+    def clear(self):
+        """Removes all entries from the cache."""
+        for last_use, entry_size, fpaths in self._entries():
+            for fpath in fpaths:
+                os.remove(fpath)
+
+# The cache used by storage2numpy, TRCFile, and ANCFile; None if disabled.
+_parse_cache = None
+
+def enable_parse_cache(cache_dir=None, max_size=2 * 1024**3,
+        check_hash=False):
+    """Cache the parsed contents of Storage, TRC, and ANC files on disk, so
+    that reading the same file again (in this session or a later one) does
+    not require parsing it. See `ParseCache`.
+
+    Parameters
+    ----------
+    cache_dir : str, optional
+        Directory in which to store the cache. By default, we use
+        '~/.perimysium_cache'.
+    max_size : int, optional
+        Maximum total size of the cache, in bytes (default: 2 GiB).
+    check_hash : bool, optional (default: False)
+        See `ParseCache`.
+
+    Returns
+    -------
+    cache : ParseCache
+
+    """
+    global _parse_cache
+    if cache_dir == None:
+        cache_dir = os.path.join(os.path.expanduser('~'), '.perimysium_cache')
+    _parse_cache = ParseCache(cache_dir, max_size=max_size,
+            check_hash=check_hash)
+    return _parse_cache
+
+def disable_parse_cache():
+    """Stop using the parse cache. Its contents are left on disk."""
+    global _parse_cache
+    _parse_cache = None
+
+def clear_parse_cache():
+    """Removes all entries from the parse cache, if it is enabled."""
+    if _parse_cache is not None:
+        _parse_cache.clear()
+
+def _cached_parse(fpath, kind, parse, args=()):
+    """Calls `parse`, or loads its result from the parse cache if it is
+    enabled. See `ParseCache.load`.
+
+    """
+    if _parse_cache is None:
+        return parse()
+    return _parse_cache.load(fpath, kind, parse, args=args)
 
 class GaitLandmarks(object):
     def __init__(self,
@@ -100,6 +467,132 @@ class GaitLandmarks(object):
         return self.cycle_end - self.cycle_start
 
 
+class GaitCycleIndex(object):
+    """A table of gait cycles, one row per cycle, from many trials; usually
+    built by `postprocessing.index_gait_cycles`. The fields of each row are
+    'trial' (a name for the trial, e.g., the path to its GRF file), and the
+    attributes of a `GaitLandmarks`: 'primary_leg', 'cycle_start',
+    'cycle_end', 'left_strike', 'left_toeoff', 'right_strike', and
+    'right_toeoff'.
+
+    The table is saved as a '.npz' file, or as a table '/gait_cycles' in an
+    HDF5 ('.h5') file, so that the gait cycles can be used (e.g., with
+    `postprocessing.data_by_pgc`) without reading the GRF files again.
+
+    Examples
+    --------
+    >>> index = GaitCycleIndex('study_gait_cycles.npz')
+    >>> for gl in index.gait_landmarks(trial='subj01/walk2_grf.mot',
+    ...         primary_leg='right'):
+    ...     pgc, angle = data_by_pgc(time, knee_angle_r, gl, side='right')
+
+    """
+    landmark_names = ['cycle_start', 'cycle_end', 'left_strike',
+            'left_toeoff', 'right_strike', 'right_toeoff']
+
+    def __init__(self, fpath=None, data=None):
+        """
+        Parameters
+        ----------
+        fpath : str, optional
+            A '.npz' or '.h5' file written by `write()`.
+        data : numpy.ndarray, optional
+            Instead, the rows of the table; see `empty()`.
+
+        """
+        if fpath != None:
+            self.read(fpath)
+        elif data is not None:
+            self.data = data
+        else:
+            self.data = self.empty(0)
+
+    @classmethod
+    def empty(cls, n_cycles, trial_name_length=1):
+        """A structured ndarray for the rows of `n_cycles` gait cycles."""
+        return np.empty(n_cycles, dtype=[('trial', 'S%i' % trial_name_length),
+            ('primary_leg', 'S5')] +
+            [(name, 'f8') for name in cls.landmark_names])
+
+    @classmethod
+    def concatenate(cls, datas):
+        """The rows of several tables (structured ndarrays) as one."""
+        length = max([1] + [data.dtype['trial'].itemsize for data in datas])
+        data = cls.empty(sum(len(d) for d in datas), length)
+        i = 0
+        for d in datas:
+            for name in d.dtype.names:
+                data[name][i:i + len(d)] = d[name]
+            i += len(d)
+        return data
+
+    def __len__(self):
+        return len(self.data)
+
+    def trials(self):
+        """The names of the trials, in order."""
+        return [trial for trial in collections.OrderedDict.fromkeys(
+            self.data['trial'])]
+
+    def select(self, trial=None, primary_leg=None):
+        """The rows for the given trial and/or primary leg (by default, all
+        rows).
+
+        """
+        mask = np.ones(len(self.data), dtype=bool)
+        if trial != None:
+            mask &= self.data['trial'] == trial
+        if primary_leg != None:
+            mask &= self.data['primary_leg'] == primary_leg
+        return self.data[mask]
+
+    def gait_landmarks(self, trial=None, primary_leg=None):
+        """A `GaitLandmarks` for each of the rows given by `select()`."""
+        return [GaitLandmarks(primary_leg=row['primary_leg'],
+            **dict((name, row[name]) for name in self.landmark_names))
+            for row in self.select(trial, primary_leg)]
+
+    def read(self, fpath):
+        """Loads the table from a file written by `write()`."""
+        if os.path.splitext(fpath)[1].lower() == '.npz':
+            npz = np.load(fpath)
+            try:
+                data = self.empty(len(npz['trial']),
+                        max(1, npz['trial'].dtype.itemsize))
+                for name in data.dtype.names:
+                    data[name] = npz[name]
+            finally:
+                npz.close()
+        else:
+            h5file = tables.open_file(fpath, mode='r')
+            try:
+                data = h5file.root.gait_cycles.read()
+            finally:
+                h5file.close()
+        self.data = data
+
+    def write(self, fpath):
+        """Saves the table to `fpath`: a '.npz' file (one array per field) or,
+        for other extensions, an HDF5 file with the table '/gait_cycles'
+        (replacing any existing table of that name).
+
+        """
+        if os.path.splitext(fpath)[1].lower() == '.npz':
+            tmp_fpath = fpath + '.tmp%i.npz' % os.getpid()
+            np.savez(tmp_fpath, **dict((name, self.data[name])
+                for name in self.data.dtype.names))
+            _rename_into_place(tmp_fpath, fpath)
+        else:
+            h5file = tables.open_file(fpath, mode='a')
+            try:
+                if '/gait_cycles' in h5file:
+                    h5file.remove_node('/gait_cycles')
+                h5file.create_table('/', 'gait_cycles', obj=self.data,
+                        title='Gait cycles')
+            finally:
+                h5file.close()
+
+
 class ANCFile(object):
     """A plain-text file format for storing analog data from Motion Analysis
     Realtime. They have a file extension '.anc'. The file extension '.anb' is
@@ -109,62 +602,160 @@ class ANCFile(object):
 
     This class is based off of similar code written by Amy Silder.
 
+    Binary (.anb) files are expected to have the same text header as .anc
+    files (through the 'Range' row), followed by the samples as
+    little-endian signed integers (16-bit if `bit_depth` is at most 16,
+    otherwise 32-bit), one row of `num_channels` samples per time step, and
+    no time column; the time is computed from `precise_rate`. `anc2anb`
+    writes such files. The samples are memory-mapped rather than parsed.
+
     """
-    def __init__(self, fpath):
+    def __init__(self, fpath, min_time=None, max_time=None, volts=False):
         """
         Parameters
         ----------
         fpath : str
-            Valid file path to an ANC (.anc) file.
+            Valid file path to an ANC (.anc) or ANB (.anb) file.
+        min_time, max_time : float, optional
+            Only load rows with min_time <= time <= max_time. Parsing starts
+            near `min_time` and stops after `max_time`.
+        volts : bool, optional (default: False)
+            Convert the data from raw A/D counts to volts; see `to_volts()`.
 
         """
-        with open(fpath) as f:
-            line1 = f.readline()
-            line1list = line1.split('\t')
-            self.file_type = line1list[1].strip()
-            self.generation = line1list[3].strip()
-
-            line2 = f.readline()
-            line2list = line2.split('\t')
-            self.board_type = line2list[1].strip()
-            self.polarity = line2list[3].strip()
-
-            line3 = f.readline()
-            line3list = line3.split('\t')
-            self.trial_name = line3list[1]
-            self.trial_num = int(line3list[3])
-            self.duration = float(line3list[5])
-            self.num_channels = int(line3list[7])
-
-            line4 = f.readline()
-            line4list = line4.split('\t')
-            self.bit_depth = int(line4list[1])
-            self.precise_rate = float(line4list[3])
+        if os.path.splitext(fpath)[1].lower() == '.anb':
+            self.data, meta = self._read_anb(fpath, min_time, max_time)
+        else:
+            self.data, meta = _cached_parse(fpath, 'anc',
+                    lambda: self._parse(fpath, min_time, max_time),
+                    args=(min_time, max_time))
+        for k, v in meta.items():
+            setattr(self, k, v)
+        self.time = self.data['time']
+        self.units = 'counts'
+        if volts:
+            self.to_volts()
+
+    @staticmethod
+    def _parse_header(f):
+        """Reads the header of an ANC/ANB file from `f`, through the 'Range'
+        row, and returns the metadata and the dtype of the data.
 
+        """
+        meta = dict()
+        line1 = f.readline()
+        line1list = line1.split('\t')
+        meta['file_type'] = line1list[1].strip()
+        meta['generation'] = line1list[3].strip()
+
+        line2 = f.readline()
+        line2list = line2.split('\t')
+        meta['board_type'] = line2list[1].strip()
+        meta['polarity'] = line2list[3].strip()
+
+        line3 = f.readline()
+        line3list = line3.split('\t')
+        meta['trial_name'] = line3list[1]
+        meta['trial_num'] = int(line3list[3])
+        meta['duration'] = float(line3list[5])
+        meta['num_channels'] = int(line3list[7])
+
+        line4 = f.readline()
+        line4list = line4.split('\t')
+        meta['bit_depth'] = int(line4list[1])
+        meta['precise_rate'] = float(line4list[3])
+
+        line = f.readline()
+        while line.strip() == '':
+            # There will most likely be a few empty lines.
             line = f.readline()
-            iline = 5
-            while line.strip() == '':
-                # There will most likely be a few empty lines.
-                line = f.readline()
-                iline += 1
-
-            # Metadata for each column.
-            header_row = line
-            self.names = header_row.split()[1:]
-            rate_row = f.readline()
-            iline += 1
-            self.rates = {self.names[i]: float(v) for i, v in
-                    enumerate(rate_row.split()[1:])}
-            range_row = f.readline()
-            iline += 1
-            self.ranges = {self.names[i]: float(v) for i, v in
-                    enumerate(range_row.split()[1:])}
-
-        dtype = {'names': ['time'] + self.names,
-                'formats': (len(self.names) + 1) * ['float64']}
-        self.data = np.loadtxt(fpath, delimiter='\t', skiprows=iline,
-                    dtype=dtype)
-        self.time = self.data['time']
+
+        # Metadata for each column.
+        header_row = line
+        names = header_row.split()[1:]
+        meta['names'] = names
+        rate_row = f.readline()
+        meta['rates'] = {names[i]: float(v) for i, v in
+                enumerate(rate_row.split()[1:])}
+        range_row = f.readline()
+        meta['ranges'] = {names[i]: float(v) for i, v in
+                enumerate(range_row.split()[1:])}
+
+        dtype = {'names': ['time'] + names,
+                'formats': (len(names) + 1) * ['float64']}
+        return meta, dtype
+
+    @staticmethod
+    def _parse(fpath, min_time=None, max_time=None):
+        """Returns the data as a structured ndarray, and a dict of the header
+        entries (metadata), for the ANC file `fpath`.
+
+        """
+        with open(fpath) as f:
+            meta, dtype = ANCFile._parse_header(f)
+            names = dtype['names']
+            if min_time is not None or max_time is not None:
+                # Time is the 1st column.
+                monotonic = _seek_time(f, fpath, f.tell(), 0, min_time)
+                data = _concatenate_chunks(_time_window_chunks(
+                    (_parse_analog_rows(lines, names, dtype)
+                        for lines in _line_chunks(f, 10000)),
+                    min_time, max_time, monotonic), dtype)
+                return data, meta
+
+            # Tokenize the rest of the file in bulk.
+            data_start = f.tell()
+            data = _parse_storage_data(f.read(), names)
+
+        if data is None:
+            with open(fpath) as f:
+                f.seek(data_start)
+                data = np.loadtxt(f, delimiter='\t', dtype=dtype, ndmin=1)
+        return data, meta
+
+    @staticmethod
+    def _read_anb(fpath, min_time=None, max_time=None):
+        """Returns the data as a structured ndarray, and a dict of the header
+        entries (metadata), for the ANB file `fpath`.
+
+        """
+        with open(fpath, 'rb') as f:
+            meta, dtype = ANCFile._parse_header(f)
+            data_start = f.tell()
+        n_channels = len(meta['names'])
+        sample_dtype, n_rows = _anb_layout(fpath, meta, data_start)
+        if n_rows == 0:
+            # An empty file can't be memory-mapped.
+            counts = np.zeros((0, n_channels), dtype=sample_dtype)
+        else:
+            counts = np.memmap(fpath, dtype=sample_dtype, mode='r',
+                    offset=data_start, shape=(n_rows, n_channels))
+        time = np.arange(len(counts)) / meta['precise_rate']
+        if min_time is not None or max_time is not None:
+            window = _time_window_slice(time, min_time, max_time)
+            time = time[window]
+            counts = counts[window]
+
+        data = np.empty(len(counts), dtype=dtype)
+        # All fields are float64, so data can be filled as a 2-D array.
+        table = data.view(np.float64).reshape(len(data), n_channels + 1)
+        table[:, 0] = time
+        table[:, 1:] = counts
+        return data, meta
+
+    def to_volts(self):
+        """Converts the data (except time) from raw A/D counts to volts, in
+        place. A channel's range (`ranges`, in millivolts) is the voltage of
+        a full-scale count, 2**(bit_depth - 1). Does nothing if the data is
+        already in volts.
+
+        """
+        if self.units == 'volts':
+            return
+        scale = _anc_volts_scale(self.__dict__)
+        table = self.data.view(np.float64).reshape(len(self.data), -1)
+        table[:, 1:] *= scale
+        self.units = 'volts'
 
     def __getitem__(self, name):
         """See `column()`.
@@ -196,6 +787,122 @@ class ANCFile(object):
 
 
 
+def _anb_sample_dtype(bit_depth):
+    return '<i2' if bit_depth <= 16 else '<i4'
+
+def _anb_layout(fpath, meta, data_start):
+    """The sample dtype and number of rows of the ANB file `fpath`, whose
+    samples start at byte `data_start`. Raises an exception if the samples
+    do not form whole rows, which means the file is truncated or not laid
+    out as `ANCFile` expects.
+
+    """
+    sample_dtype = np.dtype(_anb_sample_dtype(meta['bit_depth']))
+    row_bytes = len(meta['names']) * sample_dtype.itemsize
+    n_bytes = os.path.getsize(fpath) - data_start
+    if n_bytes % row_bytes != 0:
+        raise Exception("The data in ANB file %s (%i bytes) is not a whole "
+                "number of rows of %i channels of %i-byte samples; the file "
+                "is truncated or has an unexpected layout." % (fpath,
+                    n_bytes, len(meta['names']), sample_dtype.itemsize))
+    return sample_dtype, n_bytes // row_bytes
+
+def _anc_volts_scale(meta):
+    """Volts per A/D count for each channel; see `ANCFile.to_volts()`."""
+    return np.array([meta['ranges'][name] for name in meta['names']]) * (
+            0.001 / 2**(meta['bit_depth'] - 1))
+
+def anc2numpy_chunks(fpath, chunk_rows=1000, volts=False):
+    """Reads an ANC (or ANB; see `ANCFile`) file one block of rows at a time,
+    e.g., to process a long recording (or one that is still being written)
+    without holding all of it in memory. This is a generator; each block is
+    a structured ndarray with the same fields as `ANCFile.data`.
+
+    Blocks are read until the end of the file, including rows appended while
+    reading. For an ANB file, only whole rows are read: a last row that is
+    only partly written is left unread (unlike `ANCFile`, which raises). An
+    ANC file is read line by line, so its last line must be complete.
+
+    Parameters
+    ----------
+    fpath : str
+        Valid file path to an ANC (.anc) or ANB (.anb) file.
+    chunk_rows : int, optional
+        Number of rows in each block (the last block may have fewer).
+    volts : bool, optional (default: False)
+        Convert the data from raw A/D counts to volts; see
+        `ANCFile.to_volts()`.
+
+    """
+    binary = os.path.splitext(fpath)[1].lower() == '.anb'
+    with open(fpath, 'rb' if binary else 'r') as f:
+        meta, dtype = ANCFile._parse_header(f)
+        names = dtype['names']
+        n_channels = len(meta['names'])
+        scale = _anc_volts_scale(meta) if volts else None
+        if binary:
+            sample_dtype = np.dtype(_anb_sample_dtype(meta['bit_depth']))
+            row_bytes = n_channels * sample_dtype.itemsize
+            irow = 0
+            while True:
+                buf = f.read(chunk_rows * row_bytes)
+                n_rows = len(buf) // row_bytes
+                if n_rows == 0:
+                    break
+                if len(buf) != n_rows * row_bytes:
+                    # The writer is partway through a row; leave it unread.
+                    f.seek(n_rows * row_bytes - len(buf), os.SEEK_CUR)
+                counts = np.frombuffer(buf[:n_rows * row_bytes],
+                        dtype=sample_dtype)
+                chunk = np.empty(n_rows, dtype=dtype)
+                table = chunk.view(np.float64).reshape(n_rows, -1)
+                table[:, 0] = (irow + np.arange(n_rows)) / meta['precise_rate']
+                table[:, 1:] = counts.reshape(n_rows, n_channels)
+                if scale is not None:
+                    table[:, 1:] *= scale
+                irow += n_rows
+                yield chunk
+                if n_rows < chunk_rows:
+                    break
+        else:
+            for lines in _line_chunks(f, chunk_rows):
+                chunk = _parse_analog_rows(lines, names, dtype)
+                if scale is not None:
+                    chunk.view(np.float64).reshape(len(chunk), -1)[:, 1:] *= \
+                            scale
+                yield chunk
+
+def anc2anb(anc_fpath, anb_fpath=None):
+    """Converts an ANC file to a binary ANB file (see `ANCFile`), which loads
+    much faster. The ANC data must be raw A/D counts.
+
+    Parameters
+    ----------
+    anc_fpath : str
+        Valid file path to an ANC (.anc) file.
+    anb_fpath : str, optional
+        Path of the ANB file to create. By default, `anc_fpath` with the
+        extension '.anb'.
+
+    Returns
+    -------
+    anb_fpath : str
+
+    """
+    if anb_fpath == None:
+        anb_fpath = os.path.splitext(anc_fpath)[0] + '.anb'
+    anc = ANCFile(anc_fpath)
+    with open(anc_fpath, 'rb') as f:
+        ANCFile._parse_header(f)
+        header_size = f.tell()
+        f.seek(0)
+        header = f.read(header_size)
+    counts = anc.data.view(np.float64).reshape(len(anc.data), -1)[:, 1:]
+    with open(anb_fpath, 'wb') as f:
+        f.write(header)
+        np.round(counts).astype(_anb_sample_dtype(anc.bit_depth)).tofile(f)
+    return anb_fpath
+
 class TRCFile(object):
     """A plain-text file format for storing motion capture marker trajectories.
     TRC stands for Track Row Column.
@@ -206,8 +913,15 @@ class TRCFile(object):
     http://simtk-confluence.stanford.edu:8080/display/OpenSim/Marker+(.trc)+Files
     for more information.
 
+    For very large files, use `mmap=True`. The TRC file is then converted once
+    (see `trc2binary`) into a binary file that is memory-mapped, so that only
+    the parts of the file that are used are read from disk. In this mode,
+    `marker()` returns views rather than copies, and `markers` is a
+    num_frames x num_markers x 3 view of all the marker data.
+
     """
-    def __init__(self, fpath=None, **kwargs):
+    def __init__(self, fpath=None, mmap=False, min_time=None, max_time=None,
+            **kwargs):
             #path=None,
             #data_rate=None,
             #camera_rate=None,
@@ -225,16 +939,91 @@ class TRCFile(object):
         ----------
         fpath : str
             Valid file path to a TRC (.trc) file.
+        mmap : bool or str, optional
+            Memory-map the data; see `read_from_file`.
+        min_time, max_time : float, optional
+            Only load frames in this time window; see `read_from_file`.
 
         """
         self.marker_names = []
+        self.mmap = False
         if fpath != None:
-            self.read_from_file(fpath)
+            self.read_from_file(fpath, mmap=mmap, min_time=min_time,
+                    max_time=max_time)
         else:
             for k, v in kwargs.items():
                 setattr(self, k, v)
 
-    def read_from_file(self, fpath):
+    def read_from_file(self, fpath, mmap=False, min_time=None,
+            max_time=None):
+        """
+        Parameters
+        ----------
+        fpath : str
+            Valid file path to a TRC (.trc) file.
+        mmap : bool or str, optional
+            If True, memory-map the binary file `fpath + '.npy'`, which is
+            created with `trc2binary` if it does not exist or is older than
+            `fpath`. If a str, it is the path to use for the binary file.
+            Changes to `data` are then not written to the binary file.
+        min_time, max_time : float, optional
+            Only load frames with min_time <= time <= max_time; `num_frames`
+            is the number of frames in this window. Parsing starts near
+            `min_time` and stops after `max_time`.
+
+        """
+        if mmap:
+            binary_fpath = fpath + '.npy' if mmap is True else mmap
+            if (not os.path.exists(_trc_binary_meta_fpath(binary_fpath)) or
+                    os.path.getmtime(_trc_binary_meta_fpath(binary_fpath)) <
+                    os.path.getmtime(fpath)):
+                trc2binary(fpath, binary_fpath)
+            self.data = np.load(binary_fpath, mmap_mode='c')
+            with open(_trc_binary_meta_fpath(binary_fpath), 'rb') as f:
+                meta = pickle.load(f)
+            if min_time is not None or max_time is not None:
+                # A slice of a memmap is still a memmap.
+                window = _time_window_slice(meta['time'], min_time, max_time)
+                self.data = self.data[window]
+                meta['time'] = meta['time'][window]
+                meta['num_frames'] = len(meta['time'])
+        else:
+            self.data, meta = _cached_parse(fpath, 'trc',
+                    lambda: self._parse(fpath, min_time, max_time),
+                    args=(min_time, max_time))
+        for k, v in meta.items():
+            setattr(self, k, v)
+        self.mmap = bool(mmap)
+        if not self.mmap:
+            self.time = self.data['time']
+
+    @property
+    def markers(self):
+        """All marker data, as a num_frames x num_markers x 3 view of `data`,
+        or None if `data` is not memory-mapped.
+
+        """
+        if not self.mmap:
+            return None
+        # All fields (including frame_num) are 8 bytes, so each row of data
+        # is [frame_num, time, x0, y0, z0, x1, ...].
+        n_frames = len(self.data)
+        flat = self.data.view(np.float64).reshape(n_frames, -1)
+        return flat[:, 2:].reshape(n_frames, -1, 3)
+
+    def _marker_index(self, name):
+        if getattr(self, '_marker_indices', None) is None or len(
+                self._marker_indices) != len(self.marker_names):
+            self._marker_indices = dict((mname, i)
+                    for i, mname in enumerate(self.marker_names))
+        return self._marker_indices[name]
+
+    @staticmethod
+    def _parse_header(fpath):
+        """Returns a dict of the header entries (metadata) of the TRC file
+        `fpath`, and the dtype for its data.
+
+        """
         # Read the header lines / metadata.
         # ---------------------------------
         # Split by any whitespace.
@@ -248,54 +1037,84 @@ class TRCFile(object):
         fourth_line = f.readline().split()
         f.close()
 
+        meta = dict()
+
         # First line.
         if len(first_line) > 3:
-            self.path = first_line[3]
+            meta['path'] = first_line[3]
         else:
-            self.path = ''
+            meta['path'] = ''
 
         # Third line.
-        self.data_rate = float(third_line[0])
-        self.camera_rate = float(third_line[1])
-        self.num_frames = int(third_line[2])
-        self.num_markers = int(third_line[3])
-        self.units = third_line[4]
-        self.orig_data_rate = float(third_line[5])
-        self.orig_data_start_frame = int(third_line[6])
-        self.orig_num_frames = int(third_line[7])
+        meta['data_rate'] = float(third_line[0])
+        meta['camera_rate'] = float(third_line[1])
+        meta['num_frames'] = int(third_line[2])
+        meta['num_markers'] = int(third_line[3])
+        meta['units'] = third_line[4]
+        meta['orig_data_rate'] = float(third_line[5])
+        meta['orig_data_start_frame'] = int(third_line[6])
+        meta['orig_num_frames'] = int(third_line[7])
 
         # Marker names.
         # The first and second column names are 'Frame#' and 'Time'.
-        self.marker_names = fourth_line[2:]
+        meta['marker_names'] = fourth_line[2:]
 
-        len_marker_names = len(self.marker_names)
-        if len_marker_names != self.num_markers:
+        len_marker_names = len(meta['marker_names'])
+        if len_marker_names != meta['num_markers']:
             warnings.warn('Header entry NumMarkers, %i, does not '
                     'match actual number of markers, %i. Changing '
                     'NumMarkers to match actual number.' % (
-                        self.num_markers, len_marker_names))
-            self.num_markers = len_marker_names
+                        meta['num_markers'], len_marker_names))
+            meta['num_markers'] = len_marker_names
 
-        # Load the actual data.
-        # ---------------------
         col_names = ['frame_num', 'time']
         # This naming convention comes from OpenSim's Inverse Kinematics tool,
         # when it writes model marker locations.
-        for mark in self.marker_names:
+        for mark in meta['marker_names']:
             col_names += [mark + '_tx', mark + '_ty', mark + '_tz']
         dtype = {'names': col_names,
-                'formats': ['int'] + ['float64'] * (3 * self.num_markers + 1)}
-        self.data = np.loadtxt(fpath, delimiter='\t', skiprows=6, dtype=dtype)
-        self.time = self.data['time']
+                'formats': ['int'] + ['float64'] * (3 * meta['num_markers'] +
+                    1)}
+        return meta, dtype
 
-        # Check the number of rows.
-        n_rows = self.time.shape[0]
-        if n_rows != self.num_frames:
+    @staticmethod
+    def _check_num_frames(fpath, meta, n_rows):
+        if n_rows != meta['num_frames']:
             warnings.warn('%s: Header entry NumFrames, %i, does not '
                     'match actual number of frames, %i, Changing '
                     'NumFrames to match actual number.' % (fpath,
-                        self.num_frames, n_rows))
-            self.num_frames = n_rows
+                        meta['num_frames'], n_rows))
+            meta['num_frames'] = n_rows
+
+    @staticmethod
+    def _parse(fpath, min_time=None, max_time=None):
+        """Returns the data as a structured ndarray, and a dict of the header
+        entries (metadata), for the TRC file `fpath`.
+
+        """
+        meta, dtype = TRCFile._parse_header(fpath)
+
+        # Load the actual data.
+        # ---------------------
+        if min_time is None and max_time is None:
+            data = np.loadtxt(fpath, delimiter='\t', skiprows=6, dtype=dtype,
+                    ndmin=1)
+
+            # Check the number of rows.
+            TRCFile._check_num_frames(fpath, meta, data.shape[0])
+        else:
+            with open(fpath) as f:
+                for i in range(6):
+                    f.readline()
+                # Time is the 2nd column.
+                monotonic = _seek_time(f, fpath, f.tell(), 1, min_time)
+                data = _concatenate_chunks(_time_window_chunks(
+                    (np.loadtxt(lines, delimiter='\t', dtype=dtype, ndmin=1)
+                        for lines in _line_chunks(f, 10000)),
+                    min_time, max_time, monotonic), dtype)
+            meta['num_frames'] = len(data)
+
+        return data, meta
 
     def __getitem__(self, key):
         """See `marker()`.
@@ -305,9 +1124,12 @@ class TRCFile(object):
 
     def marker(self, name):
         """The trajectory of marker `name`, given as a `self.num_frames` x 3
-        array. The order of the columns is x, y, z.
+        array. The order of the columns is x, y, z. If the data is
+        memory-mapped, this is a view of `data`, not a copy.
 
         """
+        if self.mmap:
+            return self.markers[:, self._marker_index(name), :]
         this_dat = np.empty((self.num_frames, 3))
         this_dat[:, 0] = self.data[name + '_tx']
         this_dat[:, 1] = self.data[name + '_ty']
@@ -326,28 +1148,145 @@ class TRCFile(object):
             length.
 
         """
-        if (len(x) != self.num_frames or len(y) != self.num_frames or len(z) !=
-                self.num_frames):
-            raise Exception('Length of data (%i, %i, %i) is not '
-                    'NumFrames (%i).', len(x), len(y), len(z), self.num_frames)
-        self.marker_names += [name]
-        self.num_markers += 1
-        if not hasattr(self, 'data'):
-            self.data = np.array(x, dtype=[('%s_tx' % name, 'float64')])
-            self.data = append_fields(self.data,
-                    ['%s_t%s' % (name, s) for s in 'yz'],
-                    [y, z], usemask=False)
+        self.add_markers(collections.OrderedDict([(name, (x, y, z))]))
+
+    def add_markers(self, markers):
+        """Add several markers to the TRCFile at once. The data is
+        reallocated at most once. `data` has spare room for more markers,
+        which doubles whenever it runs out, so adding markers one at a time
+        (e.g., with `add_marker`) is also cheap.
+
+        Parameters
+        ----------
+        markers : dict
+            Keys are marker names, and values are the trajectories, either as
+            (x, y, z) or as a `num_frames` x 3 array. Use a
+            collections.OrderedDict to control the order of the markers.
+
+        """
+        fields = list()
+        columns = list()
+        for name, xyz in markers.items():
+            if isinstance(xyz, np.ndarray) and xyz.ndim == 2:
+                xyz = xyz.T
+            x, y, z = xyz
+            if (len(x) != self.num_frames or len(y) != self.num_frames or
+                    len(z) != self.num_frames):
+                raise Exception('Length of data (%i, %i, %i) for marker %s '
+                        'is not NumFrames (%i).' % (len(x), len(y), len(z),
+                            name, self.num_frames))
+            fields += ['%s_t%s' % (name, s) for s in 'xyz']
+            columns += [x, y, z]
+
+        self._extend_data(fields)
+        for field, column in zip(fields, columns):
+            self.data[field] = column
+
+        self.marker_names += list(markers.keys())
+        self.num_markers += len(markers)
+        # The data is no longer memory-mapped.
+        self.mmap = False
+
+    def _extend_data(self, fields):
+        """Appends float64 `fields` to `data`. `data` is a view of the first
+        bytes of each row of a larger buffer, so fields can be appended
+        without copying the existing ones until the buffer is full; then its
+        capacity is doubled.
+
+        """
+        # [buffer, number of bytes of each row in use]. Shallow copies of
+        # this object share the list, so only the one whose data ends where
+        # the buffer's used part ends may claim the spare room.
+        buf = getattr(self, '_data_buffer', None)
+        owned = (buf is not None and self.data.base is buf[0] and
+                buf[1] == self._data_used)
+        if getattr(self, 'data', None) is None:
+            names = list()
+            formats = list()
+            offsets = list()
+            n_used = 0
         else:
-            self.data = append_fields(self.data,
-                    ['%s_t%s' % (name, s) for s in 'xyz'],
-                    [x, y, z], usemask=False)
+            names = list(self.data.dtype.names)
+            formats = [self.data.dtype.fields[n][0] for n in names]
+            offsets = [self.data.dtype.fields[n][1] for n in names]
+            n_used = self._data_used if owned else self.data.dtype.itemsize
+        n_needed = n_used + 8 * len(fields)
+        if not owned or n_needed > buf[0].shape[1]:
+            buf = [np.empty((self.num_frames, max(n_needed, 2 * n_used)),
+                dtype=np.uint8), n_used]
+            old = np.ndarray(self.num_frames, dtype=np.dtype({'names': names,
+                'formats': formats, 'offsets': offsets,
+                'itemsize': buf[0].shape[1]}), buffer=buf[0])
+            for name in names:
+                old[name] = self.data[name]
+        offsets += [n_used + 8 * i for i in range(len(fields))]
+        self.data = np.ndarray(self.num_frames, dtype=np.dtype({
+            'names': names + fields,
+            'formats': formats + ['float64'] * len(fields),
+            'offsets': offsets, 'itemsize': buf[0].shape[1]}),
+            buffer=buf[0])
+        buf[1] = n_needed
+        self._data_buffer = buf
+        self._data_used = n_needed
 
     def marker_at(self, name, time):
+        """The location [x, y, z] of marker `name` at `time`, linearly
+        interpolated. If the data is memory-mapped, only the frames
+        surrounding `time` are read.
+
+        """
+        if self.mmap:
+            idx, weight = _interp_weights(self.time, time)
+            xyz = self.markers[:, self._marker_index(name), :]
+            weight = np.asarray(weight)[..., np.newaxis]
+            interped = (1 - weight) * xyz[idx - 1] + weight * xyz[idx]
+            # As with np.interp, a scalar `time` gives scalars, not 0-d
+            # arrays.
+            return [interped[..., i][()] for i in range(3)]
         x = np.interp(time, self.time, self.data[name + '_tx'])
         y = np.interp(time, self.time, self.data[name + '_ty'])
         z = np.interp(time, self.time, self.data[name + '_tz'])
         return [x, y, z]
 
+    def markers_at(self, names, times):
+        """The locations of several markers at several times, linearly
+        interpolated (with the same behavior as `marker_at`). The search for
+        `times` in the time column is done once, for all markers.
+
+        Parameters
+        ----------
+        names : list of str's
+            Names of markers.
+        times : array_like
+            Times at which to interpolate.
+
+        Returns
+        -------
+        locations : numpy.ndarray
+            Shape (n_times, n_markers, 3); the last axis is x, y, z.
+
+        """
+        times = np.atleast_1d(np.asarray(times, dtype=float))
+        idx, weight = _interp_weights(self.time, times)
+        weight = weight[:, np.newaxis, np.newaxis]
+        return ((1 - weight) * self._marker_rows(names, idx - 1) +
+                weight * self._marker_rows(names, idx))
+
+    def _marker_rows(self, names, rows):
+        """The locations of markers `names` at frames (indices) `rows`, as a
+        (len(rows), len(names), 3) array.
+
+        """
+        if self.mmap:
+            # Only touches the frames in `rows`.
+            imarkers = [self._marker_index(name) for name in names]
+            return self.markers[rows][:, imarkers, :]
+        locations = np.empty((len(rows), len(names), 3))
+        for imark, name in enumerate(names):
+            for idim, suffix in enumerate(['_tx', '_ty', '_tz']):
+                locations[:, imark, idim] = self.data[name + suffix][rows]
+        return locations
+
     def marker_exists(self, name):
         """
         Returns
@@ -358,13 +1297,18 @@ class TRCFile(object):
         """
         return name in self.marker_names
 
-    def write(self, fpath):
+    def write(self, fpath, time_fmt='%.5f', marker_fmt='%.3f'):
         """Write this TRCFile object to a TRC file.
 
         Parameters
         ----------
         fpath : str
             Valid file path to which this TRCFile is saved.
+        time_fmt : str, optional
+            Format of the time column.
+        marker_fmt : str or dict, optional
+            Format of the marker coordinates. A dict gives the format for
+            each marker name; markers not in the dict use '%.3f'.
 
         """
         f = open(fpath, 'w')
@@ -398,34 +1342,224 @@ class TRCFile(object):
         f.write('\n')
 
         # Data.
-        for iframe in range(self.num_frames):
-            f.write('%i' % (iframe + 1))
-            f.write('\t%.5f' % self.time[iframe])
-            for mark in self.marker_names:
-                idxs = [mark + '_tx', mark + '_ty', mark + '_tz']
-                f.write('\t%.3f\t%.3f\t%.3f' % tuple(
-                    self.data[coln][iframe] for coln in idxs))
-            f.write('\n')
+        columns = [np.arange(self.num_frames) + 1, self.time]
+        fmts = ['%i', time_fmt]
+        for mark in self.marker_names:
+            columns += [self.data[mark + '_tx'], self.data[mark + '_ty'],
+                    self.data[mark + '_tz']]
+            fmts += 3 * _column_formats([mark], marker_fmt, '%.3f')
+        _write_rows(f, columns, fmts)
 
         f.close()
 
-    def add_noise(self, noise_width):
+    def add_noise(self, noise_width, rng=None):
         """ add random noise to each component of the marker trajectory
             The noise mean will be zero, with the noise_width being the
-            standard deviation.
+            standard deviation. All the noise is drawn in one call.
+
+            noise_width : float, or dict
+                Standard deviation of the noise. A dict gives the standard
+                deviation for each marker name; markers not in the dict get
+                no noise.
+            rng : int, or random number generator, optional
+                A seed, or an object with a `normal(loc, scale, size)` method
+                (e.g., numpy.random.RandomState). By default, the global
+                numpy.random state is used.
+        """
+        rng = _random_generator(rng)
+        if isinstance(noise_width, dict):
+            widths = np.array([noise_width.get(name, 0.0)
+                for name in self.marker_names])
+        else:
+            widths = noise_width * np.ones(self.num_markers)
+        noise = rng.normal(0, 1, (self.num_markers, 3, self.num_frames))
+        noise *= widths[:, np.newaxis, np.newaxis]
+        components = ['_tx', '_ty', '_tz']
+        for imarker, name in enumerate(self.marker_names):
+            if widths[imarker] != 0:
+                for iComponent in range(3):
+                    # add noise to each component of marker data.
+                    self.data[name + components[iComponent]] += \
+                            noise[imarker, iComponent]
+
+    def noisy_copies(self, n, noise_width, rng=None):
+        """A generator of `n` copies of this TRCFile, each with different
+        noise added (see `add_noise`). The file is not read again.
+
+        Examples
+        --------
+        >>> trc = TRCFile('walk.trc')
+        >>> for i, noisy in enumerate(trc.noisy_copies(100, 2.0, rng=0)):
+        ...     noisy.write('walk_noisy%03i.trc' % i)
 
-            noise_width : int
         """
-        for imarker in range(self.num_markers):
-            components = ['_tx', '_ty', '_tz']
-            for iComponent in range(3):
-                # generate noise
-                noise = np.random.normal(0, noise_width, self.num_frames)
-                # add noise to each component of marker data.
-                self.data[self.marker_names[imarker] + components[iComponent]] += noise
+        rng = _random_generator(rng)
+        for i in range(n):
+            noisy = copy.copy(self)
+            # Copies the data into memory, even if memory-mapped.
+            noisy.data = np.array(self.data)
+            noisy.mmap = False
+            noisy.marker_names = list(self.marker_names)
+            if 'time' in noisy.data.dtype.names:
+                noisy.time = noisy.data['time']
+            noisy.add_noise(noise_width, rng=rng)
+            yield noisy
+
+
+def _random_generator(rng):
+    """The random number generator to use, given a seed, a generator, or
+    None (the global numpy.random state).
+
+    """
+    if rng is None:
+        return np.random
+    if isinstance(rng, (int, long, np.integer)):
+        if hasattr(np.random, 'default_rng'):
+            return np.random.default_rng(rng)
+        return np.random.RandomState(rng)
+    return rng
+
+def _trc_binary_meta_fpath(binary_fpath):
+    return os.path.splitext(binary_fpath)[0] + '.pkl'
+
+def trc2binary(trc_fpath, binary_fpath=None, chunk_rows=10000):
+    """Converts a TRC file into a binary file that `TRCFile` can memory-map
+    (see `TRCFile(fpath, mmap=True)`). The file is read `chunk_rows` rows at a
+    time, so the whole file is never in memory.
+
+    The binary file is a .npy file holding the same structured ndarray as
+    `TRCFile.data`, with 8-byte fields. The metadata is stored alongside it,
+    in a .pkl file with the same base name.
+
+    Parameters
+    ----------
+    trc_fpath : str
+        Valid file path to a TRC (.trc) file.
+    binary_fpath : str, optional
+        Path of the .npy file to create. By default, `trc_fpath + '.npy'`.
+    chunk_rows : int, optional
+        Number of rows to parse at a time.
+
+    Returns
+    -------
+    binary_fpath : str
+
+    """
+    if binary_fpath == None:
+        binary_fpath = trc_fpath + '.npy'
+    meta, dtype = TRCFile._parse_header(trc_fpath)
+    dtype = np.dtype(dtype)
+    if dtype.fields['frame_num'][0].itemsize != 8:
+        # e.g., on Windows, where 'int' is 32 bits.
+        dtype = np.dtype({'names': dtype.names,
+            'formats': ['int64'] + (len(dtype.names) - 1) * ['float64']})
+
+    tmp_suffix = '.tmp%i' % os.getpid()
+    raw_fpath = binary_fpath + '.raw' + tmp_suffix
+    n_rows = 0
+    times = list()
+    f = open(trc_fpath)
+    raw = open(raw_fpath, 'wb')
+    try:
+        for i in range(6):
+            f.readline()
+        for lines in _line_chunks(f, chunk_rows):
+            chunk = np.loadtxt(lines, delimiter='\t', dtype=dtype, ndmin=1)
+            chunk.tofile(raw)
+            times.append(chunk['time'])
+            n_rows += len(chunk)
+    finally:
+        f.close()
+        raw.close()
+    TRCFile._check_num_frames(trc_fpath, meta, n_rows)
+    meta['time'] = (np.concatenate(times) if len(times) > 0 else
+            np.zeros(0))
+
+    # Prepend the .npy header to the raw data.
+    try:
+        with open(binary_fpath + tmp_suffix, 'wb') as out:
+            np.lib.format.write_array_header_1_0(out, {
+                'descr': np.lib.format.dtype_to_descr(dtype),
+                'fortran_order': False, 'shape': (n_rows,)})
+            with open(raw_fpath, 'rb') as raw:
+                shutil.copyfileobj(raw, out, 2**20)
+    finally:
+        os.remove(raw_fpath)
+    meta_fpath = _trc_binary_meta_fpath(binary_fpath)
+    with open(meta_fpath + tmp_suffix, 'wb') as f:
+        pickle.dump(meta, f, 2)
+    # The metadata file is renamed last; if it is up to date, so is the data.
+    _rename_into_place(binary_fpath + tmp_suffix, binary_fpath)
+    _rename_into_place(meta_fpath + tmp_suffix, meta_fpath)
+    return binary_fpath
+
+def _time_window_slice(time, min_time, max_time):
+    """Indexes the elements of the monotonic array `time` with
+    min_time <= time <= max_time.
+
+    """
+    start = 0 if min_time is None else np.searchsorted(time, min_time, 'left')
+    stop = (len(time) if max_time is None else
+            np.searchsorted(time, max_time, 'right'))
+    return slice(start, stop)
+
+def _interp_weights(x, x_new):
+    """Indices and weights for linearly interpolating data sampled at `x`
+    onto `x_new`: `(1 - weight) * y[idx - 1] + weight * y[idx]`. Like
+    `np.interp`, `x_new` outside `x` gets the first or last value.
+
+    """
+    if len(x) == 1:
+        # All of x_new gets the only sample; idx - 1 is -1, which is also
+        # that sample.
+        return (np.zeros(np.shape(x_new), dtype=int),
+                np.ones(np.shape(x_new)))
+    idx = np.clip(np.searchsorted(x, x_new, side='right'), 1, len(x) - 1)
+    x0 = x[idx - 1]
+    dx = x[idx] - x0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        weight = np.where(dx > 0, (x_new - x0) / dx, 1.0)
+    return idx, np.clip(weight, 0.0, 1.0)
+
+def _column_formats(names, fmt, default):
+    """The format string for each column in `names`. `fmt` is either a format
+    string for all columns, or a dict of formats by column name, in which
+    case columns that are not in the dict get `default`.
+
+    """
+    if isinstance(fmt, dict):
+        return [fmt.get(name, default) for name in names]
+    return len(names) * [fmt]
+
+def _write_rows(f, columns, fmts, chunk_rows=10000):
+    """Writes columns of numbers to `f` as tab-delimited rows. Rather than
+    formatting one number at a time, a whole chunk of rows is formatted with
+    a single '%' operation.
 
+    Parameters
+    ----------
+    f : file
+    columns : list of array_like
+        The data for each column. All must have the same length.
+    fmts : list of str's
+        The format (e.g., '%f') of each column.
+    chunk_rows : int, optional
+        Number of rows to format at a time. This bounds the memory used.
 
-def ndarray2storage(ndarray, storage_fpath, name=None, in_degrees=False):
+    """
+    if len(columns) == 0:
+        return
+    row_fmt = '\t'.join(fmts) + '\n'
+    n_rows = len(columns[0])
+    for start in range(0, n_rows, chunk_rows):
+        stop = min(start + chunk_rows, n_rows)
+        block = np.empty((stop - start, len(columns)))
+        for icol, column in enumerate(columns):
+            block[:, icol] = column[start:stop]
+        f.write((row_fmt * (stop - start)) % tuple(block.ravel().tolist()))
+
+def ndarray2storage(ndarray, storage_fpath, name=None, in_degrees=False,
+        fmt='%f'):
     """Saves an ndarray, with named dtypes, to an OpenSim Storage file.
 
     Parameters
@@ -435,6 +1569,9 @@ def ndarray2storage(ndarray, storage_fpath, name=None, in_degrees=False):
     in_degrees : bool, optional
     name : str
         Name of Storage object.
+    fmt : str or dict, optional
+        Format of the numbers. A dict gives the format for each column name;
+        columns not in the dict use '%f'.
 
     """
     n_rows = ndarray.shape[0]
@@ -453,16 +1590,13 @@ def ndarray2storage(ndarray, storage_fpath, name=None, in_degrees=False):
         f.write('%s' % col)
     f.write('\n')
 
-    for i_row in range(n_rows):
-        for line_num, col in enumerate(ndarray.dtype.names):
-            if line_num != 0:
-                f.write('\t')
-            f.write('%f' % ndarray[col][i_row])
-        f.write('\n')
+    _write_rows(f, [ndarray[col] for col in ndarray.dtype.names],
+            _column_formats(ndarray.dtype.names, fmt, '%f'))
 
     f.close()
 
-def dict2storage(data, storage_fpath, name=None, in_degrees=False):
+def dict2storage(data, storage_fpath, name=None, in_degrees=False,
+        fmt='%f'):
     """Saves an ndarray, with named dtypes, to an OpenSim Storage file.
 
     Parameters
@@ -472,6 +1606,9 @@ def dict2storage(data, storage_fpath, name=None, in_degrees=False):
     in_degrees : bool, optional
     name : str
         Name of Storage object.
+    fmt : str or dict, optional
+        Format of the numbers. A dict gives the format for each column name;
+        columns not in the dict use '%f'.
 
     """
     n_rows = len(data.values()[0])
@@ -490,76 +1627,235 @@ def dict2storage(data, storage_fpath, name=None, in_degrees=False):
         f.write('%s' % col)
     f.write('\n')
 
-    for i_row in range(n_rows):
-        for line_num, col in enumerate(data.keys()):
-            if line_num != 0:
-                f.write('\t')
-            f.write('%f' % data[col][i_row])
-        f.write('\n')
+    _write_rows(f, [data[col] for col in data.keys()],
+            _column_formats(data.keys(), fmt, '%f'))
 
     f.close()
 
 
-def Storage(object):
+class Storage(object):
     """Can deserialize a storage file and provides a method to interpolate the
     data in the storage file.
 
+    The file is parsed once. Interpolating several columns at the same times
+    shares one search of the time column, and the most recent search is
+    cached, so that per-frame code that queries many columns at one time
+    does only one search. Spline and PCHIP interpolants are built on first
+    use, and the `cache_size` most recently used ones are kept.
+
+    Examples
+    --------
+    >>> sto = Storage('states.sto')
+    >>> sto.interpolate('knee_angle_r', 0.52)
+    >>> sto.interpolate(['knee_angle_r', 'hip_flexion_r'], [0.52, 0.53])
+    >>> sto.interpolate('knee_angle_r', 0.52, kind='pchip')
+
     """
 
-    def __init__(self, storage_file):
+    def __init__(self, storage_file, cache_size=32, **kwargs):
         """
 
         Parameters
         ----------
         storage_file : str
             The .STO file to load.
+        cache_size : int, optional
+            Number of spline/PCHIP interpolants to keep.
+        **kwargs : optional
+            Passed onto `storage2numpy` (e.g., 'usecols', 'min_time').
 
         """
-        self.data = storage2numpy(storage_file)
+        self.data = storage2numpy(storage_file, **kwargs)
+        self.time = self.data['time']
+        self.cache_size = cache_size
+        self._interpolants = collections.OrderedDict()
+        self._last_search = None
 
-    def interpolate(self, column_name, time):
+    def interpolate(self, column_name, time, kind='linear'):
         """
         Parameters
         ----------
-        column_name : str
-            Name of a column in the storage file.
-        time : float
-            The time at which you'd like your data.
+        column_name : str, or list of str's
+            Name of a column in the storage file, or a list of names.
+        time : float, or array_like of float's
+            The time(s) at which you'd like your data.
+        kind : str, optional
+            'linear' (default), 'spline' (cubic), or 'pchip' (monotonic
+            cubic; requires scipy).
 
         Returns
         -------
-        y_value : float
-            The data interpolated at the time provided.
+        y_value : float, or numpy.ndarray
+            The data interpolated at the time provided. NaN outside the time
+            range of the file. If `column_name` is a list, this is a 2-D
+            array, (n_times, n_columns). Otherwise, it has the shape of
+            `time`.
+
+        """
+        if isinstance(column_name, basestring):
+            values = self.interpolate([column_name], time, kind=kind)[:, 0]
+            if np.ndim(time) == 0:
+                return values[0]
+            return values.reshape(np.shape(time))
+        times = np.atleast_1d(np.asarray(time, dtype=float))
+        values = np.empty((len(times), len(column_name)))
+        if kind == 'linear':
+            idx, weight = self._search(times)
+            for icol, name in enumerate(column_name):
+                col = self.data[name]
+                values[:, icol] = ((1 - weight) * col[idx - 1] +
+                        weight * col[idx])
+        else:
+            for icol, name in enumerate(column_name):
+                values[:, icol] = self._interpolant(name, kind)(times)
+        values[(times < self.time[0]) | (times > self.time[-1])] = np.nan
+        return values
+
+    def _search(self, times):
+        """`_interp_weights` for `times`, reusing the previous search if the
+        times are the same.
 
         """
-        return np.interp(time, self.data['time'], self.data[column_name],
-                left=np.nan, right=np.nan)
+        if (self._last_search is not None and
+                np.array_equal(self._last_search[0], times)):
+            return self._last_search[1]
+        result = _interp_weights(self.time, times)
+        self._last_search = (times.copy(), result)
+        return result
+
+    def _interpolant(self, column_name, kind):
+        """The (cached) spline or PCHIP interpolant of a column."""
+        key = (column_name, kind)
+        if key in self._interpolants:
+            # Mark as recently used.
+            interpolant = self._interpolants.pop(key)
+        else:
+            from scipy import interpolate
+            if kind == 'spline':
+                interpolant = interpolate.InterpolatedUnivariateSpline(
+                        self.time, self.data[column_name], k=3)
+            elif kind == 'pchip':
+                interpolant = interpolate.PchipInterpolator(self.time,
+                        self.data[column_name])
+            else:
+                raise Exception("Unrecognized kind '%s'; use 'linear', "
+                        "'spline', or 'pchip'." % kind)
+            while len(self._interpolants) >= self.cache_size:
+                self._interpolants.popitem(last=False)
+        self._interpolants[key] = interpolant
+        return interpolant
+
+# Characters that np.genfromtxt strips from column names. We strip the same
+# characters so that column names do not depend on which parser was used.
+_STORAGE_NAME_DELETECHARS = set("""~!@#$%^&*()-=+\|]}[{';: /?.>,<""")
+_STORAGE_NAME_EXCLUDELIST = ['return', 'file', 'print']
+
+def _validate_storage_column_names(names):
+    """Turns the entries of a Storage file's header row into valid field names
+    for a structured ndarray, following the same rules as `np.genfromtxt`
+    (e.g., 'R.Hip' becomes 'RHip', and duplicate names get a '_1' suffix).
 
-def storage2numpy(storage_file, excess_header_entries=0):
-    """Returns the data from a storage file in a numpy format. Skips all lines
-    up to and including the line that says 'endheader'.
+    Parameters
+    ----------
+    names : list of str's
+        Entries of the header row (the row after 'endheader').
+
+    Returns
+    -------
+    valid_names : list of str's
+
+    """
+    valid_names = list()
+    seen = dict()
+    n_empty = 0
+    for name in names:
+        name = ''.join([c for c in name.strip()
+            if c not in _STORAGE_NAME_DELETECHARS])
+        if name == '':
+            name = 'f%i' % n_empty
+            while name in names:
+                n_empty += 1
+                name = 'f%i' % n_empty
+            n_empty += 1
+        elif name in _STORAGE_NAME_EXCLUDELIST:
+            name += '_'
+        count = seen.get(name, 0)
+        if count > 0:
+            valid_names.append(name + '_%i' % count)
+        else:
+            valid_names.append(name)
+        seen[name] = count + 1
+    return valid_names
+
+def _read_storage_header(f):
+    """Reads the header of a Storage file, up to and including the row of
+    column names that follows 'endheader'. Afterwards, `f` is positioned at
+    the start of the numeric data.
 
     Parameters
     ----------
-    storage_file : str
-        Path to an OpenSim Storage (.sto) file.
+    f : file
+        A Storage file, opened for reading and positioned at its start.
 
     Returns
     -------
-    data : np.ndarry (or numpy structure array or something?)
-        Contains all columns from the storage file, indexable by column name.
-    excess_header_entries : int, optional
-        If the header row has more names in it than there are data columns.
-        We'll ignore this many header row entries from the end of the header
-        row. This argument allows for a hacky fix to an issue that arises from
-        Static Optimization '.sto' outputs.
+    header_lines : list of str's
+        Lines preceding 'endheader' (e.g., 'nRows=83581').
+    column_names : list of str's
+        The raw (unvalidated) entries of the column name row.
 
-    Examples
-    --------
-    Columns from the storage file can be obtained as follows:
+    """
+    header_lines = list()
+    for line in iter(f.readline, ''):
+        if line.count('endheader') != 0:
+            break
+        header_lines.append(line.rstrip('\r\n'))
+    else:
+        raise Exception("No 'endheader' line found in %s." % f.name)
+    column_names = f.readline().split()
+    return header_lines, column_names
 
-        >>> data = storage2numpy('<filename>')
-        >>> data['ground_force_vy']
+def _parse_storage_data(text, names):
+    """Parses the numeric block of a Storage file into a structured ndarray
+    with a float64 field for each name. The tokenizing is done in C by
+    `np.fromstring`, and the structured ndarray is a view on the result.
+
+    Parameters
+    ----------
+    text : str
+        Whitespace-delimited numbers; everything after the column name row.
+    names : list of str's
+        Valid field names, one per column of data.
+
+    Returns
+    -------
+    data : numpy.ndarray
+        Structured ndarray, or None if `text` does not form a complete
+        rectangular block (e.g., missing entries or comments). The caller
+        should then fall back to a more forgiving parser.
+
+    """
+    n_cols = len(names)
+    with warnings.catch_warnings():
+        # fromstring stops at the first token it cannot parse (with a
+        # DeprecationWarning in newer NumPy); we detect that below.
+        warnings.simplefilter('ignore', DeprecationWarning)
+        values = np.fromstring(text, dtype='float64', sep=' ')
+    if n_cols == 0 or values.size % n_cols != 0:
+        return None
+    # Make sure every row was parsed, and has n_cols entries.
+    text = text.strip()
+    n_rows = text.count('\n') + 1 if text else 0
+    if values.size != n_rows * n_cols:
+        return None
+    dtype = np.dtype([(name, 'float64') for name in names])
+    return values.view(dtype)
+
+def _storage2numpy_genfromtxt(storage_file, excess_header_entries=0):
+    """The original implementation of `storage2numpy`, which reads the file
+    twice and parses the data with `np.genfromtxt`. It tolerates missing
+    entries, and is used as a fallback when the fast parser can't handle the
+    file.
 
     """
     # What's the line number of the line containing 'endheader'?
@@ -587,6 +1883,432 @@ def storage2numpy(storage_file, excess_header_entries=0):
 
     return data
 
+def storage2numpy(storage_file, excess_header_entries=0, usecols=None,
+        min_time=None, max_time=None):
+    """Returns the data from a storage file in a numpy format. Skips all lines
+    up to and including the line that says 'endheader'.
+
+    The file is read only once: the header is read line by line, and the
+    remaining numeric block is tokenized in bulk by NumPy. If the numeric
+    block is not a complete table (e.g., has missing entries), we fall back to
+    `np.genfromtxt`. If `usecols` is given, the file is parsed in blocks of
+    rows, each row is split only up to the last requested column, and only
+    the requested fields are converted to numbers, so both time and memory
+    scale with the requested columns rather than the width of the file (see
+    `_parse_storage_fields`). If `min_time` or `max_time` is given, parsing
+    starts near `min_time` (see `_time_index`) and stops after `max_time`.
+
+    If the parse cache is enabled (see `enable_parse_cache()`), the parsed
+    data is loaded from the cache when the file hasn't changed.
+
+    Parameters
+    ----------
+    storage_file : str
+        Path to an OpenSim Storage (.sto) file.
+
+    Returns
+    -------
+    data : np.ndarry (or numpy structure array or something?)
+        Contains all columns from the storage file, indexable by column name.
+    excess_header_entries : int, optional
+        If the header row has more names in it than there are data columns.
+        We'll ignore this many header row entries from the end of the header
+        row. This argument allows for a hacky fix to an issue that arises from
+        Static Optimization '.sto' outputs.
+    usecols : list of str's, optional
+        Only keep these columns. Each entry is a column name or, if no column
+        has that name, a regular expression that must match entire column
+        names (e.g., '.*_force_vy'). Columns are kept in the order they
+        appear in the file.
+    min_time, max_time : float, optional
+        Only keep rows with min_time <= time <= max_time. Parsing stops after
+        `max_time` if the time column is monotonic.
+
+    Examples
+    --------
+    Columns from the storage file can be obtained as follows:
+
+        >>> data = storage2numpy('<filename>')
+        >>> data['ground_force_vy']
+
+    If only some columns are needed:
+
+        >>> data = storage2numpy('<filename>', usecols=['time', '.*_vy'])
+
+    Or only one gait cycle:
+
+        >>> data = storage2numpy('<filename>', min_time=gl.cycle_start,
+        ...         max_time=gl.cycle_end)
+
+    """
+    if usecols is not None:
+        usecols = tuple(usecols)
+    return _cached_parse(storage_file, 'storage',
+            lambda: (_storage2numpy(storage_file, excess_header_entries,
+                usecols, min_time, max_time), None),
+            args=(excess_header_entries, usecols, min_time, max_time))[0]
+
+def _resolve_storage_columns(names, usecols, fpath=''):
+    """The entries of `names` (valid column names) requested by `usecols` (see
+    `storage2numpy`), in the order of `names`.
+
+    """
+    selected = set()
+    for col in usecols:
+        if col in names:
+            selected.add(col)
+            continue
+        pattern = re.compile(col + '$')
+        matches = [name for name in names if pattern.match(name)]
+        if len(matches) == 0:
+            raise Exception("No column in %s matches '%s'." % (fpath, col))
+        selected.update(matches)
+    return [name for name in names if name in selected]
+
+def _storage2numpy(storage_file, excess_header_entries=0, usecols=None,
+        min_time=None, max_time=None):
+    """Parses a Storage file; see `storage2numpy`."""
+    if usecols is not None or min_time is not None or max_time is not None:
+        return _concatenate_chunks(storage2numpy_chunks(storage_file,
+            usecols=usecols, excess_header_entries=excess_header_entries,
+            min_time=min_time, max_time=max_time),
+            _storage_dtype(storage_file, excess_header_entries, usecols))
+
+    with open(storage_file, 'r') as f:
+        _, column_names = _read_storage_header(f)
+        if excess_header_entries != 0:
+            column_names = column_names[:-excess_header_entries]
+        names = _validate_storage_column_names(column_names)
+        text = f.read()
+
+    data = _parse_storage_data(text, names)
+    if data is None:
+        return _storage2numpy_genfromtxt(storage_file,
+                excess_header_entries=excess_header_entries)
+    return data
+
+def _storage_dtype(storage_file, excess_header_entries=0, usecols=None):
+    """The dtype of the data from `storage2numpy`, without parsing the
+    data.
+
+    """
+    with open(storage_file, 'r') as f:
+        _, column_names = _read_storage_header(f)
+    if excess_header_entries != 0:
+        column_names = column_names[:-excess_header_entries]
+    names = _validate_storage_column_names(column_names)
+    if usecols is not None:
+        names = _resolve_storage_columns(names, usecols, storage_file)
+    return np.dtype([(name, 'float64') for name in names])
+
+def storage2numpy_chunks(storage_file, chunk_rows=10000, time_step=None,
+        usecols=None, excess_header_entries=0, min_time=None,
+        max_time=None):
+    """Reads a Storage file one block of rows at a time, for files that are
+    too big to hold in memory. This is a generator; each block is a
+    structured ndarray with a float64 field for each column (the same fields
+    as `storage2numpy`), so blocks can be passed to np.concatenate.
+
+    Parameters
+    ----------
+    storage_file : str
+        Path to an OpenSim Storage (.sto) file.
+    chunk_rows : int, optional
+        Number of rows in each block (the last block may have fewer). Also
+        the number of rows read at a time if `time_step` is given.
+    time_step : float, optional
+        Instead of blocks of `chunk_rows` rows, yield one block for each time
+        window [t0, t0 + time_step), [t0 + time_step, t0 + 2 * time_step),
+        ..., where t0 is the first time in the file. Windows without any rows
+        are skipped.
+    usecols : list of str's, optional
+        Only keep these columns (names or regular expressions; see
+        `storage2numpy`) in the blocks. By default, all columns are kept.
+    excess_header_entries : int, optional
+        See `storage2numpy`.
+    min_time, max_time : float, optional
+        See `storage2numpy`.
+
+    Examples
+    --------
+    Compute the mean of a column over a huge file:
+
+        >>> total = 0
+        >>> n = 0
+        >>> for block in storage2numpy_chunks('<filename>',
+        ...         usecols=['ground_force_vy']):
+        ...     total += block['ground_force_vy'].sum()
+        ...     n += len(block)
+        >>> mean = total / n
+
+    """
+    with open(storage_file, 'r') as f:
+        _, column_names = _read_storage_header(f)
+        if excess_header_entries != 0:
+            column_names = column_names[:-excess_header_entries]
+        names = _validate_storage_column_names(column_names)
+        parsed = None
+        if usecols is not None:
+            usecols = _resolve_storage_columns(names, usecols, storage_file)
+            parsed = usecols
+            if ((min_time is not None or max_time is not None or
+                    time_step is not None) and 'time' not in usecols):
+                # Rows are selected by time before the time column is
+                # dropped.
+                parsed = [name for name in names
+                        if name in usecols or name == 'time']
+        dtype = np.dtype([(name, 'float64') for name in names])
+
+        if min_time is not None or max_time is not None:
+            if 'time' not in names:
+                raise Exception("No 'time' column in %s." % storage_file)
+            monotonic = _seek_time(f, storage_file, f.tell(),
+                    names.index('time'), min_time)
+            chunks = _time_window_chunks(_storage_chunks(f, dtype,
+                chunk_rows, parsed), min_time, max_time, monotonic)
+        else:
+            chunks = _storage_chunks(f, dtype, chunk_rows, parsed)
+        if time_step is not None:
+            chunks = _storage_time_windows(chunks, time_step)
+        for chunk in chunks:
+            if parsed != usecols:
+                chunk = _select_fields(chunk, usecols)
+            yield chunk
+
+def _parse_analog_rows(lines, names, dtype):
+    """Parses lines of whitespace-delimited numbers into a structured ndarray,
+    in bulk if possible.
+
+    """
+    data = _parse_storage_data(''.join(lines), names)
+    if data is None:
+        data = np.loadtxt(lines, dtype=dtype, ndmin=1)
+    return data
+
+def _line_chunks(f, chunk_rows):
+    """A generator of lists of (up to) `chunk_rows` non-blank lines from `f`,
+    starting at its current position.
+
+    """
+    while True:
+        lines = list(itertools.islice(f, chunk_rows))
+        if len(lines) == 0:
+            break
+        lines = [line for line in lines if line.strip() != '']
+        if len(lines) != 0:
+            yield lines
+
+# Sparse indices of the time column of data files, built by `_time_index`.
+# Keys are (file path, offset of the data, index of the time column). Only
+# the `_time_indices_size` most recently used indices are kept.
+_time_indices = collections.OrderedDict()
+_time_indices_size = 128
+
+def _time_index(fpath, data_start, time_col, stride=1000):
+    """A sparse index of the time column of a text data file: the time and
+    byte offset of every `stride`-th row. The index is built (by scanning
+    the lines of the file, without tokenizing most of them) the first time
+    it is needed for a file, and kept (up to `_time_indices_size` of them,
+    least recently used first out) for the rest of the process.
+
+    Parameters
+    ----------
+    fpath : str
+        The data file.
+    data_start : int
+        Byte offset of the first row of data (after the header).
+    time_col : int
+        Index of the time column in each whitespace-delimited row.
+    stride : int, optional
+        Number of rows between entries of the index.
+
+    Returns
+    -------
+    index : tuple of numpy.ndarray, or None
+        (times, offsets), or None if the sampled times are not monotonic, in
+        which case the index is of no use.
+
+    """
+    key = (os.path.abspath(fpath), data_start, time_col)
+    stat = os.stat(fpath)
+    signature = (stat.st_mtime, stat.st_size)
+    if key in _time_indices and _time_indices[key][0] == signature:
+        # Mark as recently used.
+        _time_indices[key] = _time_indices.pop(key)
+        return _time_indices[key][1]
+
+    times = list()
+    offsets = list()
+    with open(fpath, 'rb') as f:
+        f.seek(data_start)
+        offset = data_start
+        irow = 0
+        for line in f:
+            if line.strip() != '':
+                if irow % stride == 0:
+                    times.append(float(line.split(None, time_col + 1)[
+                        time_col]))
+                    offsets.append(offset)
+                irow += 1
+            offset += len(line)
+    times = np.array(times)
+    if np.all(np.diff(times) >= 0):
+        index = (times, np.array(offsets))
+    else:
+        index = None
+    _time_indices.pop(key, None)
+    while len(_time_indices) >= _time_indices_size:
+        _time_indices.popitem(last=False)
+    _time_indices[key] = (signature, index)
+    return index
+
+def _seek_time(f, fpath, data_start, time_col, min_time):
+    """Positions `f`, which contains time-stamped rows of data starting at
+    byte `data_start`, at the start of a row that is at or before the first
+    row with a time of at least `min_time`, using `_time_index`.
+
+    Returns
+    -------
+    monotonic : bool
+        Whether the time column is (as far as the index can tell) monotonic.
+        If not, `f` is positioned at `data_start`.
+
+    """
+    index = _time_index(fpath, data_start, time_col)
+    if index is None:
+        f.seek(data_start)
+        return False
+    times, offsets = index
+    if min_time is None:
+        f.seek(data_start)
+    else:
+        i_entry = max(0, np.searchsorted(times, min_time, side='left') - 1)
+        f.seek(offsets[i_entry])
+    return True
+
+def _time_window_chunks(chunks, min_time, max_time, monotonic):
+    """Filters a generator of structured ndarrays `chunks` (with a 'time'
+    field) to the rows with min_time <= time <= max_time. If the time is
+    `monotonic`, stops reading `chunks` once past `max_time`.
+
+    """
+    for chunk in chunks:
+        time = chunk['time']
+        keep = np.ones(len(chunk), dtype=bool)
+        if min_time is not None:
+            keep &= time >= min_time
+        if max_time is not None:
+            keep &= time <= max_time
+        if np.all(keep):
+            yield chunk
+        elif np.any(keep):
+            yield chunk[keep]
+        if (monotonic and max_time is not None and len(time) > 0 and
+                time[-1] > max_time):
+            break
+
+def _concatenate_chunks(chunks, dtype):
+    """Concatenates structured ndarrays, which may be an empty list."""
+    chunks = list(chunks)
+    if len(chunks) == 0:
+        return np.empty(0, dtype=dtype)
+    return np.concatenate(chunks)
+
+def _storage_chunks(f, dtype, chunk_rows, usecols=None):
+    """Parses the numeric block of a Storage file, from `f`'s current
+    position, `chunk_rows` rows at a time. This is a generator of structured
+    ndarrays with the given `dtype`, or with only the fields `usecols` (a
+    list of names from `dtype`) if given.
+
+    """
+    names = list(dtype.names)
+    if usecols is not None:
+        indices = [names.index(name) for name in usecols]
+    for lines in _line_chunks(f, chunk_rows):
+        if usecols is None:
+            chunk = _parse_storage_data(''.join(lines), names)
+        else:
+            chunk = _parse_storage_fields(lines, usecols, indices)
+        if chunk is None:
+            # Fall back to the more forgiving parser.
+            chunk = np.atleast_1d(np.genfromtxt(lines, dtype=dtype))
+            if usecols is not None:
+                chunk = _select_fields(chunk, usecols)
+        yield chunk
+
+def _parse_storage_fields(lines, names, indices):
+    """Parses only some fields of rows of a Storage file. Each line is split
+    (in C, by str.split) only up to its last requested field, and only the
+    requested fields are handed to `_parse_storage_data`, so the rest of the
+    row is never tokenized or converted.
+
+    Parameters
+    ----------
+    lines : list of str's
+        Non-blank rows of whitespace-delimited numbers.
+    names : list of str's
+        Valid field names for the requested fields.
+    indices : list of int's
+        The column of each of `names` in the rows, in increasing order.
+
+    Returns
+    -------
+    data : numpy.ndarray
+        Structured ndarray, or None if a row is too short or a requested
+        field is not a number (see `_parse_storage_data`).
+
+    """
+    n_split = indices[-1] + 1
+    if len(indices) == 1:
+        index = indices[0]
+        get = lambda tokens: (tokens[index],)
+    else:
+        get = operator.itemgetter(*indices)
+    try:
+        text = '\n'.join([' '.join(get(line.split(None, n_split)))
+            for line in lines])
+    except IndexError:
+        return None
+    return _parse_storage_data(text, names)
+
+def _storage_time_windows(chunks, time_step):
+    """Regroups the rows of the structured ndarrays `chunks` into one
+    ndarray for each window of `time_step` in the 'time' field. See
+    `storage2numpy_chunks`.
+
+    """
+    start_time = None
+    current = None
+    pending = list()
+    for chunk in chunks:
+        if len(chunk) == 0:
+            continue
+        if start_time is None:
+            start_time = chunk['time'][0]
+        windows = np.floor((chunk['time'] - start_time) /
+                time_step).astype(int)
+        starts = np.flatnonzero(np.diff(windows)) + 1
+        for piece, window in zip(np.split(chunk, starts),
+                windows[np.r_[0, starts]]):
+            if window != current and len(pending) > 0:
+                yield np.concatenate(pending)
+                pending = list()
+            current = window
+            pending.append(piece)
+    if len(pending) > 0:
+        yield np.concatenate(pending)
+
+def _select_fields(data, names):
+    """A compact copy of the structured ndarray `data` with only the fields
+    `names`.
+
+    """
+    selected = np.empty(len(data), dtype=[(name, data.dtype[name])
+        for name in names])
+    for name in names:
+        selected[name] = data[name]
+    return selected
+
 def _splitall(path):
     """Splits a path into a list of the directories in the path. Copied from http://my.safaribooksonline.com/book/programming/python/0596001673/files/pythoncook-chp-4-sect-16.
 
@@ -616,99 +2338,306 @@ def _splitall(path):
             allparts.insert(0, parts[1])
     return allparts
 
-def cmc_input_fpaths(cmc_setup_fpath, replace=None):
-    """Given a CMC setup file, returns the paths to all the files that the cmc
-    setup file depends on.
+# Parsed setup (XML) files and resolved paths to the files they refer to,
+# shared by cmc_input_fpaths, copy_cmc_inputs and copy_so_inputs. Entries
+# are kept for the rest of the process, and are discarded when the
+# modification time or size of the file they came from changes.
+_xml_trees = dict()
+_resolved_paths = dict()
+
+def _file_signature(fpath):
+    stat = os.stat(fpath)
+    return (stat.st_mtime, stat.st_size)
+
+def _parse_xml(fpath, writable=False):
+    """Parses an XML file, reusing the tree from a previous call if the file
+    has not changed since.
 
     Parameters
     ----------
-    cmc_setup_fpath : str
-        Path to a CMC setup file.
-    replace : dict, optional
-        In case the paths in the files may be invalid, replace parts of the
-        paths with the strings given in this dict. Keys are strings to look
-        for, values are what to replace the key with.
+    fpath : str
+        The XML file.
+    writable : bool, optional
+        Return a copy of the cached tree, which the caller is free to edit.
+        Otherwise, the cached tree itself is returned, and must not be edited.
 
     Returns
     -------
-    inputs : dict
-        A valid filepath to all the original CMC input files related to the
-        provided CMC setup file.
-        - setup
-        - model
-        - tasks
-        - actuators (str if 1 file, list of str's if multiple files.
-        - control_constraints
-        - desired_kinematics
-        - external_loads
-        - force_plates
-        - extload_kinematics
+    tree : xml.etree.ElementTree.ElementTree
 
     """
-    fname = cmc_setup_fpath
+    key = os.path.abspath(fpath)
+    signature = _file_signature(fpath)
+    if key not in _xml_trees or _xml_trees[key][0] != signature:
+        _xml_trees[key] = (signature, etree.parse(fpath))
+    tree = _xml_trees[key][1]
+    if writable:
+        return copy.deepcopy(tree)
+    return tree
+
+def _valid_path(path, file_containing_path, replace=None):
+    """Finds the file that `path`, a path in `file_containing_path`, refers
+    to. The path is tried as is, after the replacements in `replace`, with
+    forward slashes, and then relative to the directory containing
+    `file_containing_path`.
 
-    setup = etree.parse(fname)
+    Returns
+    -------
+    path : str, or None
+        None if `path` is empty.
 
-    inputs = dict()
+    """
+    if path == None or path.lstrip() == '': return None
+    if os.path.exists(path): return path
 
-    def valid_path_helper(file_containing_path, xml, tag):
+    if replace:
+        for key, val in replace.items():
+            path = path.replace(key, val)
+    if os.path.exists(path): return path
 
-        path = xml.findall('.//%s' % tag)[0].text
-        return valid_path(path, file_containing_path)
+    path = path.replace('\\', '/')
+    if os.path.exists(path): return path
 
-    def valid_path(path, file_containing_path):
-        if path == None or path.lstrip() == '': return None
-        if os.path.exists(path): return path
+    path2 = os.path.normpath(
+            os.path.join(os.path.split(file_containing_path)[0], path))
+    if os.path.exists(path2): return path2
 
-        if replace:
-            for key, val in replace.items():
-                path = path.replace(key, val)
-        if os.path.exists(path): return path
+    path2 = os.path.normpath(
+            os.path.join(os.path.split(file_containing_path)[0],
+                path.lstrip()))
+    if os.path.exists(path2): return path2
 
-        path = path.replace('\\', '/')
-        if os.path.exists(path): return path
+    path2 = os.path.normpath(
+            os.path.join(os.path.split(file_containing_path)[0],
+                path.rstrip()))
+    if os.path.exists(path2): return path2
 
-        path2 = os.path.normpath(
-                os.path.join(os.path.split(file_containing_path)[0], path))
-        if os.path.exists(path2): return path2
+    raise Exception("Paths '%s' and '%s' do not exist." % (path, path2))
+
+def _resolve_path(path, file_containing_path, replace=None):
+    """`_valid_path`, remembering the result for as long as
+    `file_containing_path` is unchanged. A remembered path is used only if it
+    still exists, which costs one probe instead of up to six.
+
+    """
+    if path == None or path.lstrip() == '': return None
+    key = (path, os.path.abspath(file_containing_path), os.getcwd(),
+            tuple(sorted(replace.items())) if replace else None)
+    signature = _file_signature(file_containing_path)
+    if key in _resolved_paths:
+        cached_signature, resolved = _resolved_paths[key]
+        if cached_signature == signature and os.path.exists(resolved):
+            return resolved
+    resolved = _valid_path(path, file_containing_path, replace)
+    _resolved_paths[key] = (signature, resolved)
+    return resolved
+
+def _resolve_setup_inputs(setup_fpath, tags, replace=None, writable=False):
+    """Parses a tool setup file and the external loads file it refers to,
+    and resolves the paths of the input files named in both.
+
+    Parameters
+    ----------
+    setup_fpath : str
+        Path to the setup file.
+    tags : list of (str, str)
+        (key, tag) for each single-file input in the setup file, which
+        must include ('external_loads', 'external_loads_file').
+    replace : dict, optional
+        See `cmc_input_fpaths`.
+    writable : bool, optional
+        See `_parse_xml`.
 
-        path2 = os.path.normpath(
-                os.path.join(os.path.split(file_containing_path)[0],
-                    path.lstrip()))
-        if os.path.exists(path2): return path2
+    Returns
+    -------
+    setup : xml.etree.ElementTree.ElementTree
+    extloads : xml.etree.ElementTree.ElementTree
+    fpaths : dict
+        Resolved path for each key in `tags`, and for 'force_plates' and
+        'extload_kinematics'.
+    actu : list of str's
+        Resolved paths of the files in force_set_files.
 
-        path2 = os.path.normpath(
-                os.path.join(os.path.split(file_containing_path)[0],
-                    path.rstrip()))
-        if os.path.exists(path2): return path2
+    """
+    setup = _parse_xml(setup_fpath, writable=writable)
 
-        raise Exception("Paths '%s' and '%s' do not exist." % (path, path2))
+    def resolve_tag(file_containing_path, xml, tag):
+        path = xml.findall('.//%s' % tag)[0].text
+        return _resolve_path(path, file_containing_path, replace)
 
-    # Get file names.
-    # ---------------
-    # Settings / parameters.
-    inputs['model'] = valid_path_helper(fname, setup, 'model_file')
-    inputs['tasks'] = valid_path_helper(fname, setup, 'task_set_file')
+    fpaths = dict()
+    for key, tag in tags:
+        fpaths[key] = resolve_tag(setup_fpath, setup, tag)
 
     # This is a list of files, not just 1 file.
     actu = list()
     for path in setup.findall('.//force_set_files')[0].text.split():
-        actu.append(valid_path(path, fname))
+        actu.append(_resolve_path(path, setup_fpath, replace))
+
+    # Try to open the external loads file.
+    extloads = _parse_xml(fpaths['external_loads'], writable=writable)
+    fpaths['force_plates'] = resolve_tag(fpaths['external_loads'], extloads,
+            'datafile')
+    fpaths['extload_kinematics'] = resolve_tag(fpaths['external_loads'],
+            extloads, 'external_loads_model_kinematics_file')
+
+    return setup, extloads, fpaths, actu
+
+_COPY_STRATEGIES = ['copy', 'hardlink', 'symlink', 'reflink', 'store']
+
+# Linux ioctl that makes the destination file share the source file's data
+# blocks (copy-on-write), on filesystems that support it (btrfs, XFS).
+_FICLONE = 0x40049409
+
+# SHA-256 of input files, keyed by absolute path; see `_content_hash`.
+_content_hashes = dict()
 
-    inputs['control_constraints'] = valid_path_helper(fname, setup,
-            'constraints_file')
+def _content_hash(fpath):
+    """SHA-256 of the contents of `fpath`, remembered for as long as the
+    file's modification time and size are unchanged.
 
-    # Data.
-    inputs['desired_kinematics'] = valid_path_helper(fname, setup,
-            'desired_kinematics_file')
-    inputs['external_loads'] = valid_path_helper(fname, setup, 'external_loads_file')
+    """
+    key = os.path.abspath(fpath)
+    signature = _file_signature(fpath)
+    if key in _content_hashes and _content_hashes[key][0] == signature:
+        return _content_hashes[key][1]
+    sha256 = hashlib.sha256()
+    with open(fpath, 'rb') as f:
+        for chunk in iter(lambda: f.read(2**20), ''):
+            sha256.update(chunk)
+    _content_hashes[key] = (signature, sha256.hexdigest())
+    return _content_hashes[key][1]
+
+def _store_input(fpath, store):
+    """Adds `fpath` to the content-addressed store in directory `store`, if
+    it is not there already, and returns the path of the file in the store.
+    Files in the store are named by the SHA-256 of their contents, and are
+    made read-only since they are shared (through hard links) by all the
+    directories that use them.
+
+    """
+    digest = _content_hash(fpath)
+    store_fpath = os.path.join(store, digest[:2],
+            digest + os.path.splitext(fpath)[1])
+    if not os.path.exists(store_fpath):
+        if not os.path.exists(os.path.dirname(store_fpath)):
+            try:
+                os.makedirs(os.path.dirname(store_fpath))
+            except OSError:
+                # Another process created it.
+                pass
+        tmp_fpath = store_fpath + '.tmp%i' % os.getpid()
+        shutil.copyfile(fpath, tmp_fpath)
+        os.chmod(tmp_fpath, 0444)
+        _rename_into_place(tmp_fpath, store_fpath)
+    return store_fpath
+
+def _reflink(src, dst):
+    """Creates `dst` as a copy-on-write clone of `src`. Raises ImportError if
+    the platform does not support it, or IOError (leaving `dst` behind,
+    possibly empty) if the filesystem does not.
+
+    """
+    import fcntl
+    with open(src, 'rb') as fsrc:
+        with open(dst, 'wb') as fdst:
+            fcntl.ioctl(fdst.fileno(), _FICLONE, fsrc.fileno())
+    shutil.copymode(src, dst)
+
+def _copy_input(src, dst, strategy='copy', store=None):
+    """Places the file `src` at `dst`, according to `strategy`; see
+    `copy_cmc_inputs`. With a linking strategy, nothing is done if `dst`
+    already links to `src`.
+
+    """
+    if strategy not in _COPY_STRATEGIES:
+        raise Exception("Unrecognized copy strategy '%s'; must be one of %s."
+                % (strategy, _COPY_STRATEGIES))
+    if os.path.abspath(src) == os.path.abspath(dst):
+        raise Exception("'%s' and '%s' are the same file." % (src, dst))
+    if strategy == 'store':
+        if store == None:
+            raise Exception("The 'store' copy strategy requires `store`.")
+        src = _store_input(src, store)
+        strategy = 'hardlink'
+
+    if os.path.lexists(dst):
+        if (strategy in ['hardlink', 'symlink'] and os.path.exists(dst) and
+                os.path.islink(dst) == (strategy == 'symlink') and
+                os.path.samefile(src, dst)):
+            return
+        # Never write through a link to another file.
+        os.remove(dst)
+
+    if strategy == 'hardlink':
+        try:
+            os.link(src, dst)
+            return
+        except (OSError, AttributeError), e:
+            warnings.warn("Could not hard link '%s' to '%s' (%s); copying "
+                    "instead." % (dst, src, e))
+    elif strategy == 'symlink':
+        try:
+            os.symlink(os.path.abspath(src), dst)
+            return
+        except (OSError, AttributeError), e:
+            warnings.warn("Could not symlink '%s' to '%s' (%s); copying "
+                    "instead." % (dst, src, e))
+    elif strategy == 'reflink':
+        try:
+            _reflink(src, dst)
+            return
+        except (IOError, OSError, ImportError), e:
+            warnings.warn("Could not reflink '%s' to '%s' (%s); copying "
+                    "instead." % (dst, src, e))
+    shutil.copy(src, dst)
+
+# (key, tag) of the single-file inputs named in CMC and static optimization
+# setup files.
+_CMC_INPUT_TAGS = [
+        ('model', 'model_file'),
+        ('tasks', 'task_set_file'),
+        ('control_constraints', 'constraints_file'),
+        ('desired_kinematics', 'desired_kinematics_file'),
+        ('external_loads', 'external_loads_file'),
+        ]
+_SO_INPUT_TAGS = [
+        ('model', 'model_file'),
+        ('coordinates_file', 'coordinates_file'),
+        ('external_loads', 'external_loads_file'),
+        ]
+
+def cmc_input_fpaths(cmc_setup_fpath, replace=None):
+    """Given a CMC setup file, returns the paths to all the files that the cmc
+    setup file depends on.
+
+    Parameters
+    ----------
+    cmc_setup_fpath : str
+        Path to a CMC setup file.
+    replace : dict, optional
+        In case the paths in the files may be invalid, replace parts of the
+        paths with the strings given in this dict. Keys are strings to look
+        for, values are what to replace the key with.
+
+    Returns
+    -------
+    inputs : dict
+        A valid filepath to all the original CMC input files related to the
+        provided CMC setup file.
+        - setup
+        - model
+        - tasks
+        - actuators (str if 1 file, list of str's if multiple files.
+        - control_constraints
+        - desired_kinematics
+        - external_loads
+        - force_plates
+        - extload_kinematics
 
-    # Try to open the external loads file.
-    extloads = etree.parse(inputs['external_loads'])
-    inputs['force_plates'] = valid_path_helper(inputs['external_loads'],
-            extloads, 'datafile')
-    inputs['extload_kinematics'] = valid_path_helper(inputs['external_loads'],
-            extloads, 'external_loads_model_kinematics_file')
+    """
+    setup, extloads, inputs, actu = _resolve_setup_inputs(cmc_setup_fpath,
+            _CMC_INPUT_TAGS, replace)
 
     if len(actu) == 1:
         inputs['actuators'] = actu[0]
@@ -719,7 +2648,7 @@ def cmc_input_fpaths(cmc_setup_fpath, replace=None):
 
 
 def copy_cmc_inputs(cmc_setup_fpath, destination, replace=None,
-        do_not_copy=None, **kwargs):
+        do_not_copy=None, strategy='copy', store=None, **kwargs):
     """Given a CMC setup file, copies all files necessary to run CMC over to
     `destination`. All files necessary to run CMC are stored in the same
     directory. The CMC setup file and the external loads files are edited so
@@ -753,6 +2682,25 @@ def copy_cmc_inputs(cmc_setup_fpath, destination, replace=None,
         'setup' and 'external_loads' are necessarily copied over. 'actuators'
         are treated as a group: all the files in this field are copied, or none
         of them are copied.
+    strategy : str, optional
+        How the input files (not the setup and external loads files, which
+        are edited) are placed in `destination`:
+        - 'copy': an independent copy.
+        - 'hardlink': a hard link to the original file.
+        - 'symlink': a symbolic link to the (absolute path of the) original.
+        - 'reflink': a copy-on-write clone, where the filesystem supports it
+          (btrfs, XFS on Linux); otherwise, a copy.
+        - 'store': a hard link into the content-addressed store `store`,
+          where each distinct file is kept once, named by its SHA-256.
+        With the linking strategies, the files in `destination` are shared,
+        so they must not be edited in place; in exchange, placing an
+        unchanged input costs no copying and no extra disk. Links that cannot
+        be created (e.g., across filesystems) fall back to a copy, with a
+        warning.
+    store : str, optional
+        Directory of the content-addressed store, for `strategy='store'`.
+        Best placed on the same filesystem as `destination`, and shared by
+        all the experiments of a study.
     setup : str, optional
         A new filename for the cmc setup file (the first argument to this
         method).
@@ -800,69 +2748,8 @@ def copy_cmc_inputs(cmc_setup_fpath, destination, replace=None,
         if 'setup' in do_not_copy or 'external_loads' in do_not_copy:
             raise Exception('`do_not_copy` cannot contain `setup` or '
                     '`external_loads`.')
-    fname = cmc_setup_fpath
-
-    setup = etree.parse(fname)
-
-    old = dict()
-
-    def valid_path_helper(file_containing_path, xml, tag):
-
-        path = xml.findall('.//%s' % tag)[0].text
-        return valid_path(path, file_containing_path)
-
-    def valid_path(path, file_containing_path):
-        if path == None or path.lstrip() == '': return None
-        if os.path.exists(path): return path
-
-        if replace:
-            for key, val in replace.items():
-                path = path.replace(key, val)
-        if os.path.exists(path): return path
-
-        path = path.replace('\\', '/')
-        if os.path.exists(path): return path
-
-        path2 = os.path.normpath(
-                os.path.join(os.path.split(file_containing_path)[0], path))
-        if os.path.exists(path2): return path2
-
-        path2 = os.path.normpath(
-                os.path.join(os.path.split(file_containing_path)[0],
-                    path.lstrip()))
-        if os.path.exists(path2): return path2
-
-        path2 = os.path.normpath(
-                os.path.join(os.path.split(file_containing_path)[0],
-                    path.rstrip()))
-        if os.path.exists(path2): return path2
-
-        raise Exception("Paths '%s' and '%s' do not exist." % (path, path2))
-
-    # Get file names.
-    # ---------------
-    # Settings / parameters.
-    old['model'] = valid_path_helper(fname, setup, 'model_file')
-    old['tasks'] = valid_path_helper(fname, setup, 'task_set_file')
-
-    # This is a list of files, not just 1 file.
-    old_actu = list()
-    for path in setup.findall('.//force_set_files')[0].text.split():
-        old_actu.append(valid_path(path, fname))
-
-    old['control_constraints'] = valid_path_helper(fname, setup, 'constraints_file')
-
-    # Data.
-    old['desired_kinematics'] = valid_path_helper(fname, setup,
-            'desired_kinematics_file')
-    old['external_loads'] = valid_path_helper(fname, setup, 'external_loads_file')
-
-    # Try to open the external loads file.
-    extloads = etree.parse(old['external_loads'])
-    old['force_plates'] = valid_path_helper(old['external_loads'], extloads,
-            'datafile')
-    old['extload_kinematics'] = valid_path_helper(old['external_loads'],
-            extloads, 'external_loads_model_kinematics_file')
+    setup, extloads, old, old_actu = _resolve_setup_inputs(cmc_setup_fpath,
+            _CMC_INPUT_TAGS, replace, writable=True)
 
     # Copy files over.
     # ----------------
@@ -885,17 +2772,15 @@ def copy_cmc_inputs(cmc_setup_fpath, destination, replace=None,
                 in do_not_copy):
             if key in kwargs:
                 new_fpath = os.path.join(destination, kwargs[key])
-                shutil.copy(val, new_fpath)
-                new_fpaths[key] = new_fpath
             else:
-                shutil.copy(val, destination)
-                new_fpaths[key] = os.path.join(destination,
-                        os.path.basename(val))
+                new_fpath = os.path.join(destination, os.path.basename(val))
+            _copy_input(val, new_fpath, strategy, store)
+            new_fpaths[key] = new_fpath
     if do_not_copy == None or 'actuators' not in do_not_copy:
         for actu in old_actu:
-            shutil.copy(actu, destination)
-            new_actu_fpaths.append(
-                    os.path.join(destination, os.path.basename(actu)))
+            new_fpath = os.path.join(destination, os.path.basename(actu))
+            _copy_input(actu, new_fpath, strategy, store)
+            new_actu_fpaths.append(new_fpath)
 
     # Edit the names of the files in the setup files.
     # -----------------------------------------------
@@ -968,7 +2853,7 @@ def copy_cmc_inputs(cmc_setup_fpath, destination, replace=None,
     return old, new_fpaths
 
 def copy_so_inputs(so_setup_fpath, destination, replace=None,
-        do_not_copy=None, **kwargs):
+        do_not_copy=None, strategy='copy', store=None, **kwargs):
     """Given a static optimization setup file, copies all files necessary to
     run static optimization over to `destination`. All files necessary to run
     static optimization are stored in the same directory. The static
@@ -1003,6 +2888,25 @@ def copy_so_inputs(so_setup_fpath, destination, replace=None,
         'setup' and 'external_loads' are necessarily copied over. 'actuators'
         are treated as a group: all the files in this field are copied, or none
         of them are copied.
+    strategy : str, optional
+        How the input files (not the setup and external loads files, which
+        are edited) are placed in `destination`:
+        - 'copy': an independent copy.
+        - 'hardlink': a hard link to the original file.
+        - 'symlink': a symbolic link to the (absolute path of the) original.
+        - 'reflink': a copy-on-write clone, where the filesystem supports it
+          (btrfs, XFS on Linux); otherwise, a copy.
+        - 'store': a hard link into the content-addressed store `store`,
+          where each distinct file is kept once, named by its SHA-256.
+        With the linking strategies, the files in `destination` are shared,
+        so they must not be edited in place; in exchange, placing an
+        unchanged input costs no copying and no extra disk. Links that cannot
+        be created (e.g., across filesystems) fall back to a copy, with a
+        warning.
+    store : str, optional
+        Directory of the content-addressed store, for `strategy='store'`.
+        Best placed on the same filesystem as `destination`, and shared by
+        all the experiments of a study.
     setup : str, optional
         A new filename for the so setup file (the first argument to this
         method).
@@ -1044,66 +2948,8 @@ def copy_so_inputs(so_setup_fpath, destination, replace=None,
         if 'setup' in do_not_copy or 'external_loads' in do_not_copy:
             raise Exception('`do_not_copy` cannot contain `setup` or '
                     '`external_loads`.')
-    fname = so_setup_fpath
-
-    setup = etree.parse(fname)
-
-    old = dict()
-
-    def valid_path_helper(file_containing_path, xml, tag):
-
-        path = xml.findall('.//%s' % tag)[0].text
-        return valid_path(path, file_containing_path)
-
-    def valid_path(path, file_containing_path):
-        if path == None or path.lstrip() == '': return None
-        if os.path.exists(path): return path
-
-        if replace:
-            for key, val in replace.items():
-                path = path.replace(key, val)
-        if os.path.exists(path): return path
-
-        path = path.replace('\\', '/')
-        if os.path.exists(path): return path
-
-        path2 = os.path.normpath(
-                os.path.join(os.path.split(file_containing_path)[0], path))
-        if os.path.exists(path2): return path2
-
-        path2 = os.path.normpath(
-                os.path.join(os.path.split(file_containing_path)[0],
-                    path.lstrip()))
-        if os.path.exists(path2): return path2
-
-        path2 = os.path.normpath(
-                os.path.join(os.path.split(file_containing_path)[0],
-                    path.rstrip()))
-        if os.path.exists(path2): return path2
-
-        raise Exception("Paths '%s' and '%s' do not exist." % (path, path2))
-
-    # Get file names.
-    # ---------------
-    # Settings / parameters.
-    old['model'] = valid_path_helper(fname, setup, 'model_file')
-
-    # This is a list of files, not just 1 file.
-    old_actu = list()
-    for path in setup.findall('.//force_set_files')[0].text.split():
-        old_actu.append(valid_path(path, fname))
-
-    # Data.
-    old['coordinates_file'] = valid_path_helper(fname, setup,
-            'coordinates_file')
-    old['external_loads'] = valid_path_helper(fname, setup, 'external_loads_file')
-
-    # Try to open the external loads file.
-    extloads = etree.parse(old['external_loads'])
-    old['force_plates'] = valid_path_helper(old['external_loads'], extloads,
-            'datafile')
-    old['extload_kinematics'] = valid_path_helper(old['external_loads'],
-            extloads, 'external_loads_model_kinematics_file')
+    setup, extloads, old, old_actu = _resolve_setup_inputs(so_setup_fpath,
+            _SO_INPUT_TAGS, replace, writable=True)
 
     # Copy files over.
     # ----------------
@@ -1124,17 +2970,15 @@ def copy_so_inputs(so_setup_fpath, destination, replace=None,
                 in do_not_copy):
             if key in kwargs:
                 new_fpath = os.path.join(destination, kwargs[key])
-                shutil.copy(val, new_fpath)
-                new_fpaths[key] = new_fpath
             else:
-                shutil.copy(val, destination)
-                new_fpaths[key] = os.path.join(destination,
-                        os.path.basename(val))
+                new_fpath = os.path.join(destination, os.path.basename(val))
+            _copy_input(val, new_fpath, strategy, store)
+            new_fpaths[key] = new_fpath
     if do_not_copy == None or 'actuators' not in do_not_copy:
         for actu in old_actu:
-            shutil.copy(actu, destination)
-            new_actu_fpaths.append(
-                    os.path.join(destination, os.path.basename(actu)))
+            new_fpath = os.path.join(destination, os.path.basename(actu))
+            _copy_input(actu, new_fpath, strategy, store)
+            new_actu_fpaths.append(new_fpath)
 
     # Edit the names of the files in the setup files.
     # -----------------------------------------------
@@ -1205,13 +3049,247 @@ def copy_so_inputs(so_setup_fpath, destination, replace=None,
     return old, new_fpaths
 
 
+class DockProfile(object):
+    """How the tables docked in a pyTables file are stored: compression,
+    chunking, and precision. Pass one of these (or the name of one in
+    `DOCK_PROFILES`) as the `profile` argument of the dock_* functions.
+
+    PyTables tables are stored row by row, so reading a single column (e.g.,
+    `table.col('time')`) reads (and decompresses) every chunk of the table.
+    Compression makes files smaller and whole-table reads cheaper over slow
+    disks or networks, but makes column-by-column reads slower; see
+    bench_dataman.py.
+
+    """
+    def __init__(self, complib=None, complevel=0, shuffle=True,
+            chunk_bytes=None, float64=False):
+        """
+        Parameters
+        ----------
+        complib : str, optional
+            Compression library; e.g., 'zlib', 'blosc', 'blosc:lz4'. See
+            `tables.Filters`. By default, data is not compressed.
+        complevel : int, optional
+            Compression level, 0 (none) through 9 (most).
+        shuffle : bool, optional (default: True)
+            Use the shuffle filter, which usually improves compression of
+            floating point data.
+        chunk_bytes : int, optional
+            Approximate size of a chunk, in bytes. By default, pyTables
+            chooses the chunk size from the expected number of rows.
+        float64 : bool, optional (default: False)
+            Store columns as 64-bit floats, rather than 32-bit floats.
+
+        """
+        self.complib = complib
+        self.complevel = complevel
+        self.shuffle = shuffle
+        self.chunk_bytes = chunk_bytes
+        self.float64 = float64
+
+    def column(self):
+        """A pyTables column description for a data column."""
+        if self.float64:
+            return tables.Float64Col()
+        else:
+            return tables.Float32Col()
+
+    def atom(self):
+        """A pyTables atom for the arrays of a column group."""
+        if self.float64:
+            return tables.Float64Atom()
+        else:
+            return tables.Float32Atom()
+
+    def filters(self):
+        """The tables.Filters to use for a table, or None."""
+        if self.complib == None or self.complevel == 0:
+            return None
+        return tables.Filters(complevel=self.complevel, complib=self.complib,
+                shuffle=self.shuffle)
+
+    def chunkshape(self, n_cols):
+        """The chunkshape for a table with `n_cols` data columns, or None to
+        let pyTables choose.
+
+        """
+        if self.chunk_bytes == None:
+            return None
+        itemsize = 8 if self.float64 else 4
+        return (max(1, self.chunk_bytes / (itemsize * max(1, n_cols))),)
+
+# Named profiles, for the `profile` argument of the dock_* functions.
+DOCK_PROFILES = {
+        # pyTables defaults; this is what was always used.
+        'default': DockProfile(),
+        # Fast compression and decompression.
+        'blosc': DockProfile(complib='blosc:lz4', complevel=5,
+            chunk_bytes=2**20),
+        # Smaller files, but slower to write.
+        'zlib': DockProfile(complib='zlib', complevel=5, chunk_bytes=2**20),
+        }
+
+def _dock_profile(profile):
+    """Resolves the `profile` argument of the dock_* functions to a
+    DockProfile.
+
+    """
+    if profile is None:
+        return DOCK_PROFILES['default']
+    elif isinstance(profile, DockProfile):
+        return profile
+    elif profile in DOCK_PROFILES:
+        return DOCK_PROFILES[profile]
+    else:
+        raise Exception("Unrecognized dock profile '%s'." % profile)
+
+class ColumnTable(object):
+    """A read-only view of a table docked with layout='columns' (see
+    `_populate_table`), with the parts of the tables.Table interface that we
+    use in analysis: `col(name)`, `colnames`, `cols.<name>`, `nrows`, and
+    `read()`. Such a table is a group containing one chunked array per
+    column, so that reading one column reads only that column's chunks.
+
+    Examples
+    --------
+    >>> table = ColumnTable(h5file.root.study.subj01.cmc.states)
+    >>> time = table.cols.time[:]
+    >>> activation = table.col('soleus_r_activation')
+
+    """
+    def __init__(self, group):
+        """
+        Parameters
+        ----------
+        group : tables.Group
+            A group created by `_populate_table(..., layout='columns')`.
+
+        """
+        if getattr(group._v_attrs, 'dock_layout', None) != 'columns':
+            raise Exception("Group '%s' is not a table docked with "
+                    "layout='columns'." % group._v_pathname)
+        self._group = group
+        self.colnames = list(group._v_attrs.colnames)
+        self.cols = _ColumnTableCols(group)
+        self.name = group._v_name
+        self.title = group._v_title
+        self.attrs = group._v_attrs
+
+    @property
+    def nrows(self):
+        return self._group._v_attrs.nrows
+
+    def __len__(self):
+        return self.nrows
+
+    def col(self, name):
+        """The data in column `name`, as an ndarray."""
+        return self._group._f_get_child(name).read()
+
+    def read(self):
+        """The entire table, as a structured ndarray."""
+        arrays = [self._group._f_get_child(name) for name in self.colnames]
+        data = np.empty(self.nrows, dtype={'names': self.colnames,
+            'formats': [arr.atom.dtype for arr in arrays]})
+        for name, arr in zip(self.colnames, arrays):
+            data[name] = arr.read()
+        return data
+
+class _ColumnTableCols(object):
+    """Attribute access to the columns of a `ColumnTable`, like
+    tables.Table.cols. The columns are pyTables arrays, so they can be sliced
+    without reading the whole column.
+
+    """
+    def __init__(self, group):
+        self._group = group
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        try:
+            return self._group._f_get_child(name)
+        except tables.NoSuchNodeError:
+            raise AttributeError("Table has no column '%s'." % name)
+
+def docked_table(node):
+    """A docked table that supports the tables.Table interface used in
+    analysis (`col`, `colnames`, `cols`), regardless of its layout.
+
+    Parameters
+    ----------
+    node : tables.Table or tables.Group
+        A table docked with either layout='rows' (a tables.Table, returned as
+        is) or layout='columns' (a group, returned as a `ColumnTable`).
+
+    """
+    if isinstance(node, tables.Group):
+        return ColumnTable(node)
+    return node
+
+def _create_docked_table(h5file, group, table_name, title, columns, n_rows,
+        profile=None, layout='rows'):
+    """Creates a table (layout='rows') or column group (layout='columns') and
+    fills it with data.
+
+    Parameters
+    ----------
+    columns : list of (str, array_like) tuples
+        The name of each column, and its data.
+    n_rows : int
+        The length of each column.
+
+    Returns
+    -------
+    table : tables.Table or ColumnTable
+
+    """
+    profile = _dock_profile(profile)
+    if layout == 'rows':
+        table_cols = dict()
+        for name, values in columns:
+            table_cols[name] = profile.column()
+        table = h5file.create_table(group, table_name, table_cols, title,
+                filters=profile.filters(), expectedrows=max(1, n_rows),
+                chunkshape=profile.chunkshape(len(table_cols)))
+        _append_columns_to_table(table, columns)
+        return table
+    elif layout == 'columns':
+        col_group = h5file.create_group(group, table_name, title)
+        for name, values in columns:
+            # An EArray is a CArray that can also have zero rows.
+            arr = h5file.create_earray(col_group, name, profile.atom(),
+                    shape=(0,), filters=profile.filters(),
+                    expectedrows=max(1, n_rows),
+                    chunkshape=profile.chunkshape(1))
+            arr.append(np.asarray(values, dtype=arr.atom.dtype))
+        col_group._v_attrs.colnames = [name for name, values in columns]
+        col_group._v_attrs.nrows = n_rows
+        col_group._v_attrs.dock_layout = 'columns'
+        h5file.flush()
+        return ColumnTable(col_group)
+    else:
+        raise Exception("Unrecognized layout '%s'; use 'rows' or "
+                "'columns'." % layout)
+
 def dock_simulation_tree_in_pytable(h5fname, study_root, h5_root, verbose=True,
-        **kwargs):
+        n_workers=1, queue_depth=None, incremental=False, dry_run=False,
+        remove_deleted=False, **kwargs):
     """Docks all simulations in the tree into the h5file at the desired
     location. The directory structure used in the h5 file is the same that is
     used for the simulation output. All leaves in the tree MUST be simulation
     outputs (e.g. contain STO files).
 
+    The h5 file keeps a manifest, in the table '/dock_manifest', of the
+    mtime, size, and table path of every Storage file that has been docked.
+    Leaves that could not be docked are recorded, with a signature of the
+    names, mtimes, and sizes of their files and the error, in the table
+    '/dock_failures'. With `incremental`, the manifest is compared with the
+    directory tree so that only new and changed leaves are docked; unchanged
+    leaves are not touched at all. Leaves that failed, and whose files have
+    not changed since, are reported as failed and are not retried (a full,
+    non-incremental dock retries them).
+
     Parameters
     ----------
     h5fname : str
@@ -1223,18 +3301,178 @@ def dock_simulation_tree_in_pytable(h5fname, study_root, h5_root, verbose=True,
         docked.
     verbose : bool, optional (default: True)
         Prints a notice for every output loaded into the pyTables file.
+    n_workers : int, optional (default: 1)
+        Number of processes that parse Storage files. If greater than 1, a
+        pool of processes parses the leaves ahead of time, and this process,
+        the only one that touches the pyTables file, writes them in the same
+        order as the serial walk. Exceptions are reported and counted per
+        leaf, just as in serial.
+    queue_depth : int, optional
+        If `n_workers` is greater than 1, the maximum number of leaves that
+        are being parsed or waiting to be written. This bounds memory use. By
+        default, 2 * `n_workers`.
+    incremental : bool, optional (default: False)
+        Only dock leaves that are new, or that contain a Storage file whose
+        mtime or size differs from that in the manifest. Tables for changed
+        files are rewritten, so `overwrite_if_newer` is implied.
+    dry_run : bool, optional (default: False)
+        Only report which leaves are new, changed, or deleted (as with
+        `incremental`); don't write anything.
+    remove_deleted : bool, optional (default: False)
+        With `incremental`, remove the tables of Storage files that no longer
+        exist. Otherwise, such tables are only reported.
     kwargs : passed onto `dock_output_in_pytable`.
+        For example, 'profile' sets the compression, chunking, and precision
+        of the tables (see `DockProfile`), and 'layout' can be 'columns' (see
+        `_populate_table`).
+
+    Returns
+    -------
+    changes : dict
+        Only if `incremental` or `dry_run`. The keys 'new', 'changed',
+        'deleted', and 'failed' map to lists of the paths of leaves (output
+        directories) in each category.
 
     """
     # TODO overwrite : bool, optional (default : False)
     # TODO     If a group already exists, delete it and rewrite it with the
     # TODO     newly-found data.  Otherwise, the group is skipped.
-    # Open the pyTables file.
-    h5file = tables.open_file(h5fname, mode='a')
+    if dry_run:
+        if os.path.exists(h5fname):
+            h5file = tables.open_file(h5fname, mode='r')
+            manifest = _read_dock_manifest(h5file)
+            failures = _read_dock_failures(h5file)
+            h5file.close()
+        else:
+            manifest = dict()
+            failures = dict()
+        changes, _, _ = _diff_simulation_tree(manifest, failures, study_root,
+                h5_root, kwargs)
+        if verbose:
+            _print_simulation_tree_changes(changes)
+        return changes
 
     # Report the number of exceptions we get.
     exception_count = 0
 
+    def dock_leaf(path, group_path, sources, parsed_tables=None):
+        if verbose:
+            print "Loading {0}.".format(path)
+
+        # Dock this specific simulation output.
+        try:
+            this_table = dock_output_in_pytable(h5file, path,
+                    group_path, parsed_tables=parsed_tables, **kwargs)
+        except Exception, e:
+            print "Exception at path {0}: {1}".format(path, e.message)
+            # Tables docked before the exception are still recorded.
+            failures[os.path.abspath(path)] = (_leaf_signature(path), str(e))
+            status = 1
+        else:
+            failures.pop(os.path.abspath(path), None)
+            status = 0
+
+        # Record what we docked.
+        for source, signature in sources.items():
+            if signature[2] in h5file:
+                manifest[source] = signature
+        return status
+
+    pool = None
+    h5file = None
+    try:
+        # Start the worker processes before opening the pyTables file, so
+        # they do not inherit its file handle.
+        if n_workers > 1:
+            pool = multiprocessing.Pool(n_workers)
+            if queue_depth == None:
+                queue_depth = 2 * n_workers
+
+        # Open the pyTables file.
+        h5file = tables.open_file(h5fname, mode='a')
+        manifest = _read_dock_manifest(h5file)
+        # Forget the failures of leaves that no longer exist.
+        failures = dict((leaf, failure)
+                for leaf, failure in _read_dock_failures(h5file).items()
+                if os.path.isdir(leaf))
+
+        if incremental:
+            kwargs['overwrite_if_newer'] = True
+            changes, leaves, deleted = _diff_simulation_tree(manifest,
+                    failures, study_root, h5_root, kwargs)
+            if verbose:
+                _print_simulation_tree_changes(changes)
+            # Tables of changed files are removed, so that they are rewritten
+            # even if the file is now older than the table.
+            for path, group_path, sources in leaves:
+                for source, signature in sources.items():
+                    if (source in manifest and
+                            manifest[source][:2] != signature[:2] and
+                            manifest[source][2] in h5file):
+                        h5file.remove_node(manifest[source][2],
+                                recursive=True)
+            if remove_deleted:
+                for source in deleted:
+                    if manifest[source][2] in h5file:
+                        h5file.remove_node(manifest[source][2],
+                                recursive=True)
+                    manifest.pop(source)
+        else:
+            leaves = _simulation_tree_leaves(study_root, h5_root, kwargs)
+
+        try:
+            if n_workers > 1:
+                # Leaves that are being parsed, in the order they were found.
+                pending = collections.deque()
+                for path, group_path, sources in leaves:
+                    storage_tables = _storage_tables_to_parse(h5file, path,
+                            group_path, kwargs)
+                    pending.append((path, group_path, sources,
+                        pool.apply_async(_parse_storage_tables,
+                            (storage_tables,
+                                kwargs.get('replacements', {})))))
+                    if len(pending) >= queue_depth:
+                        path, group_path, sources, result = pending.popleft()
+                        exception_count += dock_leaf(path, group_path,
+                                sources, result.get())
+                while len(pending) > 0:
+                    path, group_path, sources, result = pending.popleft()
+                    exception_count += dock_leaf(path, group_path, sources,
+                            result.get())
+            else:
+                for path, group_path, sources in leaves:
+                    exception_count += dock_leaf(path, group_path, sources)
+        finally:
+            # Save the manifest even if we were interrupted, so that the
+            # leaves that were docked need not be docked again.
+            _write_dock_manifest(h5file, manifest)
+            _write_dock_failures(h5file, failures)
+    except:
+        if pool is not None:
+            pool.terminate()
+        raise
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        # Close the pyTables file.
+        if h5file is not None and h5file.isopen:
+            h5file.close()
+
+    print "Number of exceptions: %i" % exception_count
+
+    if incremental:
+        return changes
+
+def _simulation_tree_leaves(study_root, h5_root, kwargs):
+    """Generates (path, group_path, sources) for each leaf of a simulation
+    tree; see `dock_simulation_tree_in_pytable`. `sources` is a dict mapping
+    the absolute path of each Storage file in the leaf to a tuple (mtime,
+    size, table path), as in the dock manifest; it is empty if the leaf's
+    Storage files can't be listed (`dock_output_in_pytable` raises the
+    corresponding exception).
+
+    """
     # Walk the entire directory structure.
     for (path, dirs, files) in os.walk(study_root):
 
@@ -1243,9 +3481,6 @@ def dock_simulation_tree_in_pytable(h5fname, study_root, h5_root, verbose=True,
         # TODO an alternative check is os.path.split(path)[1] == 'output'
         if len(dirs) == 0 and len(files) != 0:
 
-            if verbose:
-                print "Loading {0}.".format(path)
-
             # Create a list describing the path, excluding 'output' at the end.
             # Also make sure we do this for a path that's relative to the study
             # root.
@@ -1255,21 +3490,223 @@ def dock_simulation_tree_in_pytable(h5fname, study_root, h5_root, verbose=True,
             # Prepend the user's desired root for this study in the h5 file.
             group_path = h5_root + path_parts
 
-            # Dock this specific simulation output.
+            sources = dict()
             try:
-                this_table = dock_output_in_pytable(h5file, path,
-                        group_path, **kwargs)
-            except Exception, e:
-                print "Exception at path {0}: {1}".format(path, e.message)
-                exception_count += 1
+                storage_tables = _output_storage_tables(path,
+                        **_listing_kwargs(kwargs))
+            except Exception:
+                storage_tables = None
+            for table_name, filepath in storage_tables or []:
+                stat = os.stat(filepath)
+                sources[os.path.abspath(filepath)] = (stat.st_mtime,
+                        stat.st_size, '/' + '/'.join(group_path + [table_name]))
 
-    print "Number of exceptions: %i" % exception_count
+            yield path, group_path, sources
 
-    # Close the pyTables file.
-    h5file.close()
+def _diff_simulation_tree(manifest, failures, study_root, h5_root, kwargs):
+    """Compares a simulation tree with a dock manifest and the record of
+    failed leaves (see `_read_dock_failures`).
+
+    Returns
+    -------
+    changes : dict
+        See `dock_simulation_tree_in_pytable`.
+    leaves : list
+        (path, group_path, sources) for the new and changed leaves; see
+        `_simulation_tree_leaves`. Leaves that failed and have not changed
+        since are left out.
+    deleted : list of str's
+        Sources in the manifest, under `study_root`, that no longer exist.
+
+    """
+    changes = {'new': [], 'changed': [], 'deleted': [], 'failed': []}
+    leaves = list()
+    scanned = set()
+    for path, group_path, sources in _simulation_tree_leaves(study_root,
+            h5_root, kwargs):
+        scanned.update(sources.keys())
+        failure = failures.get(os.path.abspath(path))
+        if failure is not None and failure[0] == _leaf_signature(path):
+            changes['failed'].append(path)
+            continue
+        elif failure is not None:
+            changes['changed'].append(path)
+        elif not any(source in manifest for source in sources):
+            changes['new'].append(path)
+        elif any(source not in manifest or
+                manifest[source][:2] != signature[:2]
+                for source, signature in sources.items()):
+            changes['changed'].append(path)
+        else:
+            continue
+        leaves.append((path, group_path, sources))
+
+    root = os.path.join(os.path.abspath(study_root), '')
+    deleted = [source for source in manifest if source.startswith(root) and
+            source not in scanned and not os.path.exists(source)]
+    changes['deleted'] = sorted(set(os.path.dirname(source)
+        for source in deleted))
+    return changes, leaves, deleted
+
+def _print_simulation_tree_changes(changes):
+    for key in ['new', 'changed', 'deleted', 'failed']:
+        print "{0} leaves: {1}".format(key.capitalize(), len(changes[key]))
+        for path in changes[key]:
+            print "    {0}".format(path)
+
+def _read_dock_manifest(h5file):
+    """The dock manifest of `h5file` as a dict; see
+    `dock_simulation_tree_in_pytable`. Keys are absolute paths to Storage
+    files, and values are (mtime, size, table path) tuples.
+
+    """
+    manifest = dict()
+    if '/dock_manifest' in h5file:
+        rows = h5file.root.dock_manifest.read()
+        for i in range(len(rows)):
+            manifest[rows['source'][i]] = (float(rows['mtime'][i]),
+                    int(rows['size'][i]), rows['table_path'][i])
+    return manifest
+
+def _write_dock_manifest(h5file, manifest):
+    """Replaces the dock manifest of `h5file`; see `_read_dock_manifest`."""
+    if '/dock_manifest' in h5file:
+        h5file.remove_node('/dock_manifest')
+    sources = sorted(manifest.keys())
+    table_paths = [manifest[source][2] for source in sources]
+    table = h5file.create_table(h5file.root, 'dock_manifest', {
+        'source': tables.StringCol(max([1] + [len(s) for s in sources])),
+        'table_path': tables.StringCol(
+            max([1] + [len(s) for s in table_paths])),
+        'mtime': tables.Float64Col(),
+        'size': tables.Int64Col()},
+        'Storage files docked in this file', expectedrows=len(sources))
+    _append_columns_to_table(table, [
+        ('source', sources),
+        ('table_path', table_paths),
+        ('mtime', [manifest[source][0] for source in sources]),
+        ('size', [manifest[source][1] for source in sources])])
+
+def _leaf_signature(path):
+    """A digest of the names, mtimes, and sizes of the files in the leaf
+    (output directory) `path`, to tell whether a leaf that failed to dock has
+    changed since.
+
+    """
+    entries = list()
+    for name in sorted(os.listdir(path)):
+        stat = os.stat(os.path.join(path, name))
+        entries.append((name, stat.st_mtime, stat.st_size))
+    return hashlib.sha1(repr(entries)).hexdigest()
+
+def _read_dock_failures(h5file):
+    """The leaves that failed to dock into `h5file`, as a dict; see
+    `dock_simulation_tree_in_pytable`. Keys are absolute paths to leaves,
+    and values are (signature, error message) tuples; see
+    `_leaf_signature`.
+
+    """
+    failures = dict()
+    if '/dock_failures' in h5file:
+        rows = h5file.root.dock_failures.read()
+        for i in range(len(rows)):
+            failures[rows['leaf'][i]] = (rows['signature'][i],
+                    rows['error'][i])
+    return failures
+
+def _write_dock_failures(h5file, failures):
+    """Replaces the record of failed leaves of `h5file`; see
+    `_read_dock_failures`.
+
+    """
+    if '/dock_failures' in h5file:
+        h5file.remove_node('/dock_failures')
+    leaves = sorted(failures.keys())
+    errors = [failures[leaf][1] for leaf in leaves]
+    table = h5file.create_table(h5file.root, 'dock_failures', {
+        'leaf': tables.StringCol(max([1] + [len(s) for s in leaves])),
+        'signature': tables.StringCol(40),
+        'error': tables.StringCol(max([1] + [len(s) for s in errors]))},
+        'Leaves that could not be docked', expectedrows=len(leaves))
+    _append_columns_to_table(table, [
+        ('leaf', leaves),
+        ('signature', [failures[leaf][0] for leaf in leaves]),
+        ('error', errors)])
+
+def _listing_kwargs(kwargs):
+    """The entries of `kwargs` (for `dock_output_in_pytable`) that are
+    arguments to `_output_storage_tables`.
+
+    """
+    listing_kwargs = dict()
+    for key in ['allow_one', 'ext', 'remove_shared_name', 'table_name_repl',
+            'silent_skip']:
+        if key in kwargs:
+            listing_kwargs[key] = kwargs[key]
+    return listing_kwargs
+
+def _storage_tables_to_parse(h5file, output_path, group_path, kwargs):
+    """The (table name, Storage file path) pairs that
+    `dock_output_in_pytable` will need to parse for this output. With
+    `overwrite_if_newer`, tables that already exist and are up to date are
+    left out. Any exception (e.g., no Storage files) is left for
+    `dock_output_in_pytable` to raise.
+
+    """
+    try:
+        storage_tables = _output_storage_tables(output_path,
+                **_listing_kwargs(kwargs))
+    except Exception:
+        return []
+    if storage_tables is None:
+        return []
+
+    if not kwargs.get('overwrite_if_newer', False):
+        return storage_tables
+
+    # Don't create any groups here; just look.
+    group = h5file.root
+    for group_name in group_path:
+        group = getattr(group, group_name, None)
+        if group is None:
+            return storage_tables
+    to_parse = list()
+    for table_name, filepath in storage_tables:
+        table = getattr(group, table_name, None)
+        mtime = None if table is None else getattr(table._v_attrs, 'mtime',
+                None)
+        if mtime is None or mtime < os.path.getmtime(filepath):
+            to_parse.append((table_name, filepath))
+    return to_parse
+
+def _parse_storage_tables(storage_tables, replacements={}):
+    """Parses Storage files for `dock_output_in_pytable`, in a worker process.
+
+    Parameters
+    ----------
+    storage_tables : list of (str, str) tuples
+        Table name and path to the Storage file.
+    replacements : dict, optional
+        See `_populate_table`.
+
+    Returns
+    -------
+    parsed_tables : dict
+        Keys are table names; values are the return value of
+        `_parse_storage_for_table`, or the exception that it raised.
+
+    """
+    parsed_tables = dict()
+    for table_name, filepath in storage_tables:
+        try:
+            parsed_tables[table_name] = _parse_storage_for_table(filepath,
+                    replacements)
+        except Exception, e:
+            parsed_tables[table_name] = e
+    return parsed_tables
 
 def dock_trc_in_pytable(h5file, trc_fpath, table_name, group_path, title='',
-        overwrite_if_newer=False):
+        overwrite_if_newer=False, profile=None, layout='rows'):
     """Write the contents of a TRC file to the database.
 
     Parameters
@@ -1295,6 +3732,10 @@ def dock_trc_in_pytable(h5file, trc_fpath, table_name, group_path, title='',
         that the newer tables can be written to the database. This is done on a
         per-table basis. Skip popluation of a table if the table already exists
         AND the data isn't any newer.
+    profile : DockProfile or str, optional
+        How to store the table; see `DockProfile` and `DOCK_PROFILES`.
+    layout : str, optional
+        'rows' or 'columns'; see `_populate_table`.
 
     Returns
     -------
@@ -1317,29 +3758,31 @@ def dock_trc_in_pytable(h5file, trc_fpath, table_name, group_path, title='',
     # then remove the existing group.
     if overwrite_if_newer:
         if hasattr(current_group, table_name):
-            if not hasattr(getattr(current_group, table_name).attrs, 'mtime'):
+            if not hasattr(getattr(current_group, table_name)._v_attrs,
+                    'mtime'):
                 raise Exception("Table exists, but is not labeled with an "
                         "mtime. Not overwriting.")
-            if (getattr(current_group, table_name).attrs.mtime <
+            if (getattr(current_group, table_name)._v_attrs.mtime <
                     os.path.getmtime(trc_fpath)):
                 getattr(current_group, table_name)._f_remove(True)
                 _populate_table_with_trc(h5file, current_group, table_name,
-                        trc_fpath)
+                        trc_fpath, profile=profile, layout=layout)
             else:
                 # Table exists and isn't newer; skip writing.
                 pass
         else:
             # Table doesn't exist; write it!
             _populate_table_with_trc(h5file, current_group, table_name,
-                    trc_fpath)
+                    trc_fpath, profile=profile, layout=layout)
     else:
         # Try to populate indiscriminantly.
-        _populate_table_with_trc(h5file, current_group, table_name, trc_fpath)
+        _populate_table_with_trc(h5file, current_group, table_name, trc_fpath,
+                profile=profile, layout=layout)
 
     # Update the attribute for when this group was last updated.
     # This must go after _populate_table, because otherwise the table is
     # not necessarily created yet.
-    getattr(current_group, table_name).attrs.mtime = \
+    getattr(current_group, table_name)._v_attrs.mtime = \
             os.path.getmtime(trc_fpath)
 
     return current_group
@@ -1373,7 +3816,8 @@ def dock_storage_in_pytable(h5file, sto_fpath, group_path, name=None,
         If no files ending in `ext` are found in `output_path`, don't make no
         fuss.
     **kwargs : optional
-        Passed onto _populate_table. May want to use the kwarg 'replacements'.
+        Passed onto _populate_table. May want to use the kwargs
+        'replacements', 'profile' (see `DockProfile`), or 'layout'.
 
     Returns
     -------
@@ -1400,9 +3844,9 @@ def dock_storage_in_pytable(h5file, sto_fpath, group_path, name=None,
         table = getattr(current_group, name, None)
         if table is not None:
             # Table exists.
-            mtime = getattr(table.attrs, 'mtime', None)
+            mtime = getattr(table._v_attrs, 'mtime', None)
             if (mtime is None or
-                    (table.attrs.mtime < os.path.getmtime(sto_fpath))):
+                    (table._v_attrs.mtime < os.path.getmtime(sto_fpath))):
                 # Table exists and ((there is newer data available) OR (we
                 # don't know how old the stored table is)).
                 getattr(current_group, name)._f_remove(True)
@@ -1424,12 +3868,13 @@ def dock_storage_in_pytable(h5file, sto_fpath, group_path, name=None,
     # This must go after _populate_table, because otherwise the table is
     # not necessarily created yet.
     if hasattr(current_group, name):
-        getattr(current_group, name).attrs.mtime = \
+        getattr(current_group, name)._v_attrs.mtime = \
                 os.path.getmtime(sto_fpath)
 
     return current_group
 
-def _populate_table_with_trc(h5file, group, table_name, trc_fpath):
+def _populate_table_with_trc(h5file, group, table_name, trc_fpath,
+        profile=None, layout='rows'):
     """Populates a pyTables file with a table, using data from CSV file at
     filepath.
 
@@ -1444,10 +3889,14 @@ def _populate_table_with_trc(h5file, group, table_name, trc_fpath):
     trc_fpath : str
         Valid path to a TRC file. We load this into memory using
         `dataman.TRCFile`.
+    profile : DockProfile or str, optional
+        How to store the table; see `DockProfile` and `DOCK_PROFILES`.
+    layout : str, optional
+        'rows' or 'columns'; see `_populate_table`.
 
     Returns
     -------
-    table : tables.Table
+    table : tables.Table or ColumnTable
         The table that has just been created.
 
     """
@@ -1465,42 +3914,53 @@ def _populate_table_with_trc(h5file, group, table_name, trc_fpath):
         col_names[i] = col_names[i].replace('.', '_')
 
     # Create pyTables table columns.
-    table_cols = dict()
-    for col in col_names:
+    columns = list()
+    for i in range(len(col_names)):
         # Checking if the column is empty. This is a
         # once-in-a-blue-moon bug fix as a result of inconsistency in
         # Hamner's files. See CMC results for subject 2, speed 2 m/s,
         # cycle 1, states_OG.sto file.
-        if col != '':
-            table_cols[col] = tables.Float32Col()
-
-    # Create pyTables table.
-    table = h5file.create_table(group, table_name, table_cols,
-            'Output file {0}'.format(trc_fpath))
+        if col_names[i] != '':
+            columns.append((col_names[i], trcf.data[orig_col_names[i]]))
 
-    # Add data to the table.
-    # ----------------------
-    # TODO could probably do this more efficiently than adding rows one by one.
-    # For each column in the data file in this row.
-    for it in range(trcf.num_frames):
-        for i in range(len(table_cols.keys())):
+    # Create pyTables table, and add data to it.
+    return _create_docked_table(h5file, group, table_name,
+            'Output file {0}'.format(trc_fpath), columns, trcf.num_frames,
+            profile=profile, layout=layout)
 
-            # Append the data into the table.
-            table.row[col_names[i]] = trcf.data[orig_col_names[i]][it]
+def _append_columns_to_table(table, columns, chunk_size=50000):
+    """Appends rows to a pyTables table, column by column. Rather than adding
+    one cell at a time, each chunk of rows is assembled in an ndarray with the
+    table's dtype and appended in one call.
 
-        # Tell pyTables to append this data to the table.
-        table.row.append()
+    Parameters
+    ----------
+    table : tables.Table
+        The table to which to append. Its columns that are not in `columns`
+        are filled with zeros.
+    columns : list of (str, array_like) tuples
+        The name of a column in `table` and its data. All data must have the
+        same length.
+    chunk_size : int, optional
+        Number of rows to append at a time. This bounds the size of the
+        temporary ndarray for huge files.
 
-    # Save (?).
+    """
+    if len(columns) == 0:
+        return
+    n_rows = len(columns[0][1])
+    for start in range(0, n_rows, chunk_size):
+        stop = min(start + chunk_size, n_rows)
+        rows = np.zeros(stop - start, dtype=table.dtype)
+        for name, values in columns:
+            rows[name] = values[start:stop]
+        table.append(rows)
     table.flush()
 
-    # Give access to it.
-    return table
-
 def dock_output_in_pytable(h5file, output_path, group_path, allow_one=False,
         title='', ext='.sto', overwrite_if_newer=False,
         remove_shared_name=True, table_name_repl={}, silent_skip=False,
-        **kwargs):
+        parsed_tables=None, **kwargs):
     """Docks an OpenSim output, via a table for each STO (see `ext`) file, in a
     pyTable file.
 
@@ -1543,8 +4003,14 @@ def dock_output_in_pytable(h5file, output_path, group_path, allow_one=False,
     silent_skip : bool, optional
         If no files ending in `ext` are found in `output_path`, don't make no
         fuss.
+    parsed_tables : dict, optional
+        Storage files that have already been parsed (e.g., by another
+        process). Keys are table names, and values are the return value of
+        `_parse_storage_for_table`, or the exception that parsing raised.
+        Tables not in this dict are parsed here.
     **kwargs : optional
-        Passed onto _populate_table. May want to use the kwarg 'replacements'.
+        Passed onto _populate_table. May want to use the kwargs
+        'replacements', 'profile' (see `DockProfile`), or 'layout'.
 
     Returns
     -------
@@ -1564,7 +4030,70 @@ def dock_output_in_pytable(h5file, output_path, group_path, allow_one=False,
     current_group = _blaze_group_trail(h5file, group_path, title)
 
     # -- Determine which files we want to use to create tables.
+    storage_tables = _output_storage_tables(output_path, allow_one=allow_one,
+            ext=ext, remove_shared_name=remove_shared_name,
+            table_name_repl=table_name_repl, silent_skip=silent_skip)
+    if storage_tables is None:
+        return None
+
+    # -- Add tables in the current group.
+
+    # Loop through all storage files.
+    for table_name, filepath in storage_tables:
+
+        parsed = None
+        if parsed_tables is not None:
+            parsed = parsed_tables.get(table_name, None)
+            if isinstance(parsed, Exception):
+                raise parsed
+
+        # If we are considering overwriting and we SHOULD overwrite (is_newer),
+        # then remove the existing group.
+        if overwrite_if_newer:
+            table = getattr(current_group, table_name, None)
+            if table is not None:
+                # Table exists.
+                mtime = getattr(table._v_attrs, 'mtime', None)
+                if (mtime is None or
+                        (table._v_attrs.mtime < os.path.getmtime(filepath))):
+                    # Table exists and ((there is newer data available) OR (we
+                    # don't know how old the stored table is)).
+                    getattr(current_group, table_name)._f_remove(True)
+                    _populate_table(h5file, current_group, table_name,
+                            filepath, parsed=parsed, **kwargs)
+                else:
+                    # Table exists and isn't newer; skip writing.
+                    pass
+            else:
+                # Table doesn't exist; write it!
+                _populate_table(h5file, current_group, table_name, filepath,
+                        parsed=parsed, **kwargs)
+        else:
+            # Try to populate indiscriminantly.
+            _populate_table(h5file, current_group, table_name, filepath,
+                    parsed=parsed, **kwargs)
+
+        # Update the attribute for when this group was last updated.
+        # This must go after _populate_table, because otherwise the table is
+        # not necessarily created yet.
+        if hasattr(current_group, table_name):
+            getattr(current_group, table_name)._v_attrs.mtime = \
+                    os.path.getmtime(filepath)
+
+    return current_group
+
+def _output_storage_tables(output_path, allow_one=False, ext='.sto',
+        remove_shared_name=True, table_name_repl={}, silent_skip=False):
+    """The Storage files in `output_path` and the names of the tables to
+    create from them. See `dock_output_in_pytable` for the parameters.
+
+    Returns
+    -------
+    storage_tables : list of (str, str) tuples
+        Table name and path to the Storage file; or None if there are no
+        Storage files and `silent_skip` is True.
 
+    """
     # Make a list of all files in this directory ending is 'sto'.
     storage_files = [f for f in os.listdir(output_path) if f.endswith(ext)]
 
@@ -1585,9 +4114,7 @@ def dock_output_in_pytable(h5file, output_path, group_path, allow_one=False,
     if remove_shared_name:
         n_shared = _length_of_shared_prefix(storage_files)
 
-    # -- Add tables in the current group.
-
-    # Loop through all storage files.
+    storage_tables = list()
     for f in storage_files:
 
         # Path to the data file.
@@ -1602,40 +4129,9 @@ def dock_output_in_pytable(h5file, output_path, group_path, allow_one=False,
             regex = re.compile(find)
             table_name = regex.sub(rep, table_name)
 
-        # If we are considering overwriting and we SHOULD overwrite (is_newer),
-        # then remove the existing group.
-        if overwrite_if_newer:
-            table = getattr(current_group, table_name, None)
-            if table is not None:
-                # Table exists.
-                mtime = getattr(table.attrs, 'mtime', None)
-                if (mtime is None or
-                        (table.attrs.mtime < os.path.getmtime(filepath))):
-                    # Table exists and ((there is newer data available) OR (we
-                    # don't know how old the stored table is)).
-                    getattr(current_group, table_name)._f_remove(True)
-                    _populate_table(h5file, current_group, table_name,
-                            filepath, **kwargs)
-                else:
-                    # Table exists and isn't newer; skip writing.
-                    pass
-            else:
-                # Table doesn't exist; write it!
-                _populate_table(h5file, current_group, table_name, filepath,
-                        **kwargs)
-        else:
-            # Try to populate indiscriminantly.
-            _populate_table(h5file, current_group, table_name, filepath,
-                    **kwargs)
-
-        # Update the attribute for when this group was last updated.
-        # This must go after _populate_table, because otherwise the table is
-        # not necessarily created yet.
-        if hasattr(current_group, table_name):
-            getattr(current_group, table_name).attrs.mtime = \
-                    os.path.getmtime(filepath)
+        storage_tables.append((table_name, filepath))
 
-    return current_group
+    return storage_tables
 
 def _blaze_group_trail(h5file, group_path, title=''):
 
@@ -1658,7 +4154,8 @@ def _blaze_group_trail(h5file, group_path, title=''):
     return current_group
 
 
-def _populate_table(h5file, group, table_name, filepath, replacements={}):
+def _populate_table(h5file, group, table_name, filepath, replacements={},
+        parsed=None, profile=None, layout='rows'):
     """Populates a pyTables file with a table, using data from CSV file at
     filepath.
 
@@ -1677,81 +4174,97 @@ def _populate_table(h5file, group, table_name, filepath, replacements={}):
         corresponding value. This is useful, for example, in converting the
         Storage column names 1_ground_force_x to l_ground_force_x. The keys can
         be regular expressions.
+    parsed : tuple, optional
+        The return value of `_parse_storage_for_table(filepath,
+        replacements)`, if the file has already been parsed (e.g., by another
+        process).
+    profile : DockProfile or str, optional
+        How to store the table; see `DockProfile` and `DOCK_PROFILES`.
+    layout : str, optional
+        'rows' (default): a tables.Table. 'columns': a group with one
+        chunked array per column (including `time`), which is much faster to
+        read one column at a time. Use `docked_table` to read either.
 
     Returns
     -------
-    table : tables.Table
+    table : tables.Table or ColumnTable
         The table that has just been created.
 
     """
-    # Open data file.
-    csvread = csv.reader(open(filepath, 'r'), delimiter='\t',
-            skipinitialspace=True)
-
-    # - Parse the data as a CSV file.
-    do_parse = False
-    take_header = False
-
-    # For each row in the CSV file.
-    for csvrow in csvread:
-
-        # If this is the header line.
-        if take_header:
-
-            # Save this row for later; we'll need it.
-            title_row = csvrow
-
-            # Can't have periods in table column names in pyTables.
-            for i in range(len(title_row)):
-                title_row[i] = title_row[i].replace('.', '_')
-                for find, rep in replacements.items():
-                    regex = re.compile(find)
-                    title_row[i] = regex.sub(rep, title_row[i])
+    if parsed is None:
+        parsed = _parse_storage_for_table(filepath, replacements)
+    table_col_names, data = parsed
+
+    # Create pyTables table, and add data to it.
+    columns = [(col, data[col]) for col in data.dtype.names
+            if col in table_col_names]
+    return _create_docked_table(h5file, group, table_name,
+            'Output file {0}'.format(table_name), columns, len(data),
+            profile=profile, layout=layout)
+
+def _parse_storage_for_table(filepath, replacements={}):
+    """Parses a Storage file, and sanitizes its column names so that they can
+    be used in a pyTables table. This does not touch the pyTables file, so it
+    can be done in another process. See `_populate_table`.
 
-            # TODO Hack to deal with bug in static optimization.
-            for bad_colname in ['Right_GRF', 'Left_GRF',
-                    'Right_GRF_transformedP', 'Left_GRF_transformedP']:
-                if bad_colname in title_row:
-                    title_row.remove(bad_colname)
-
-            take_header = False
-
-            # Grab table column names.
-            table_cols = dict()
-            for col in title_row:
-                # Checking if the column is empty. This is a
-                # once-in-a-blue-moon bug fix as a result of inconsistency in
-                # Hamner's files. See CMC results for subject 2, speed 2 m/s,
-                # cycle 1, states_OG.sto file.
-                if col != '':
-                    table_cols[col] = tables.Float32Col()
-
-            # Create pyTables table.
-            table = h5file.create_table(group, table_name, table_cols,
-                    'Output file {0}'.format(table_name))
-
-        # If this is a data row.
-        elif do_parse:
-
-            # For each column in the data file in this row.
-            for i in range(len(table_cols.keys())):
+    Returns
+    -------
+    table_col_names : list of str's
+        Names of the columns of the table.
+    data : numpy.ndarray
+        Structured ndarray, with the data for each table column.
 
-                # Append the data into the table.
-                table.row[title_row[i]] = csvrow[i]
+    """
+    # Read the header and the numeric block of the data file.
+    with open(filepath, 'r') as f:
+        _, title_row = _read_storage_header(f)
+        text = f.read()
 
-            # Tell pyTables to append this data to the table.
-            table.row.append()
+    # Can't have periods in table column names in pyTables.
+    for i in range(len(title_row)):
+        title_row[i] = title_row[i].replace('.', '_')
+        for find, rep in replacements.items():
+            regex = re.compile(find)
+            title_row[i] = regex.sub(rep, title_row[i])
 
-        # The header is over.
-        if csvrow == ['endheader']:
-            take_header = True
-            do_parse = True
+    # TODO Hack to deal with bug in static optimization.
+    for bad_colname in ['Right_GRF', 'Left_GRF',
+            'Right_GRF_transformedP', 'Left_GRF_transformedP']:
+        if bad_colname in title_row:
+            title_row.remove(bad_colname)
 
-    # Save (?).
-    table.flush()
+    # Grab table column names.
+    table_col_names = list()
+    for col in title_row:
+        # Checking if the column is empty. This is a
+        # once-in-a-blue-moon bug fix as a result of inconsistency in
+        # Hamner's files. See CMC results for subject 2, speed 2 m/s,
+        # cycle 1, states_OG.sto file.
+        if col != '' and col not in table_col_names:
+            table_col_names.append(col)
+
+    # Each table column takes the data of the first column with its name.
+    indices = [title_row.index(col) for col in table_col_names]
+    n_cols = max(indices) + 1 if indices else 0
+
+    # Parse the data, by position (names may be repeated in the file).
+    raw_names = ['c%i' % i for i in range(n_cols)]
+    data = _parse_storage_data(text, raw_names)
+    if data is None:
+        # Rows have extra entries, or comments.
+        data = np.loadtxt(text.splitlines(), usecols=range(n_cols),
+                dtype=[(col, 'float64') for col in raw_names], ndmin=1)
+
+    if indices == range(n_cols):
+        data.dtype.names = table_col_names
+    else:
+        selected = np.empty(len(data), dtype=[(col, 'float64')
+            for col in table_col_names])
+        for col, i in zip(table_col_names, indices):
+            selected[col] = data[raw_names[i]]
+        data = selected
 
-    # Give access to it.
-    return table
+    return table_col_names, data
 
 def _length_of_shared_prefix(strings):
     """Determines, from a list of strings, the length of the string that is
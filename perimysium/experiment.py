@@ -7,6 +7,13 @@ import datetime
 # TODO import difflib
 import filecmp
 import os
+import Queue
+import re
+import shlex
+import subprocess
+import threading
+import time
+import traceback
 import xml.etree.ElementTree as etree
 
 import dataman
@@ -31,7 +38,8 @@ def experiment(cmc_setup_fpath, parent_dir, name, description, fcn,
         dependencies are copied over.
     run_command : str, optional
         If CMC is to be run after all the experiment files are written, this is
-        the command to run OpenSim CMC (e.g., 'cmc').
+        the command to run OpenSim CMC (e.g., 'cmc'). It is run through the
+        shell, with the arguments '-S <setup file name>'.
     overwrite : bool, optional (default: False)
         If True, files will be written even if experiment directory already
         exists.
@@ -175,15 +183,9 @@ def experiment(cmc_setup_fpath, parent_dir, name, description, fcn,
     readme.close()
 
     if run_command:
-        curdir = os.path.abspath(os.curdir)
-        os.chdir(destination)
-        try:
-            os.system('%s -S %s' % (run_command, 
-                os.path.basename(cmc_input['setup'])))
-        except:
-            os.chdir(curdir)
-            raise
-        os.chdir(curdir)
+        run_tool(run_command, cmc_input['setup'], destination, shell=True)
+
+    return cmc_input['setup']
 
 
 def static_optimization_experiment(
@@ -209,7 +211,8 @@ def static_optimization_experiment(
     run_command : str, optional
         If static optimization is to be run after all the experiment files are
         written, this is the command to run OpenSim static optimization (e.g.,
-        'analyze').
+        'analyze'). It is run through the shell, with the arguments
+        '-S <setup file name>'.
     overwrite : bool, optional (default: False)
         If True, files will be written even if experiment directory already
         exists.
@@ -351,12 +354,229 @@ def static_optimization_experiment(
     readme.close()
 
     if run_command:
-        curdir = os.path.abspath(os.curdir)
-        os.chdir(destination)
+        run_tool(run_command, so_input['setup'], destination, shell=True)
+
+    return so_input['setup']
+
+
+def run_tool(run_command, setup_fpath, destination, stdout=None,
+        stderr=None, shell=False):
+    """Runs an OpenSim tool executable on a setup file, from within
+    `destination`. The process's working directory is not changed, so this
+    can be called from multiple threads at once.
+
+    Parameters
+    ----------
+    run_command : str
+        The command to run the tool (e.g., 'cmc'); it is given the arguments
+        '-S <setup file name>'. Unless `shell` is True, it is split into
+        arguments like a shell would (see `shlex.split`), but is not run
+        through a shell, so redirects, '&&', and variables are passed to the
+        tool as arguments.
+    setup_fpath : str
+        The setup file; only its name is used, as it must be in
+        `destination`.
+    destination : str
+        Directory in which to run the tool.
+    stdout, stderr : file, optional
+        Where to send the tool's output. By default, it goes to this
+        process's stdout and stderr.
+    shell : bool, optional (default: False)
+        Run '<run_command> -S <setup file name>' through the shell, as
+        `experiment` and `static_optimization_experiment` do. A missing
+        executable is then reported by the shell (exit code 127).
+
+    Returns
+    -------
+    exit_code : int
+
+    Raises
+    ------
+    OSError
+        If `shell` is False and the tool's executable can't be run (e.g., it
+        does not exist).
+
+    """
+    if shell:
+        return subprocess.call('%s -S %s' % (run_command,
+            os.path.basename(setup_fpath)), shell=True, cwd=destination,
+            stdout=stdout, stderr=stderr)
+    return subprocess.call(shlex.split(run_command) +
+            ['-S', os.path.basename(setup_fpath)], cwd=destination,
+            stdout=stdout, stderr=stderr)
+
+
+# Lines that `run_experiments` appends to an experiment's README, and which
+# it reads back when resuming.
+_PREPARED_FORMAT = 'Prepared in %.2f s.\n'
+_RAN_FORMAT = "Ran '%s': exit code %i, wall time %.2f s.\n"
+_RAN_REGEX = re.compile(r"^Ran '.*': exit code (-?\d+), wall time")
+
+def _readme_status(destination):
+    """(prepared, exit code of the last run or None), from the README of an
+    experiment run by `run_experiments`.
+
+    """
+    readme_fpath = os.path.join(destination, 'README.txt')
+    prepared = False
+    exit_code = None
+    if os.path.exists(readme_fpath):
+        for line in open(readme_fpath):
+            if line.startswith('Prepared in '):
+                prepared = True
+            match = _RAN_REGEX.match(line)
+            if match:
+                exit_code = int(match.group(1))
+    return prepared, exit_code
+
+def run_experiments(setup_fpath, parent_dir, specs, run_command=None,
+        tool='cmc', n_workers=None, minimal=True, resume=True,
+        overwrite=False, verbose=True):
+    """Prepares (and optionally runs) many experiments at once, each as
+    `experiment` or `static_optimization_experiment` would. Up to `n_workers`
+    experiments are prepared and run at the same time; the tool executables
+    are launched with `subprocess`, in each experiment's directory (no
+    global chdir).
+
+    The output of each run is saved in the experiment directory as
+    stdout.txt and stderr.txt, and the wall time and exit code of the run
+    are appended to the experiment's README.txt. If the batch is interrupted
+    or some runs fail, call this again with the same arguments: experiments
+    whose last run succeeded are skipped, prepared experiments are only run
+    again, and the remaining experiments are prepared and run.
+
+    The workers are threads, since most of the time is spent in the tool
+    executables, and since `fcn`'s are often closures (which cannot be sent
+    to other processes). The `fcn`'s must not change the working directory.
+
+    Parameters
+    ----------
+    setup_fpath : str
+        The CMC or static optimization setup file the experiments are based
+        on.
+    parent_dir : str
+        Each experiment is placed in `parent_dir`/`name`.
+    specs : list of (str, str, function)
+        The (name, description, fcn) of each experiment; see `experiment`.
+    run_command : str, optional
+        The command to run the tool (e.g., 'cmc'). If not given, the
+        experiments are only prepared. Unlike in `experiment`, it is not run
+        through a shell (see `run_tool`).
+    tool : str, optional
+        'cmc' (see `experiment`) or 'so' (see
+        `static_optimization_experiment`).
+    n_workers : int, optional
+        Number of experiments prepared and run at a time. By default, the
+        number of CPUs.
+    minimal : bool, optional
+        See `experiment`.
+    resume : bool, optional (default: True)
+        Skip (or only run) the experiments that were completed (or prepared)
+        by a previous call. If False, existing experiment directories are an
+        error, unless `overwrite`.
+    overwrite : bool, optional (default: False)
+        See `experiment`.
+    verbose : bool, optional (default: True)
+        Print the outcome of each experiment as it finishes.
+
+    Returns
+    -------
+    results : list of dict
+        For each spec, in order: 'name', 'destination', 'status' ('skipped',
+        'prepared', 'succeeded', or 'failed'), 'exit_code' and 'wall_time'
+        of the run (None if there was no run), and 'error' (the traceback if
+        preparing the experiment raised an exception, or None).
+
+    """
+    if tool == 'cmc':
+        prepare = experiment
+    elif tool == 'so':
+        prepare = static_optimization_experiment
+    else:
+        raise Exception("`tool` must be 'cmc' or 'so', not '%s'." % tool)
+    if n_workers == None:
+        n_workers = _cpu_count()
+
+    def run_one(name, description, fcn):
+        destination = os.path.join(parent_dir, name)
+        result = {'name': name, 'destination': destination,
+                'status': 'failed', 'exit_code': None, 'wall_time': None,
+                'error': None}
+        prepared, exit_code = False, None
+        if resume and os.path.exists(destination):
+            prepared, exit_code = _readme_status(destination)
+        if prepared and (run_command == None or exit_code == 0):
+            result['status'] = 'skipped'
+            result['exit_code'] = exit_code
+            return result
         try:
-            os.system('%s -S %s' % (run_command, 
-                os.path.basename(so_input['setup'])))
-        except:
-            os.chdir(curdir)
-            raise
-        os.chdir(curdir)
+            if prepared:
+                tool_setup_fpath = os.path.join(destination,
+                        os.path.basename(setup_fpath))
+            else:
+                start = time.time()
+                tool_setup_fpath = prepare(setup_fpath, parent_dir, name,
+                        description, fcn, minimal=minimal,
+                        overwrite=overwrite or (resume and
+                            os.path.exists(destination)))
+                with open(os.path.join(destination, 'README.txt'), 'a') as f:
+                    f.write(_PREPARED_FORMAT % (time.time() - start))
+        except Exception:
+            result['error'] = traceback.format_exc()
+            return result
+        if run_command == None:
+            result['status'] = 'prepared'
+            return result
+
+        with open(os.path.join(destination, 'stdout.txt'), 'w') as out:
+            with open(os.path.join(destination, 'stderr.txt'), 'w') as err:
+                start = time.time()
+                try:
+                    exit_code = run_tool(run_command, tool_setup_fpath,
+                            destination, stdout=out, stderr=err)
+                except OSError:
+                    result['error'] = traceback.format_exc()
+                    return result
+                wall_time = time.time() - start
+        with open(os.path.join(destination, 'README.txt'), 'a') as f:
+            f.write(_RAN_FORMAT % (run_command, exit_code, wall_time))
+        result['exit_code'] = exit_code
+        result['wall_time'] = wall_time
+        if exit_code == 0:
+            result['status'] = 'succeeded'
+        return result
+
+    # A bounded pool of worker threads, fed from a queue of spec indices.
+    results = [None] * len(specs)
+    todo = Queue.Queue()
+    for i in range(len(specs)):
+        todo.put(i)
+    print_lock = threading.Lock()
+
+    def worker():
+        while True:
+            try:
+                i = todo.get_nowait()
+            except Queue.Empty:
+                return
+            results[i] = run_one(*specs[i])
+            if verbose:
+                with print_lock:
+                    print "%s: %s" % (results[i]['name'],
+                            results[i]['status'])
+
+    threads = [threading.Thread(target=worker)
+            for i in range(min(n_workers, len(specs)))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+def _cpu_count():
+    try:
+        import multiprocessing
+        return multiprocessing.cpu_count()
+    except (ImportError, NotImplementedError):
+        return 1
@@ -6,15 +6,17 @@ results.
 
 import collections
 import copy
+import multiprocessing
 import os
 import re
+from multiprocessing.pool import ThreadPool
 
 import numpy as np
 import matplotlib
 import matplotlib.pyplot as plt
 import pylab as pl
 import tables
-from scipy.signal import butter, filtfilt
+from scipy.signal import butter, filtfilt, lfilter, sosfilt, sosfilt_zi
 from scipy.stats import nanmean, nanstd
 
 from perimysium import dataman
@@ -69,36 +71,33 @@ def marker_error(model_filepath, states_storage, marker_trc_filepath,
     for mname in marker_names:
         data[mname] = []
 
-    def marker_error_for_frame(model, state, data, marker_names, trc):
+    def model_markers_for_frame(model, state, data, marker_names):
         for mname in marker_names:
             marker = model.getMarkerSet().get(mname)
             modelMarkerPosInGround = opensim.Vec3()
             engine.transformPosition(state,
                     marker.getBody(), marker.getOffset(),
                     model.getGroundBody(), modelMarkerPosInGround)
-            expMarkerPosInGround = trc.marker_at(mname, state.getTime())
 
             a = modelMarkerPosInGround
-            b = np.array(expMarkerPosInGround) * 0.001
-            distance = np.sqrt(
-                    (a.get(0) - b[0])**2 +
-                    (a.get(1) - b[1])**2 +
-                    (a.get(2) - b[2])**2
-                    )
-            data[mname].append(distance)
+            data[mname].append([a.get(0), a.get(1), a.get(2)])
 
     time, _ = modeling.analysis(m, states_storage,
-            lambda m, s: marker_error_for_frame(m, s, data, marker_names, trc),
+            lambda m, s: model_markers_for_frame(m, s, data, marker_names),
             indegrees=indegrees
             )
 
+    # Experimental marker locations at all times, for all markers, at once.
+    exp_markers = trc.markers_at(marker_names, time) * 0.001
+
     n_times = len(data[marker_names[0]])
     marker_err = np.empty(n_times, dtype={'names': ['time'] + marker_names,
         'formats': (len(marker_names) + 1) * ['f4']})
 
     marker_err['time'] = time
-    for mname in marker_names:
-        marker_err[mname] = data[mname]
+    for imark, mname in enumerate(marker_names):
+        diff = np.array(data[mname]) - exp_markers[:, imark, :]
+        marker_err[mname] = np.sqrt(np.sum(diff**2, axis=1))
 
     return marker_err
 
@@ -195,6 +194,111 @@ def filter_emg(raw_signal, sampling_rate, bandpass_order=6,
     filtered_signal : array_like
 
     """
+    design = _emg_filter_design(sampling_rate, bandpass_order,
+            bandpass_lower_frequency, bandpass_upper_frequency,
+            lowpass_order, lowpass_frequency, cd_lowpass_frequency)
+    return _filter_emg(design, np.asarray(raw_signal, dtype=float))
+
+def filter_emg_many(emg, sampling_rate=None, names=None, axis=0,
+        n_workers=1, **kwargs):
+    """Filters many raw EMG signals at once, as `filter_emg` does for one.
+    Each step (bandpass, rectify, lowpass, critically damped lowpass) is
+    applied to all the signals in one call. The filters are designed once per
+    sampling rate and set of parameters, and kept for the rest of the
+    process.
+
+    Parameters
+    ----------
+    emg : array_like, or dataman.ANCFile
+        Raw EMG signals: an array with time along `axis` (by default,
+        (n_samples, n_channels)), or the channels `names` of an ANC file.
+    sampling_rate : float, optional
+        In Hertz. Required for an array; for an ANCFile, the default is the
+        rate of the channels, which must all be sampled at the same rate.
+    names : list of str's, optional
+        For an ANCFile, the channels to filter. By default, all channels.
+    axis : int, optional
+        For an array, the axis along which to filter (time).
+    n_workers : int, optional (default: 1)
+        If greater than 1, the signals are split into this many groups,
+        which are filtered in a pool of threads (scipy's filters release
+        the GIL).
+    **kwargs :
+        The filter parameters of `filter_emg` (bandpass_order, etc.).
+
+    Returns
+    -------
+    filtered : numpy.ndarray
+        For an array, the filtered signals, of the same shape. For an
+        ANCFile, a structured ndarray with a 'time' column and the filtered
+        channels.
+
+    """
+    if isinstance(emg, dataman.ANCFile):
+        if names == None:
+            names = emg.names
+        if sampling_rate == None:
+            rates = set(emg.rates[name] for name in names)
+            if len(rates) != 1:
+                raise Exception("Channels are sampled at different rates %s; "
+                        "provide `sampling_rate`." % sorted(rates))
+            sampling_rate = rates.pop()
+        signals = np.empty((len(names), len(emg.data)))
+        for i, name in enumerate(names):
+            signals[i] = emg.data[name]
+        filtered = filter_emg_many(signals, sampling_rate, axis=1,
+                n_workers=n_workers, **kwargs)
+        data = np.empty(len(emg.data), dtype=[('time', 'f8')] +
+                [(name, 'f8') for name in names])
+        data['time'] = emg.time
+        for i, name in enumerate(names):
+            data[name] = filtered[i]
+        return data
+
+    if sampling_rate == None:
+        raise Exception('`sampling_rate` is required for an array.')
+    design = _emg_filter_design(sampling_rate, **kwargs)
+
+    # The filters are fastest along the last, contiguous axis.
+    signals = np.moveaxis(np.asarray(emg, dtype=float), axis, -1)
+    shape = signals.shape
+    signals = np.ascontiguousarray(signals.reshape(-1, shape[-1]))
+    if n_workers > 1 and len(signals) > 1:
+        pool = ThreadPool(n_workers)
+        try:
+            filtered = np.concatenate(pool.map(
+                lambda group: _filter_emg(design, group),
+                np.array_split(signals, min(n_workers, len(signals)))))
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+    else:
+        filtered = _filter_emg(design, signals)
+    return np.moveaxis(filtered.reshape(shape), -1, axis)
+
+# Designs of the filters used by `filter_emg`, keyed by the sampling rate and
+# filter parameters; see `_emg_filter_design`.
+_emg_filter_designs = dict()
+
+def _emg_filter_design(sampling_rate, bandpass_order=6,
+        bandpass_lower_frequency=50, bandpass_upper_frequency=500,
+        lowpass_order=4,
+        lowpass_frequency=7.5,
+        cd_lowpass_frequency=15.0):
+    """The coefficients of the filters in `filter_emg` (same parameters), as
+    a dict with (b, a) for 'bandpass', 'lowpass', and 'critically_damped'
+    (one pass). Designed once per set of arguments.
+
+    """
+    key = (sampling_rate, bandpass_order, bandpass_lower_frequency,
+            bandpass_upper_frequency, lowpass_order, lowpass_frequency,
+            cd_lowpass_frequency)
+    if key in _emg_filter_designs:
+        return _emg_filter_designs[key]
+
     nyquist_frequency = 0.5 * sampling_rate
 
     # Bandpass.
@@ -202,51 +306,232 @@ def filter_emg(raw_signal, sampling_rate, bandpass_order=6,
     normalized_bandpass_lower = bandpass_lower_frequency / nyquist_frequency
     normalized_bandpass_upper = bandpass_upper_frequency / nyquist_frequency
     bandpass_cutoffs = [normalized_bandpass_lower, normalized_bandpass_upper]
-    bandpass_b, bandpass_a = butter(bandpass_order, bandpass_cutoffs,
-            btype='bandpass')
 
-    bandpassed = filtfilt(bandpass_b, bandpass_a, raw_signal)
+    # Lowpass.
+    # --------
+    lowpass_cutoff = lowpass_frequency / nyquist_frequency
+
+    design = {
+            'bandpass': butter(bandpass_order, bandpass_cutoffs,
+                btype='bandpass'),
+            'lowpass': butter(lowpass_order, lowpass_cutoff),
+            'critically_damped': _critically_damped_coefficients(
+                sampling_rate, cd_lowpass_frequency, 4),
+            }
+    _emg_filter_designs[key] = design
+    return design
+
+def _filter_emg(design, signals):
+    """Applies the filters of `filter_emg`, with coefficients `design`, along
+    the last axis of `signals`.
+
+    """
+    # Bandpass.
+    b, a = design['bandpass']
+    bandpassed = filtfilt(b, a, signals)
 
     # Rectify.
-    # --------
     rectified = np.abs(bandpassed)
 
     # Lowpass.
-    # --------
-    lowpass_cutoff = lowpass_frequency / nyquist_frequency
-    lowpass_b, lowpass_a = butter(lowpass_order, lowpass_cutoff)
-
-    lowpassed = filtfilt(lowpass_b, lowpass_a, rectified)
+    b, a = design['lowpass']
+    lowpassed = filtfilt(b, a, rectified)
 
     # Critically damped filter.
-    # -------------------------
-    cd_order = 4
-    cdfed = filter_critically_damped(lowpassed, sampling_rate,
-            cd_lowpass_frequency, order=4)
+    b, a = design['critically_damped']
+    return _critically_damped(b, a, lowpassed, 4)
+
+class EMGFilter(object):
+    """A causal version of `filter_emg`, for filtering EMG one block of
+    samples at a time as it is recorded (e.g., to monitor an experiment
+    while it runs). The filter state is kept between blocks, so the output
+    is the same however the signal is split into blocks, and each block is
+    available as soon as it has been filtered.
+
+    The steps are those of `filter_emg` (bandpass, rectify, lowpass,
+    critically damped lowpass), but each filter is applied only forward
+    (`sosfilt`), once, with the critically damped filter's `order` passes
+    applied in series. Hence, unlike `filter_emg`, the output lags the
+    signal (by tens of milliseconds, with the default cutoff frequencies),
+    and the filters are only half as steep.
+
+    Examples
+    --------
+    Filter an ANC file block by block:
+
+        >>> emg_filter = EMGFilter(2000, 16)
+        >>> for block in dataman.anc2numpy_chunks('<filename>', 100):
+        ...     channels = block.view(np.float64).reshape(len(block), -1)
+        ...     filtered = emg_filter.filter(channels[:, 1:])
+
+    See also `filter_emg_stream`.
+
+    """
+    def __init__(self, sampling_rate, n_channels, bandpass_order=6,
+            bandpass_lower_frequency=50, bandpass_upper_frequency=500,
+            lowpass_order=4, lowpass_frequency=7.5, cd_lowpass_frequency=15.0,
+            cd_order=4):
+        """
+        Parameters
+        ----------
+        sampling_rate : float
+            In Hertz.
+        n_channels : int
+            Number of signals filtered together; blocks have shape
+            (n_samples, n_channels).
+        cd_order : int, optional
+            Number of passes of the critically damped filter.
+
+        The remaining parameters are those of `filter_emg`.
+
+        """
+        nyquist_frequency = 0.5 * sampling_rate
+        self.sampling_rate = sampling_rate
+        self.n_channels = n_channels
+        self._bandpass_sos = butter(bandpass_order,
+                [bandpass_lower_frequency / nyquist_frequency,
+                    bandpass_upper_frequency / nyquist_frequency],
+                btype='bandpass', output='sos')
+        # The lowpass filter and critically damped passes, in series.
+        b, a = _critically_damped_coefficients(sampling_rate,
+                cd_lowpass_frequency, cd_order)
+        self._lowpass_sos = np.vstack([butter(lowpass_order,
+            lowpass_frequency / nyquist_frequency, output='sos')] +
+            cd_order * [np.concatenate([b, a])])
+        self.reset()
+
+    def reset(self):
+        """Forget the signal filtered so far."""
+        self._bandpass_zi = None
+        self._lowpass_zi = np.zeros((len(self._lowpass_sos), 2,
+            self.n_channels))
+
+    def filter(self, block):
+        """Filters the next block of samples.
+
+        Parameters
+        ----------
+        block : array_like
+            Shape (n_samples, n_channels).
+
+        Returns
+        -------
+        filtered : numpy.ndarray
+            Same shape as `block`.
+
+        """
+        block = np.asarray(block, dtype=float)
+        if block.ndim != 2 or block.shape[1] != self.n_channels:
+            raise Exception('Expected a block of shape (n_samples, %i), got '
+                    '%s.' % (self.n_channels, block.shape))
+        if len(block) == 0:
+            return block.copy()
+        if self._bandpass_zi is None:
+            # Start in the steady state for the first sample, to avoid a
+            # transient from any DC offset in the signal.
+            self._bandpass_zi = (sosfilt_zi(self._bandpass_sos)[:, :, None]
+                    * block[0])
+        bandpassed, self._bandpass_zi = sosfilt(self._bandpass_sos, block,
+                axis=0, zi=self._bandpass_zi)
+        filtered, self._lowpass_zi = sosfilt(self._lowpass_sos,
+                np.abs(bandpassed), axis=0, zi=self._lowpass_zi)
+        return filtered
+
+def filter_emg_stream(fpath, names=None, chunk_rows=100, volts=False,
+        **kwargs):
+    """Filters the EMG channels of an ANC (or ANB) file with an `EMGFilter`,
+    reading and filtering `chunk_rows` rows at a time. This is a generator;
+    each block is a structured ndarray with a 'time' column and the filtered
+    channels.
+
+    Parameters
+    ----------
+    fpath : str
+        Valid file path to an ANC (.anc) or ANB (.anb) file.
+    names : list of str's, optional
+        The channels to filter. By default, all channels, which must all be
+        sampled at the same rate.
+    chunk_rows : int, optional
+        Number of rows in each block; sets the latency.
+    volts : bool, optional
+        See `dataman.anc2numpy_chunks`.
+    **kwargs :
+        Passed on to `EMGFilter`.
 
-    return cdfed
+    """
+    emg_filter = None
+    for chunk in dataman.anc2numpy_chunks(fpath, chunk_rows, volts=volts):
+        if emg_filter == None:
+            if names == None:
+                names = chunk.dtype.names[1:]
+            emg_filter = EMGFilter(_anc_rate(fpath, names), len(names),
+                    **kwargs)
+            dtype = [('time', 'f8')] + [(name, 'f8') for name in names]
+        channels = np.empty((len(chunk), len(names)))
+        for i, name in enumerate(names):
+            channels[:, i] = chunk[name]
+        filtered = emg_filter.filter(channels)
+        block = np.empty(len(chunk), dtype=dtype)
+        block['time'] = chunk['time']
+        for i, name in enumerate(names):
+            block[name] = filtered[:, i]
+        yield block
+
+def _anc_rate(fpath, names):
+    """The sampling rate shared by the channels `names` of an ANC file."""
+    with open(fpath, 'rb') as f:
+        meta, _ = dataman.ANCFile._parse_header(f)
+    rates = set(meta['rates'][name] for name in names)
+    if len(rates) != 1:
+        raise Exception("Channels are sampled at different rates %s."
+                % sorted(rates))
+    return rates.pop()
 
 def filter_critically_damped(data, sampling_rate, lowpass_cutoff_frequency,
-        order=4):
+        order=4, axis=0):
     """See Robertson, 2003. This code is transcribed from some MATLAB code that
     Amy Silder gave me. This implementation is slightly different from that
     appearing in Robertson, 2003. We only allow lowpass filtering.
 
+    Each pass is a second-order recursive filter, applied with `lfilter`, and
+    the direction alternates between passes (for order = 4, we go forward,
+    backward, forward, backward). As in the MATLAB code, the first two
+    samples of each pass are set to zero, and the filter starts at the third
+    sample from the first two input samples and zero past outputs. For an
+    odd `order`, the result is in reverse order.
+
     Parameters
     ----------
     data : array_like
-        The signal to filter.
+        The signal to filter. May be 2-D (e.g., one column per channel), in
+        which case all signals are filtered at once along `axis`.
     sampling_rate : float
     lowpass_cutoff_frequency : float
         In Hertz (not normalized).
     order : int, optional
         Number of filter passes.
+    axis : int, optional
+        The axis of `data` along which to filter (time).
 
     Returns
     -------
     data : array_like
         Filtered data.
 
+    """
+    b, a = _critically_damped_coefficients(sampling_rate,
+            lowpass_cutoff_frequency, order)
+
+    # lfilter is fastest along the last, contiguous axis.
+    data = np.ascontiguousarray(np.moveaxis(
+        np.asarray(data, dtype=float), axis, -1))
+    return np.moveaxis(_critically_damped(b, a, data, order), -1, axis)
+
+def _critically_damped_coefficients(sampling_rate, lowpass_cutoff_frequency,
+        order):
+    """Numerator and denominator, for `lfilter`, of one pass of the
+    critically damped filter; see `filter_critically_damped`.
+
     """
     # 3 dB cutoff correction.
     Clp = (2.0 ** (1.0 / (2.0 * order)) - 1.0) ** (-0.5)
@@ -269,22 +554,29 @@ def filter_critically_damped(data, sampling_rate, lowpass_cutoff_frequency,
     b1lp = 2.0 * a0lp  * (1.0 / K2lp - 1.0)
     b2lp = 1.0 - (a0lp + a1lp + a2lp + b1lp)
 
-    num_rows = len(data)
-    temp_filtered = np.zeros(num_rows)
-    # For order = 4, we go forward, backward, forward, backward.
-    for n_pass in range(order):
-        for i in range(2, num_rows):
-            temp_filtered[i] = (a0lp * data[i] +
-                    a1lp * data[i - 1] +
-                    a2lp * data[i - 2] +
-                    b1lp * temp_filtered[i - 1] +
-                    b2lp * temp_filtered[i - 2])
-        # Perform the filter backwards.
-        data = np.flipud(temp_filtered)
-        temp_filtered = np.zeros(num_rows)
+    # y[i] = a0 x[i] + a1 x[i-1] + a2 x[i-2] + b1 y[i-1] + b2 y[i-2].
+    return np.array([a0lp, a1lp, a2lp]), np.array([1.0, -b1lp, -b2lp])
 
+def _critically_damped(b, a, data, order):
+    """`order` passes, in alternating directions, along the last axis."""
+    for n_pass in range(order):
+        data = _critically_damped_pass(b, a, data)[..., ::-1]
     return data
 
+def _critically_damped_pass(b, a, data):
+    """One forward pass along the last axis of `data`, with zero output
+    for the first two samples.
+
+    """
+    filtered = np.zeros_like(data)
+    if data.shape[-1] > 2:
+        # State of the (transposed direct form II) filter after the first two
+        # inputs, with zero outputs.
+        zi = np.stack([b[1] * data[..., 1] + b[2] * data[..., 0],
+            b[2] * data[..., 1]], axis=-1)
+        filtered[..., 2:] = lfilter(b, a, data[..., 2:], zi=zi)[0]
+    return filtered
+
 
 def metabolic_expenditure_const_eff(power, exclude=None, concentric_eff=0.25,
         eccentric_eff=-1.20):
@@ -811,7 +1103,8 @@ def plot_simulation_verification(sim_group, **kwargs):
     Parameters
     ----------
     sim_group : tables.Group
-        A pyTables group holding tables docked from a simulation (e.g., CMC).
+        A pyTables group holding tables docked from a simulation (e.g., CMC),
+        with either layout (see `dataman.docked_table`).
     n_max : int, optional
         Plots the n_max maximum columns. By default, all columns are plotted.
         If n_max = 5, only the 5 most errorful columns are plotted.
@@ -827,19 +1120,18 @@ def plot_simulation_verification(sim_group, **kwargs):
         Figure handle, or list of handles.
 
     """
+    pErr = dataman.docked_table(sim_group.pErr)
+    actforce = dataman.docked_table(sim_group.Actuation_force)
     if 'show_legend' in kwargs and kwargs['show_legend']:
-        figk = plot_kinematics_verification(sim_group.pErr, **kwargs)
-        figrd = plot_residuals_verification(sim_group.Actuation_force, **kwargs)
-        figrv = plot_reserves_verification(sim_group.Actuation_force, **kwargs)
+        figk = plot_kinematics_verification(pErr, **kwargs)
+        figrd = plot_residuals_verification(actforce, **kwargs)
+        figrv = plot_reserves_verification(actforce, **kwargs)
         return [figk, figrd, figrv]
     else:
         fig = pl.figure(figsize=(15, 8))
-        plot_kinematics_verification(sim_group.pErr, big_picture=(3, 0),
-                **kwargs)
-        plot_residuals_verification(sim_group.Actuation_force,
-                big_picture=(3, 1), **kwargs)
-        plot_reserves_verification(sim_group.Actuation_force,
-                big_picture=(3, 2), **kwargs)
+        plot_kinematics_verification(pErr, big_picture=(3, 0), **kwargs)
+        plot_residuals_verification(actforce, big_picture=(3, 1), **kwargs)
+        plot_reserves_verification(actforce, big_picture=(3, 2), **kwargs)
         return fig
 
 
@@ -917,7 +1209,9 @@ def plot_rra_gait_info(rra_results_dir, gl=None):
     legend_kwargs = {'loc': 'best', 'prop': {'size': 12}, 'frameon': False}
 
     pErr = dataman.storage2numpy(pErr_fpath)
-    actu = dataman.storage2numpy(actu_fpath)
+    # Only the residuals are plotted.
+    actu = dataman.storage2numpy(actu_fpath,
+            usecols=['time', 'FX', 'FY', 'FZ', 'MX', 'MY', 'MZ'])
 
     fig = pl.figure(figsize=(12, 24))
     pl.subplot(621)
@@ -1975,15 +2269,17 @@ def verify_simulation(sim_group):
     Parameters
     ----------
     sim_group : tables.Group
-        A pyTables group holding tables docked from a simulation (e.g., CMC).
+        A pyTables group holding tables docked from a simulation (e.g., CMC),
+        with either layout (see `dataman.docked_table`).
 
     """
+    actforce = dataman.docked_table(sim_group.Actuation_force)
     print 'Kinematics:'
-    verify_kinematics(sim_group.pErr)
+    verify_kinematics(dataman.docked_table(sim_group.pErr))
     print '\nResiduals:'
-    verify_residuals(sim_group.Actuation_force)
+    verify_residuals(actforce)
     print '\nReserves:'
-    verify_reserves(sim_group.Actuation_force)
+    verify_reserves(actforce)
 
 
 def _evaluate_threshold(val, good_thresh, okay_thresh):
@@ -2125,7 +2421,8 @@ def plot_activations(sim, muscles=None, interval=10, subplot_width=4,
     Parameters
     ----------
     sim : tables.Group, or dict/collections.OrderedDict of tables.Group's
-        A pyTables group holding tables docked from a simulation (e.g., CMC).
+        A pyTables group holding tables docked from a simulation (e.g., CMC),
+        with either layout (see `dataman.docked_table`).
     muscles : list of str's, optional
         The names of muscle for which to plot activations. By default, plots
         activations for all muscles.
@@ -2172,9 +2469,13 @@ def plot_activations(sim, muscles=None, interval=10, subplot_width=4,
 
     """
     # TODO average both limbs.
+    if type(sim) == dict or type(sim) == collections.OrderedDict:
+        sim_group = sim.values()[0]
+    else:
+        sim_group = sim
     if muscles == None:
         muscles = [m
-                for m in sim_group.states.colnames
+                for m in dataman.docked_table(sim_group.states).colnames
                 if m.endswith('activation')]
     else:
         temp_muscles = [m + '_activation' for m in muscles]
@@ -2195,8 +2496,9 @@ def plot_activations(sim, muscles=None, interval=10, subplot_width=4,
 
     # Used below.
     def plot_single_sim_activation(sim, muscle, **kwargs):
-        x = sim.states.cols.time[::interval]
-        y = sim.states.col(muscle)[::interval]
+        states = dataman.docked_table(sim.states)
+        x = states.cols.time[::interval]
+        y = states.col(muscle)[::interval]
         if shift_data != None:
             x, y = shift_data_to_cycle(
                     shift_data['arbitrary_cycle_start_time'],
@@ -2238,7 +2540,8 @@ def plot_muscle_forces(sim, muscles=None, interval=10, subplot_width=4,
     Parameters
     ----------
     sim : tables.Group, or dict/collections.OrderedDict of tables.Group's
-        A pyTables group holding tables docked from a simulation (e.g., CMC).
+        A pyTables group holding tables docked from a simulation (e.g., CMC),
+        with either layout (see `dataman.docked_table`).
     muscles : list of str's, optional
         The names of muscle for which to plot forces. By default, plots
         forces for all muscles.
@@ -2292,8 +2595,12 @@ def plot_muscle_forces(sim, muscles=None, interval=10, subplot_width=4,
 
     """
     # TODO average both limbs.
+    if type(sim) == dict or type(sim) == collections.OrderedDict:
+        sim_group = sim.values()[0]
+    else:
+        sim_group = sim
     if muscles == None:
-        muscles = sim_group.Actuation_force.colnames
+        muscles = dataman.docked_table(sim_group.Actuation_force).colnames
 
     n_muscles = len(muscles)
 
@@ -2310,8 +2617,9 @@ def plot_muscle_forces(sim, muscles=None, interval=10, subplot_width=4,
 
     # Used below.
     def plot_single_sim_muscle_force(i, sim, muscle, shiftinfo, **kwargs):
-        x = sim.Actuation_force.cols.time[::interval]
-        y = sim.Actuation_force.col(muscle)[::interval]
+        actforce = dataman.docked_table(sim.Actuation_force)
+        x = actforce.cols.time[::interval]
+        y = actforce.col(muscle)[::interval]
         if shift_data != None:
             x, y = shift_data_to_cycle(
                     shiftinfo['arbitrary_cycle_start_time'],
@@ -2563,11 +2871,19 @@ def gait_landmarks_from_grf(mot_file,
         max_time=None,
         plot_width=6,
         show_legend=True,
+        hysteresis=None,
+        min_duration=None,
+        interpolate=False,
         ):
     """
     Obtain gait landmarks (right and left foot strike & toe-off) from ground
     reaction force (GRF) time series data.
 
+    By default, a foot is in contact with the ground wherever the magnitude
+    of its vertical GRF is at least `threshold`. For noisy force plate data,
+    `hysteresis` and `min_duration` prevent spurious events, and
+    `interpolate` gives event times between samples.
+
     Parameters
     ----------
     mot_file : str
@@ -2591,6 +2907,20 @@ def gait_landmarks_from_grf(mot_file,
         If plotting, this is the width of the plotting window in inches.
     show_legend : bool, optional
         If plotting, show a legend.
+    hysteresis : float, optional
+        If set, contact begins only once the force reaches `threshold` +
+        `hysteresis`, and ends once it falls below `threshold` (so noise
+        around `threshold` does not create events).
+    min_duration : float, optional
+        If set, periods of contact, and then periods without contact, that
+        are shorter than this (in seconds) are ignored (merged into the
+        surrounding periods). Periods at the start or end of the data are
+        kept.
+    interpolate : bool, optional (default: False)
+        Give the times at which the force crosses the (contact or no
+        contact) threshold, linearly interpolated between samples, instead
+        of the times of the samples at which contact begins or ends.
+
     Returns
     -------
     right_foot_strikes : np.array
@@ -2605,7 +2935,8 @@ def gait_landmarks_from_grf(mot_file,
         Same as above, but for the left foot.
 
     """
-    data = dataman.storage2numpy(mot_file)
+    data = dataman.storage2numpy(mot_file, usecols=['time',
+        right_grfy_column_name, left_grfy_column_name])
 
     time = data['time']
     right_grfy = data[right_grfy_column_name]
@@ -2618,33 +2949,12 @@ def gait_landmarks_from_grf(mot_file,
     if min_time == None: min_idx = 1
     else: min_idx = max(1, nearest_index(time, min_time))
 
-    index_range = range(min_idx, max_idx)
-
-    # Helper functions
-    # ----------------
-    def zero(number):
-        return abs(number) < threshold
-
-    def birth_times(ordinate):
-        births = list()
-        for i in index_range:
-            # 'Skip' first value because we're going to peak back at previous
-            # index.
-            if zero(ordinate[i - 1]) and (not zero(ordinate[i])):
-                births.append(time[i])
-        return np.array(births)
-
-    def death_times(ordinate):
-        deaths = list()
-        for i in index_range:
-            if (not zero(ordinate[i - 1])) and zero(ordinate[i]):
-                deaths.append(time[i])
-        return np.array(deaths)
-
-    right_foot_strikes = birth_times(right_grfy)
-    left_foot_strikes = birth_times(left_grfy)
-    right_toe_offs = death_times(right_grfy)
-    left_toe_offs = death_times(left_grfy)
+    right_foot_strikes, right_toe_offs = _contact_transitions(time,
+            right_grfy, threshold, min_idx, max_idx, hysteresis, min_duration,
+            interpolate)
+    left_foot_strikes, left_toe_offs = _contact_transitions(time,
+            left_grfy, threshold, min_idx, max_idx, hysteresis, min_duration,
+            interpolate)
 
     if do_plot:
 
@@ -2690,6 +3000,268 @@ def gait_landmarks_from_grf(mot_file,
     return right_foot_strikes, left_foot_strikes, right_toe_offs, left_toe_offs
 
 
+def _contact_transitions(time, grfy, threshold, min_idx=1, max_idx=None,
+        hysteresis=None, min_duration=None, interpolate=False):
+    """The foot strikes and toe-offs in a vertical GRF signal; see
+    `gait_landmarks_from_grf`. Only transitions at indices in [`min_idx`,
+    `max_idx`) are reported.
+
+    Returns
+    -------
+    strikes : np.array
+    offs : np.array
+
+    """
+    if max_idx == None: max_idx = len(time)
+    magnitude = np.abs(grfy)
+    off = magnitude < threshold
+    if hysteresis == None:
+        contact = ~off
+        on_level = threshold
+    else:
+        on_level = threshold + hysteresis
+        on = magnitude >= on_level
+        # Between the two levels, the foot stays in its previous state, which
+        # is that of the most recent sample outside the band.
+        decided = on | off
+        decided[0] = True
+        level = on.copy()
+        level[0] = not off[0]
+        last_decided = np.maximum.accumulate(
+                np.where(decided, np.arange(len(decided)), 0))
+        contact = level[last_decided]
+
+    if min_duration != None and len(contact) > 0:
+        # Drop short periods of contact, then short periods without.
+        contact = _drop_short_runs(time, contact, min_duration)
+        contact = ~_drop_short_runs(time, ~contact, min_duration)
+
+    # Transitions at index i are between samples i - 1 and i.
+    change = np.diff(contact.astype(np.int8))
+    window = slice(max(min_idx, 1) - 1, max(max_idx - 1, 0))
+    strikes = np.flatnonzero(change[window] == 1) + window.start + 1
+    offs = np.flatnonzero(change[window] == -1) + window.start + 1
+
+    if not interpolate:
+        return time[strikes], time[offs]
+    return (_crossing_times(time, magnitude, strikes, on_level),
+            _crossing_times(time, magnitude, offs, threshold))
+
+def _drop_short_runs(time, mask, min_duration):
+    """`mask`, without the runs of True that last less than `min_duration`
+    and are preceded and followed by False.
+
+    """
+    change = np.diff(mask.astype(np.int8))
+    starts = np.flatnonzero(change == 1) + 1
+    ends = np.flatnonzero(change == -1) + 1
+    # Only runs that start and end within the data.
+    ends = ends[ends > starts[0]] if len(starts) > 0 else ends[:0]
+    starts = starts[:len(ends)]
+    short = (time[ends] - time[starts]) < min_duration
+    if not short.any():
+        return mask
+    delta = np.zeros(len(mask) + 1, dtype=int)
+    np.add.at(delta, starts[short], 1)
+    np.add.at(delta, ends[short], -1)
+    return mask & (np.cumsum(delta[:-1]) == 0)
+
+def _crossing_times(time, magnitude, indices, level):
+    """Times, linearly interpolated between samples `indices` - 1 and
+    `indices`, at which `magnitude` crosses `level`.
+
+    """
+    before = magnitude[indices - 1]
+    after = magnitude[indices]
+    span = after - before
+    fraction = np.ones(len(indices))
+    nonzero = span != 0
+    fraction[nonzero] = (level - before[nonzero]) / span[nonzero]
+    fraction = np.clip(fraction, 0, 1)
+    return time[indices - 1] + fraction * (time[indices] - time[indices - 1])
+
+
+# The options of `gait_landmarks_from_grf` that `index_gait_cycles` passes on.
+_GAIT_EVENT_OPTIONS = ['threshold', 'hysteresis', 'min_duration',
+        'interpolate']
+
+def index_gait_cycles(source, index_fpath=None, pattern=r'.*\.mot$',
+        n_workers=1, verbose=True,
+        right_grfy_column_name='ground_force_vy',
+        left_grfy_column_name='1_ground_force_vy',
+        **kwargs):
+    """Finds every complete gait cycle in every trial of a study, and
+    collects them in a `dataman.GaitCycleIndex`. The gait events of each
+    trial are detected from its vertical GRF as in `gait_landmarks_from_grf`.
+    A complete cycle starts at a foot strike of its primary leg, ends at the
+    next strike of the same leg, and contains a toe-off of the primary leg
+    and a strike and a toe-off of the other leg (the first of each after
+    the start of the cycle are used). Each trial contributes the cycles of
+    both legs.
+
+    Parameters
+    ----------
+    source : str
+        A directory tree containing GRF (OpenSim Storage) files, or an HDF5
+        file (e.g., from `dataman.dock_simulation_tree_in_pytable`); in the
+        latter case, every table with both GRF columns is a trial.
+    index_fpath : str, optional
+        If given, save the index here ('.npz' or '.h5'; see
+        `dataman.GaitCycleIndex.write()`).
+    pattern : str, optional
+        For a directory tree, the regular expression that the paths of GRF
+        files (relative to `source`) must match (`re.match`).
+    n_workers : int, optional (default: 1)
+        Number of processes that read trials and detect events.
+    verbose : bool, optional (default: True)
+        Prints the number of cycles found in each trial, and any exceptions.
+    right_grfy_column_name, left_grfy_column_name : str, optional
+        See `gait_landmarks_from_grf`.
+    **kwargs :
+        The event detection options of `gait_landmarks_from_grf`:
+        threshold, hysteresis, min_duration, interpolate.
+
+    Returns
+    -------
+    index : dataman.GaitCycleIndex
+        The trials are named by their path relative to `source`, or by their
+        path in the HDF5 file.
+
+    """
+    unknown = sorted(set(kwargs) - set(_GAIT_EVENT_OPTIONS))
+    if len(unknown) != 0:
+        raise Exception("Unrecognized options %s; the options are %s." % (
+            unknown, _GAIT_EVENT_OPTIONS))
+    columns = (right_grfy_column_name, left_grfy_column_name)
+    if os.path.isdir(source):
+        trials = list()
+        for dirpath, dirnames, filenames in os.walk(source):
+            dirnames.sort()
+            for fname in sorted(filenames):
+                relpath = os.path.relpath(os.path.join(dirpath, fname),
+                        source)
+                if re.match(pattern, relpath):
+                    trials.append((source, relpath, columns, kwargs))
+    else:
+        h5file = tables.open_file(source, mode='r')
+        try:
+            trials = [(source, path, columns, kwargs)
+                    for path in _grf_table_paths(h5file, columns)]
+        finally:
+            h5file.close()
+
+    if n_workers > 1:
+        pool = multiprocessing.Pool(n_workers)
+        try:
+            results = pool.map(_trial_gait_cycles, trials)
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+    else:
+        results = [_trial_gait_cycles(trial) for trial in trials]
+
+    exception_count = 0
+    for trial, (cycles, error) in zip(trials, results):
+        if error != None:
+            exception_count += 1
+            print "Exception for trial {0}: {1}".format(trial[1], error)
+        elif verbose:
+            print "{0}: {1} gait cycles.".format(trial[1], len(cycles))
+    if verbose:
+        print "Number of exceptions: %i" % exception_count
+
+    index = dataman.GaitCycleIndex(data=dataman.GaitCycleIndex.concatenate(
+        [cycles for cycles, error in results if error == None]))
+    if index_fpath != None:
+        index.write(index_fpath)
+    return index
+
+def _grf_table_paths(h5file, columns):
+    """Paths of the docked tables (either layout) in `h5file` that have all
+    of `columns`, and 'time'.
+
+    """
+    paths = list()
+    for node in h5file.walk_nodes('/'):
+        if isinstance(node, tables.Table) or (isinstance(node, tables.Group)
+                and getattr(node._v_attrs, 'dock_layout', None) ==
+                'columns'):
+            colnames = dataman.docked_table(node).colnames
+            if all(name in colnames for name in ('time',) + columns):
+                paths.append(node._v_pathname)
+    return paths
+
+def _trial_gait_cycles(trial):
+    """The gait cycles of one trial, for `index_gait_cycles`, as
+    (structured ndarray, None), or (None, error message). Reads the trial's
+    GRF; this runs in the worker processes.
+
+    """
+    source, name, columns, kwargs = trial
+    try:
+        if os.path.isdir(source):
+            data = dataman.storage2numpy(os.path.join(source, name),
+                    usecols=('time',) + columns)
+            time = data['time']
+            grfys = [data[column] for column in columns]
+        else:
+            h5file = tables.open_file(source, mode='r')
+            try:
+                table = dataman.docked_table(h5file.get_node(name))
+                time = table.col('time')
+                grfys = [table.col(column) for column in columns]
+            finally:
+                h5file.close()
+        threshold = kwargs.get('threshold', 1e-5)
+        options = [kwargs.get(key) for key in ['hysteresis', 'min_duration']]
+        interpolate = kwargs.get('interpolate', False)
+        right_strikes, right_toeoffs = _contact_transitions(time, grfys[0],
+                threshold, 1, len(time), *options, interpolate=interpolate)
+        left_strikes, left_toeoffs = _contact_transitions(time, grfys[1],
+                threshold, 1, len(time), *options, interpolate=interpolate)
+        cycles = _complete_gait_cycles(right_strikes, left_strikes,
+                right_toeoffs, left_toeoffs)
+        data = dataman.GaitCycleIndex.empty(len(cycles), max(1, len(name)))
+        for field in cycles.dtype.names[1:]:
+            data[field] = cycles[field]
+        data['trial'] = name
+        return data, None
+    except Exception, e:
+        return None, str(e)
+
+def _complete_gait_cycles(right_strikes, left_strikes, right_toeoffs,
+        left_toeoffs):
+    """The complete gait cycles (see `index_gait_cycles`) for the given
+    (sorted) gait events, as rows of a `dataman.GaitCycleIndex`.
+
+    """
+    events = {'right_strike': right_strikes, 'left_strike': left_strikes,
+            'right_toeoff': right_toeoffs, 'left_toeoff': left_toeoffs}
+    datas = list()
+    for leg, other in [('right', 'left'), ('left', 'right')]:
+        strikes = events[leg + '_strike']
+        starts = strikes[:-1]
+        ends = strikes[1:]
+        data = dataman.GaitCycleIndex.empty(len(starts))
+        data['primary_leg'] = leg
+        data['cycle_start'] = starts
+        data['cycle_end'] = ends
+        data[leg + '_strike'] = starts
+        complete = np.ones(len(starts), dtype=bool)
+        for name in [leg + '_toeoff', other + '_strike', other + '_toeoff']:
+            # The first event after the start of each cycle.
+            times = np.append(events[name], np.inf)
+            first = times[np.searchsorted(times, starts, side='right')]
+            complete &= first < ends
+            data[name] = first
+        datas.append(data[complete])
+    data = np.concatenate(datas)
+    return data[np.argsort(data['cycle_start'], kind='mergesort')]
+
+
 def plot_force_plate_data(mot_file):
     """Plots all force componenets, center of pressure components, and moment
     components, for both legs.
@@ -2933,7 +3505,7 @@ def contrib_of_one_muscle_about_coordinates(
         'formats': (n_coords + 1) * ['f4']})
     first_coord = True
     for coord in coord_names:
-        table = getattr(group, '%s_%s' % (qty, coord))
+        table = dataman.docked_table(getattr(group, '%s_%s' % (qty, coord)))
         if first_coord:
             times = np.linspace(table.cols.time[0], table.cols.time[-1],
                     n_times)
@@ -0,0 +1,185 @@
+"""Benchmarks for reading and writing data files. Run this file directly:
+
+    $ python perimysium/tests/bench_dataman.py
+
+"""
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import tables
+
+from perimysium import dataman
+
+from helpers import best_time, write_anc, write_cmc_setup
+
+def _write_synthetic_storage(fpath, n_rows, n_cols):
+    names = ['time'] + ['col%i' % i for i in range(n_cols - 1)]
+    data = np.empty(n_rows, dtype={'names': names,
+        'formats': n_cols * ['float64']})
+    data['time'] = np.linspace(0, 1, n_rows)
+    for name in names[1:]:
+        data[name] = np.random.randn(n_rows)
+    dataman.ndarray2storage(data, fpath)
+
+def bench_storage2numpy(n_rows=10000, n_cols=300):
+    tmpdir = tempfile.mkdtemp()
+    try:
+        fpath = os.path.join(tmpdir, 'states.sto')
+        _write_synthetic_storage(fpath, n_rows, n_cols)
+        t_old = best_time(
+                lambda: dataman._storage2numpy_genfromtxt(fpath))
+        t_new = best_time(lambda: dataman.storage2numpy(fpath))
+        t_usecols = best_time(lambda: dataman.storage2numpy(fpath,
+            usecols=['time', 'col0', 'col1']))
+        # Rows are split up to the last requested column.
+        t_usecols_last = best_time(lambda: dataman.storage2numpy(fpath,
+            usecols=['time', 'col%i' % (n_cols - 3), 'col%i' % (n_cols - 2)]))
+    finally:
+        shutil.rmtree(tmpdir)
+    print('storage2numpy, %i rows x %i columns:' % (n_rows, n_cols))
+    print('    genfromtxt:  %.3f s' % t_old)
+    print('    single-pass: %.3f s (%.1fx)' % (t_new, t_old / t_new))
+    print('    3 usecols:   %.3f s (%.1fx)' % (t_usecols, t_old / t_usecols))
+    print('    3 usecols, last columns: %.3f s (%.1fx)' % (t_usecols_last,
+        t_old / t_usecols_last))
+
+def _write_synthetic_anc(fpath, n_rows, n_channels):
+    names = ['A%i' % i for i in range(n_channels)]
+    data = np.empty(n_rows, dtype=[(name, 'f8') for name in names])
+    for name in names:
+        data[name] = np.random.randint(-32768, 32768, n_rows)
+    write_anc(fpath, data, 1000, 10000)
+    return names
+
+def bench_ancfile(n_rows=100000, n_channels=32):
+    tmpdir = tempfile.mkdtemp()
+    try:
+        fpath = os.path.join(tmpdir, 'analog.anc')
+        names = _write_synthetic_anc(fpath, n_rows, n_channels)
+        dtype = {'names': ['time'] + names,
+                'formats': (n_channels + 1) * ['float64']}
+        t_old = best_time(lambda: np.loadtxt(fpath, delimiter='\t',
+            skiprows=8, dtype=dtype), 1)
+        t_new = best_time(lambda: dataman.ANCFile(fpath))
+        anb_fpath = dataman.anc2anb(fpath)
+        t_anb = best_time(lambda: dataman.ANCFile(anb_fpath))
+    finally:
+        shutil.rmtree(tmpdir)
+    print('ANCFile, %i rows x %i channels:' % (n_rows, n_channels))
+    print('    loadtxt:     %.3f s' % t_old)
+    print('    bulk parse:  %.3f s (%.1fx)' % (t_new, t_old / t_new))
+    print('    .anb:        %.3f s (%.1fx)' % (t_anb, t_old / t_anb))
+
+def bench_writers(n_rows=10000, n_cols=300, n_markers=100):
+    tmpdir = tempfile.mkdtemp()
+    try:
+        names = ['time'] + ['col%i' % i for i in range(n_cols - 1)]
+        data = np.empty(n_rows, dtype={'names': names,
+            'formats': n_cols * ['float64']})
+        for name in names:
+            data[name] = np.random.randn(n_rows)
+        fpath = os.path.join(tmpdir, 'out.sto')
+        t = best_time(lambda: dataman.ndarray2storage(data, fpath), 1)
+        print('ndarray2storage, %i rows x %i columns: %.3f s, %.1f MB/s' % (
+            n_rows, n_cols, t, os.path.getsize(fpath) / 1e6 / t))
+
+        time = np.linspace(0, 1, n_rows)
+        trc = dataman.TRCFile(data_rate=100.0, camera_rate=100.0,
+                num_frames=n_rows, num_markers=0, units='mm',
+                orig_data_rate=100.0, orig_data_start_frame=1,
+                orig_num_frames=n_rows, time=time)
+        for i in range(n_markers):
+            trc.add_marker('M%i' % i, 1000 * np.random.randn(n_rows),
+                    1000 * np.random.randn(n_rows),
+                    1000 * np.random.randn(n_rows))
+        fpath = os.path.join(tmpdir, 'out.trc')
+        t = best_time(lambda: trc.write(fpath), 1)
+        print('TRCFile.write, %i frames x %i markers: %.3f s, %.1f MB/s' % (
+            n_rows, n_markers, t, os.path.getsize(fpath) / 1e6 / t))
+    finally:
+        shutil.rmtree(tmpdir)
+
+def bench_dock_simulation_tree(n_leaves=40, n_rows=2000, n_cols=300,
+        n_workers_list=[1, 2, 4]):
+    tmpdir = tempfile.mkdtemp()
+    try:
+        study_root = os.path.join(tmpdir, 'study')
+        for i in range(n_leaves):
+            output = os.path.join(study_root, 'run%03i' % i, 'output')
+            os.makedirs(output)
+            for name in ['states', 'controls']:
+                _write_synthetic_storage(
+                        os.path.join(output, 'cmc_%s.sto' % name),
+                        n_rows, n_cols)
+        print('dock_simulation_tree_in_pytable, %i leaves of 2 x %i rows x '
+                '%i columns:' % (n_leaves, n_rows, n_cols))
+        for n_workers in n_workers_list:
+            h5fname = os.path.join(tmpdir, 'study%i.h5' % n_workers)
+            start = time.time()
+            dataman.dock_simulation_tree_in_pytable(h5fname, study_root,
+                    ['study'], verbose=False, n_workers=n_workers)
+            print('    n_workers=%i: %.3f s' % (n_workers, time.time() - start))
+    finally:
+        shutil.rmtree(tmpdir)
+
+def bench_dock_profiles(n_rows=10000, n_cols=300):
+    tmpdir = tempfile.mkdtemp()
+    try:
+        fpath = os.path.join(tmpdir, 'states.sto')
+        _write_synthetic_storage(fpath, n_rows, n_cols)
+        float64 = dataman.DockProfile(complib='blosc:lz4', complevel=5,
+                chunk_bytes=2**20, float64=True)
+        runs = [('default', 'default', 'rows'),
+                ('blosc', 'blosc', 'rows'),
+                ('zlib', 'zlib', 'rows'),
+                ('blosc, float64', float64, 'rows'),
+                ('default, columns', 'default', 'columns'),
+                ('blosc, columns', 'blosc', 'columns')]
+        print('dock profiles, %i rows x %i columns:' % (n_rows, n_cols))
+        for i_run, (label, profile, layout) in enumerate(runs):
+            h5fname = os.path.join(tmpdir, 'profile%i.h5' % i_run)
+            start = time.time()
+            h5file = tables.open_file(h5fname, mode='w')
+            dataman.dock_storage_in_pytable(h5file, fpath, 'group',
+                    name='states', profile=profile, layout=layout)
+            h5file.close()
+            t_write = time.time() - start
+            h5file = tables.open_file(h5fname, mode='r')
+            table = dataman.docked_table(h5file.root.group.states)
+            def read_columns():
+                for name in table.colnames:
+                    table.col(name)
+            t_read = best_time(read_columns, n_repeat=1)
+            h5file.close()
+            print('    %-17s write %.3f s, %6.1f MB, read all columns %.3f s'
+                    % (label, t_write, os.path.getsize(h5fname) / 1e6, t_read))
+    finally:
+        shutil.rmtree(tmpdir)
+
+def bench_setup_inputs(n_experiments=200):
+    tmpdir = tempfile.mkdtemp()
+    try:
+        fpath = write_cmc_setup(tmpdir)
+        def resolve(clear):
+            for i in range(n_experiments):
+                if clear:
+                    dataman._xml_trees.clear()
+                    dataman._resolved_paths.clear()
+                dataman.cmc_input_fpaths(fpath)
+        t_uncached = best_time(lambda: resolve(True))
+        t_cached = best_time(lambda: resolve(False))
+        print('cmc_input_fpaths, %i experiments: %.4f s uncached, '
+                '%.4f s cached' % (n_experiments, t_uncached, t_cached))
+    finally:
+        shutil.rmtree(tmpdir)
+
+if __name__ == '__main__':
+    bench_storage2numpy()
+    bench_writers()
+    bench_ancfile()
+    bench_dock_simulation_tree()
+    bench_dock_profiles()
+    bench_setup_inputs()
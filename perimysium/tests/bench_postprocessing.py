@@ -0,0 +1,87 @@
+"""Benchmarks for filtering EMG. Run this file directly:
+
+    $ python perimysium/tests/bench_postprocessing.py
+
+"""
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from perimysium import dataman
+from perimysium import postprocessing as pproc
+
+from helpers import best_time, gait_landmarks_loop, synthetic_grf
+
+def bench_emg_filter_latency(sampling_rate=2000, n_channels=32,
+        block_sizes=[20, 100, 500], n_blocks=200):
+    """Time to filter one block with EMGFilter, and the number of channels
+    that could be filtered in real time (filtering a block takes as long as
+    recording it).
+
+    """
+    print('EMGFilter, %i Hz, %i channels:' % (sampling_rate, n_channels))
+    for block_size in block_sizes:
+        block_duration = float(block_size) / sampling_rate
+        emg = np.random.randn(n_blocks * block_size, n_channels)
+        emg_filter = pproc.EMGFilter(sampling_rate, n_channels)
+        latencies = list()
+        for i in range(n_blocks):
+            block = emg[i * block_size:(i + 1) * block_size]
+            start = time.time()
+            emg_filter.filter(block)
+            latencies.append(time.time() - start)
+        latency = np.median(latencies)
+
+        # The cost of a block grows with the number of channels; estimate
+        # the per-channel cost from a large number of channels.
+        wide = np.random.randn(block_size, 16 * n_channels)
+        wide_filter = pproc.EMGFilter(sampling_rate, 16 * n_channels)
+        per_channel = best_time(lambda: wide_filter.filter(wide),
+                n_repeat=10) / (16 * n_channels)
+        print('    block of %4i samples (%5.1f ms): median %.3f ms, '
+                'max %.3f ms; about %i channels in real time'
+                % (block_size, 1000 * block_duration, 1000 * latency,
+                    1000 * max(latencies), block_duration / per_channel))
+
+def bench_filter_emg_many(sampling_rate=2000, duration=180, n_channels=16):
+    emg = np.random.randn(duration * sampling_rate, n_channels)
+    t_loop = best_time(lambda: [pproc.filter_emg(emg[:, i], sampling_rate)
+        for i in range(n_channels)], n_repeat=1)
+    t_many = best_time(lambda: pproc.filter_emg_many(emg, sampling_rate),
+            n_repeat=1)
+    print('filter_emg, %i s x %i channels: %.2f s one at a time, %.2f s '
+            'with filter_emg_many' % (duration, n_channels, t_loop, t_many))
+
+def bench_gait_landmarks(duration=600, sampling_rate=2000):
+    """A synthetic treadmill trial: half-sine vertical GRF, with noise."""
+    data = synthetic_grf(duration, sampling_rate)
+    time_ = data['time']
+    for name in ['ground_force_vy', '1_ground_force_vy']:
+        data[name] += np.random.uniform(-2, 2, len(time_))
+    tmpdir = tempfile.mkdtemp()
+    try:
+        fpath = os.path.join(tmpdir, 'grf.mot')
+        dataman.ndarray2storage(data, fpath)
+        t_loop = best_time(lambda: [gait_landmarks_loop(time_, data[name],
+            threshold=5.0) for name in ['ground_force_vy',
+                '1_ground_force_vy']], n_repeat=1)
+        t_engine = best_time(lambda: [pproc._contact_transitions(time_,
+            data[name], 5.0, hysteresis=5.0, min_duration=0.05,
+            interpolate=True) for name in ['ground_force_vy',
+                '1_ground_force_vy']])
+        t_file = best_time(lambda: pproc.gait_landmarks_from_grf(fpath,
+            threshold=5.0))
+        print('gait landmarks, %i min at %i Hz: per-sample loop %.2f s, '
+                'vectorized (hysteresis, debouncing, interpolation) %.3f s; '
+                'gait_landmarks_from_grf, including reading the file, %.2f s'
+                % (duration / 60, sampling_rate, t_loop, t_engine, t_file))
+    finally:
+        shutil.rmtree(tmpdir)
+
+if __name__ == '__main__':
+    bench_emg_filter_latency()
+    bench_filter_emg_many()
+    bench_gait_landmarks()
@@ -0,0 +1,104 @@
+"""Functions shared by the tests and benchmarks."""
+import os
+import time
+
+import numpy as np
+
+def best_time(fcn, n_repeat=3):
+    """The fastest of `n_repeat` calls to `fcn`, in seconds."""
+    times = list()
+    for i in range(n_repeat):
+        start = time.time()
+        fcn()
+        times.append(time.time() - start)
+    return min(times)
+
+def write_anc(fpath, data, rate, ranges):
+    """Writes an ANC file of raw A/D counts.
+
+    Parameters
+    ----------
+    fpath : str
+    data : numpy.ndarray
+        Structured ndarray with a field for the counts of each channel.
+    rate : float
+        Sampling rate (Hz) of all channels; the time column starts at 0.
+    ranges : float, or list of float's
+        Range (mV) of each channel, or of all channels.
+
+    """
+    names = list(data.dtype.names)
+    if np.isscalar(ranges):
+        ranges = len(names) * [ranges]
+    n_rows = len(data)
+    with open(fpath, 'w') as f:
+        f.write('File_Type:\tNumeric\tGeneration#:\t1\n')
+        f.write('Board_Type:\tNational\tPolarity:\tBipolar\n')
+        f.write('Trial_Name:\ttrial\tTrial#:\t1\tDuration(Sec.):\t%.3f\t'
+                '#Channels:\t%i\n' % (n_rows / float(rate), len(names)))
+        f.write('BitDepth:\t16\tPreciseRate:\t%.1f\n\n' % rate)
+        f.write('Name\t%s\n' % '\t'.join(names))
+        f.write('Rate\t%s\n' % '\t'.join(len(names) * ['%i' % rate]))
+        f.write('Range\t%s\n' % '\t'.join('%i' % r for r in ranges))
+        np.savetxt(f, np.column_stack([np.arange(n_rows) / float(rate)] +
+            [data[name] for name in names]),
+            fmt=['%.6f'] + len(names) * ['%i'], delimiter='\t')
+
+def write_cmc_setup(root):
+    """Writes a CMC setup file, and (placeholder) input files for it, to the
+    directory `root`. Returns the path to the setup file.
+
+    """
+    for name in ['model.osim', 'tasks.xml', 'actu1.xml', 'actu2.xml',
+            'constraints.xml', 'kinematics.mot', 'grf.mot']:
+        open(os.path.join(root, name), 'w').write('<a/>')
+    open(os.path.join(root, 'extloads.xml'), 'w').write(
+            '<ExternalLoads><datafile>grf.mot</datafile>'
+            '<external_loads_model_kinematics_file> '
+            '</external_loads_model_kinematics_file></ExternalLoads>')
+    fpath = os.path.join(root, 'setup.xml')
+    open(fpath, 'w').write('<CMCTool>'
+            '<results_directory>out</results_directory>'
+            '<model_file>model.osim</model_file>'
+            '<task_set_file>tasks.xml</task_set_file>'
+            '<force_set_files>actu1.xml actu2.xml</force_set_files>'
+            '<constraints_file>constraints.xml</constraints_file>'
+            '<desired_kinematics_file>kinematics.mot</desired_kinematics_file>'
+            '<coordinates_file>kinematics.mot</coordinates_file>'
+            '<external_loads_file>extloads.xml</external_loads_file>'
+            '</CMCTool>')
+    return fpath
+
+def gait_landmarks_loop(time, grfy, threshold=1e-5, min_idx=1, max_idx=None):
+    """The original per-sample implementation of gait event detection in
+    `postprocessing.gait_landmarks_from_grf`, as a reference. Returns the
+    times at which `grfy` becomes nonzero, and the times at which it becomes
+    zero, checking samples `min_idx` through `max_idx - 1`.
+
+    """
+    if max_idx == None:
+        max_idx = len(time)
+    zero = lambda number: abs(number) < threshold
+    births = [time[i] for i in range(min_idx, max_idx)
+            if zero(grfy[i - 1]) and not zero(grfy[i])]
+    deaths = [time[i] for i in range(min_idx, max_idx)
+            if not zero(grfy[i - 1]) and zero(grfy[i])]
+    return np.array(births), np.array(deaths)
+
+def synthetic_grf(duration, sampling_rate=1000, stride_time=1.1,
+        stance_fraction=0.6):
+    """Half-sine vertical GRF for each leg ('ground_force_vy' and
+    '1_ground_force_vy'), the left half a stride behind, as a structured
+    ndarray with a 'time' field.
+
+    """
+    times = np.arange(int(duration * sampling_rate)) / float(sampling_rate)
+    data = np.empty(len(times), dtype=[('time', 'f8'),
+        ('ground_force_vy', 'f8'), ('1_ground_force_vy', 'f8')])
+    data['time'] = times
+    for name, offset in [('ground_force_vy', 0.1),
+            ('1_ground_force_vy', 0.1 + 0.5 * stride_time)]:
+        phase = ((times - offset) % stride_time) / (stride_time *
+                stance_fraction)
+        data[name] = np.where(phase < 1, 800 * np.sin(np.pi * phase), 0)
+    return data
@@ -1 +1,798 @@
 """ TODO """
+import collections
+import copy
+import multiprocessing
+import os
+import shutil
+
+import numpy as np
+import pytest
+import tables
+from numpy import testing
+
+from perimysium import dataman
+
+from helpers import write_anc, write_cmc_setup
+
+parentdir = os.path.abspath(os.path.dirname(__file__))
+
+def test_storage2numpy():
+    fpath = os.path.join(parentdir, 'double_pendulum_states.sto')
+    data = dataman.storage2numpy(fpath)
+    data_des = dataman._storage2numpy_genfromtxt(fpath)
+    assert data.dtype.names == data_des.dtype.names
+    testing.assert_equal(data.shape, data_des.shape)
+    for coln in data.dtype.names:
+        testing.assert_array_equal(data[coln], data_des[coln])
+
+def test_storage2numpy_excess_header_entries(tmpdir):
+    fpath = str(tmpdir.join('so_force.sto'))
+    f = open(fpath, 'w')
+    f.write('so_force\nversion=1\nnRows=2\nnColumns=3\ninDegrees=no\n'
+            'endheader\n')
+    f.write('time\tsoleus_r\ttib_ant.r\tRight_GRF\n')
+    f.write('0.0\t1.5\t-2.0\n')
+    f.write('0.1\t1.6\t-2.1\n')
+    f.close()
+    data = dataman.storage2numpy(fpath, excess_header_entries=1)
+    assert data.dtype.names == ('time', 'soleus_r', 'tib_antr')
+    testing.assert_array_equal(data['tib_antr'], [-2.0, -2.1])
+
+def test_storage2numpy_fallback(tmpdir):
+    # The comment can't be handled by the fast parser; falls back to
+    # np.genfromtxt.
+    fpath = str(tmpdir.join('comment.sto'))
+    f = open(fpath, 'w')
+    f.write('comment\nendheader\ntime\ta\tb\n0.0\t1.0\t2.0\n'
+            '0.1\t1.1\t2.1 # last row\n')
+    f.close()
+    data = dataman.storage2numpy(fpath)
+    testing.assert_array_equal(data['time'], [0.0, 0.1])
+    testing.assert_array_equal(data['b'], [2.0, 2.1])
+
+def test_remove_fields_from_structured_ndarray():
+    fpath = os.path.join(parentdir, 'double_pendulum_states.sto')
+    data = dataman.storage2numpy(fpath)
+    view = dataman.remove_fields_from_structured_ndarray(data, ['q1', 'q2_u'],
+            copy=False)
+    assert view.dtype.names == ('time', 'q2', 'q1_u')
+    assert np.may_share_memory(view, data)
+    testing.assert_array_equal(view['q2'], data['q2'])
+    copy = dataman.remove_fields_from_structured_ndarray(data, 'q1')
+    assert copy.dtype.names == ('time', 'q2', 'q1_u', 'q2_u')
+    assert copy.dtype.itemsize == 4 * 8
+    assert not np.may_share_memory(copy, data)
+    testing.assert_array_equal(copy['q2_u'], data['q2_u'])
+
+def test_column_array():
+    fpath = os.path.join(parentdir, 'double_pendulum_states.sto')
+    data = dataman.storage2numpy(fpath)
+    columns = dataman.ColumnArray.from_structured(data)
+    assert columns.names == list(data.dtype.names)
+    assert len(columns) == len(data)
+    assert columns.values.shape == (len(data), 5)
+    testing.assert_array_equal(columns.col('q2'), data['q2'])
+    assert columns.col('q2').flags['C_CONTIGUOUS']
+    testing.assert_array_equal(columns.to_structured(), data)
+
+    removed = dataman.remove_fields_from_structured_ndarray(columns,
+            ['q1', 'time'])
+    assert removed.names == ['q2', 'q1_u', 'q2_u']
+    assert np.may_share_memory(removed.col('q2'), columns.col('q2'))
+    testing.assert_array_equal(removed.values[:, 1], data['q1_u'])
+
+    # Adding columns to either doesn't affect the other.
+    buffer_before = columns._buffer
+    for i in range(20):
+        removed.add_column('extra%i' % i, i * np.ones(len(data)))
+        columns.add_column('other%i' % i, -i * np.ones(len(data)))
+    assert 'extra3' not in columns
+    testing.assert_array_equal(removed['extra3'], 3)
+    testing.assert_array_equal(columns['other3'], -3)
+    testing.assert_array_equal(columns['q2'], data['q2'])
+    testing.assert_array_equal(removed['q2'], data['q2'])
+    assert columns._buffer is not buffer_before
+    # Capacity grows geometrically.
+    assert len(columns._buffer) >= len(columns.names)
+    with pytest.raises(Exception):
+        columns.add_column('q2', data['q2'])
+
+def test_storage2numpy_usecols(tmpdir):
+    fpath = os.path.join(parentdir, 'double_pendulum_states.sto')
+    expected = dataman.storage2numpy(fpath)
+    data = dataman.storage2numpy(fpath, usecols=['q2', 'time'])
+    assert data.dtype.names == ('time', 'q2')
+    testing.assert_array_equal(data['q2'], expected['q2'])
+    data = dataman.storage2numpy(fpath, usecols=['time', 'q._u'])
+    assert data.dtype.names == ('time', 'q1_u', 'q2_u')
+    testing.assert_array_equal(data['q1_u'], expected['q1_u'])
+    data = dataman.storage2numpy(fpath, usecols=['q1'])
+    assert data.dtype.names == ('q1',)
+    testing.assert_array_equal(data['q1'], expected['q1'])
+    with pytest.raises(Exception):
+        dataman.storage2numpy(fpath, usecols=['time', 'q3'])
+
+    # Fields after the last requested column are not tokenized.
+    fpath = str(tmpdir.join('ragged.sto'))
+    with open(fpath, 'w') as f:
+        f.write('ragged\nendheader\ntime\tq1\tlabel\n')
+        f.write('0.0\t1.0\tstart\n0.1\t2.0\n0.2\t3.0\tstop extra\n')
+    data = dataman.storage2numpy(fpath, usecols=['time', 'q1'])
+    testing.assert_array_equal(data['q1'], [1.0, 2.0, 3.0])
+    testing.assert_array_equal(data['time'], [0.0, 0.1, 0.2])
+
+def test_storage2numpy_time_window(tmpdir):
+    fpath = str(tmpdir.join('long.sto'))
+    data = np.empty(5000, dtype=[('time', 'f8'), ('q1', 'f8')])
+    data['time'] = np.linspace(0, 4.999, len(data))
+    data['q1'] = np.sin(data['time'])
+    dataman.ndarray2storage(data, fpath)
+    expected = dataman.storage2numpy(fpath)
+    for min_time, max_time in [(2.5, 3.2), (None, 0.5), (4.5, None),
+            (-1, 10), (6, 7)]:
+        window = dataman.storage2numpy(fpath, min_time=min_time,
+                max_time=max_time)
+        keep = np.ones(len(expected), dtype=bool)
+        if min_time is not None:
+            keep &= expected['time'] >= min_time
+        if max_time is not None:
+            keep &= expected['time'] <= max_time
+        assert window.dtype == expected.dtype
+        testing.assert_array_equal(window, expected[keep])
+    # The sparse index is reused.
+    assert any(key[0] == os.path.abspath(fpath)
+            for key in dataman._time_indices)
+    window = dataman.storage2numpy(fpath, usecols=['q1'], min_time=1,
+            max_time=2)
+    assert window.dtype.names == ('q1',)
+    testing.assert_array_equal(window['q1'], expected['q1'][
+        (expected['time'] >= 1) & (expected['time'] <= 2)])
+
+def test_time_index_lru(tmpdir, monkeypatch):
+    monkeypatch.setattr(dataman, '_time_indices', collections.OrderedDict())
+    monkeypatch.setattr(dataman, '_time_indices_size', 3)
+    data = np.empty(100, dtype=[('time', 'f8'), ('q1', 'f8')])
+    data['time'] = np.linspace(0, 1, len(data))
+    data['q1'] = 1.0
+    fpaths = [str(tmpdir.join('f%i.sto' % i)) for i in range(5)]
+    for fpath in fpaths:
+        dataman.ndarray2storage(data, fpath)
+    indexed = lambda: [key[0] for key in dataman._time_indices]
+    for fpath in fpaths[:3]:
+        dataman.storage2numpy(fpath, min_time=0.5)
+    # Using f0 again makes f1 the least recently used.
+    dataman.storage2numpy(fpaths[0], min_time=0.5)
+    for fpath in fpaths[3:]:
+        expected = dataman.storage2numpy(fpath)
+        testing.assert_array_equal(dataman.storage2numpy(fpath,
+            min_time=0.5), expected[expected['time'] >= 0.5])
+    assert indexed() == [os.path.abspath(fpaths[i]) for i in [0, 3, 4]]
+
+def _write_anc(fpath, n_rows):
+    # Two force plate channels; F1Y is the negative of F1X.
+    data = np.empty(n_rows, dtype=[('F1X', 'f8'), ('F1Y', 'f8')])
+    data['F1X'] = np.arange(n_rows) % 32768
+    data['F1Y'] = -data['F1X']
+    write_anc(fpath, data, 1000, [10000, 5000])
+
+def test_ancfile(tmpdir):
+    fpath = str(tmpdir.join('analog.anc'))
+    _write_anc(fpath, 2500)
+    anc = dataman.ANCFile(fpath)
+    assert anc.names == ['F1X', 'F1Y']
+    assert anc.bit_depth == 16
+    assert anc.units == 'counts'
+    testing.assert_array_equal(anc['F1Y'], -np.arange(2500))
+    testing.assert_allclose(anc.time, 0.001 * np.arange(2500))
+
+    volts = dataman.ANCFile(fpath, volts=True)
+    assert volts.units == 'volts'
+    testing.assert_allclose(volts['F1X'], np.arange(2500) * 10.0 / 32768)
+    testing.assert_allclose(volts['F1Y'], -np.arange(2500) * 5.0 / 32768)
+    testing.assert_array_equal(volts.time, anc.time)
+
+    anb_fpath = dataman.anc2anb(fpath)
+    assert anb_fpath == str(tmpdir.join('analog.anb'))
+    anb = dataman.ANCFile(anb_fpath)
+    assert anb.names == anc.names
+    assert anb.ranges == anc.ranges
+    assert anb.data.dtype == anc.data.dtype
+    testing.assert_allclose(anb.time, anc.time, atol=1e-9)
+    testing.assert_array_equal(anb['F1X'], anc['F1X'])
+    window = dataman.ANCFile(anb_fpath, min_time=1.0, max_time=1.5,
+            volts=True)
+    testing.assert_allclose(window['F1X'], volts['F1X'][1000:1501])
+
+    # A truncated file (half a row missing) is an error.
+    truncated_fpath = str(tmpdir.join('truncated.anb'))
+    with open(anb_fpath, 'rb') as f:
+        content = f.read()
+    with open(truncated_fpath, 'wb') as f:
+        f.write(content[:-2])
+    with pytest.raises(Exception) as excinfo:
+        dataman.ANCFile(truncated_fpath)
+    assert 'truncated' in str(excinfo.value)
+
+def test_anc2numpy_chunks(tmpdir):
+    fpath = str(tmpdir.join('analog.anc'))
+    _write_anc(fpath, 2500)
+    anb_fpath = dataman.anc2anb(fpath)
+    for path in [fpath, anb_fpath]:
+        for volts in [False, True]:
+            anc = dataman.ANCFile(path, volts=volts)
+            chunks = list(dataman.anc2numpy_chunks(path, 1000, volts=volts))
+            assert [len(chunk) for chunk in chunks] == [1000, 1000, 500]
+            data = np.concatenate(chunks)
+            assert data.dtype == anc.data.dtype
+            for name in data.dtype.names:
+                testing.assert_allclose(data[name], anc.data[name])
+
+    # A file whose writer is partway through a row: the whole rows are read,
+    # and the partial row is left unread.
+    anc = dataman.ANCFile(anb_fpath)
+    partial_fpath = str(tmpdir.join('partial.anb'))
+    with open(anb_fpath, 'rb') as f:
+        content = f.read()
+    with open(partial_fpath, 'wb') as f:
+        f.write(content + b'\x00')
+    chunks = list(dataman.anc2numpy_chunks(partial_fpath, 1000))
+    assert [len(chunk) for chunk in chunks] == [1000, 1000, 500]
+    testing.assert_array_equal(np.concatenate(chunks), anc.data)
+    with open(partial_fpath, 'wb') as f:
+        f.write(content[:-2])
+    chunks = list(dataman.anc2numpy_chunks(partial_fpath, 1000))
+    testing.assert_array_equal(np.concatenate(chunks), anc.data[:-1])
+
+    # Rows appended while reading are read too.
+    with open(partial_fpath, 'wb') as f:
+        f.write(content[:-2])
+    reader = dataman.anc2numpy_chunks(partial_fpath, 1000)
+    next(reader)
+    with open(partial_fpath, 'ab') as f:
+        f.write(content[-2:])
+    rest = list(reader)
+    assert sum(len(chunk) for chunk in rest) == 1500
+    testing.assert_array_equal(rest[-1][-1], anc.data[-1])
+
+def test_trcfile_ancfile_time_window(tmpdir):
+    fpath = str(tmpdir.join('markers.trc'))
+    _write_trc(fpath, 3001, ['R.Hip', 'Sternum'])
+    full = dataman.TRCFile(fpath)
+    keep = (full.time >= 0.25) & (full.time <= 0.5)
+    for mmap in [False, True]:
+        trc = dataman.TRCFile(fpath, mmap=mmap, min_time=0.25, max_time=0.5)
+        assert trc.num_frames == np.sum(keep)
+        testing.assert_array_equal(trc.time, full.time[keep])
+        testing.assert_array_equal(trc.marker('Sternum'),
+                full.marker('Sternum')[keep])
+
+    fpath = str(tmpdir.join('analog.anc'))
+    _write_anc(fpath, 2500)
+    full = dataman.ANCFile(fpath)
+    anc = dataman.ANCFile(fpath, min_time=1.2, max_time=1.3)
+    keep = (full.time >= 1.2) & (full.time <= 1.3)
+    testing.assert_array_equal(anc.time, full.time[keep])
+    testing.assert_array_equal(anc['F1Y'], full['F1Y'][keep])
+    assert anc.num_channels == 2
+
+def test_storage2numpy_chunks():
+    fpath = os.path.join(parentdir, 'double_pendulum_states.sto')
+    expected = dataman.storage2numpy(fpath)
+    chunks = list(dataman.storage2numpy_chunks(fpath, chunk_rows=7))
+    assert all(len(chunk) == 7 for chunk in chunks[:-1])
+    assert np.concatenate(chunks).dtype == expected.dtype
+    testing.assert_array_equal(np.concatenate(chunks), expected)
+
+    chunks = list(dataman.storage2numpy_chunks(fpath, chunk_rows=7,
+        usecols=['time', 'q2']))
+    assert chunks[0].dtype.names == ('time', 'q2')
+    testing.assert_array_equal(np.concatenate(chunks)['q2'], expected['q2'])
+
+    time_step = 0.25
+    windows = list(dataman.storage2numpy_chunks(fpath, chunk_rows=7,
+        time_step=time_step, usecols=['q1']))
+    testing.assert_array_equal(np.concatenate(windows)['q1'], expected['q1'])
+    window_of_row = np.floor((expected['time'] - expected['time'][0]) /
+            time_step)
+    assert len(windows) == len(np.unique(window_of_row))
+    for window in np.unique(window_of_row):
+        assert np.sum(window_of_row == window) in [len(w) for w in windows]
+
+def test_storage_interpolate():
+    fpath = os.path.join(parentdir, 'double_pendulum_states.sto')
+    sto = dataman.Storage(fpath, cache_size=1)
+    times = [-1.0, 0.0, 0.0305, 0.05, 0.072, 1.0]
+    expected = np.interp(times, sto.time, sto.data['q2'], left=np.nan,
+            right=np.nan)
+    testing.assert_allclose(sto.interpolate('q2', times), expected)
+    testing.assert_allclose(sto.interpolate('q2', 0.0305), expected[2])
+    assert np.isscalar(sto.interpolate('q2', 0.0305))
+    testing.assert_allclose(sto.interpolate(u'q2', times), expected)
+    values = sto.interpolate(['q1', 'q2'], times)
+    assert values.shape == (len(times), 2)
+    testing.assert_allclose(values[:, 1], expected)
+    testing.assert_allclose(values[:, 0], np.interp(times, sto.time,
+        sto.data['q1'], left=np.nan, right=np.nan))
+
+    for kind in ['spline', 'pchip']:
+        values = sto.interpolate(['q1', 'q2'], times, kind=kind)
+        assert np.all(np.isnan(values[[0, -1]]))
+        testing.assert_allclose(values[1:-1, 1], expected[1:-1], rtol=1e-4)
+        # Interpolants are rebuilt when evicted from the cache.
+        assert len(sto._interpolants) == 1
+    with pytest.raises(Exception):
+        sto.interpolate('q1', 0.01, kind='quadratic')
+
+def test_parse_cache(tmpdir):
+    fpath = str(tmpdir.join('states.sto'))
+    shutil.copy(os.path.join(parentdir, 'double_pendulum_states.sto'), fpath)
+    cache = dataman.enable_parse_cache(str(tmpdir.join('cache')))
+    try:
+        cold = dataman.storage2numpy(fpath)
+        warm = dataman.storage2numpy(fpath)
+        assert isinstance(warm, np.memmap)
+        testing.assert_array_equal(warm, cold)
+        assert cache.size() > 0
+
+        # A changed file is parsed again.
+        data = cold.copy()
+        data['q1'] += 1.0
+        dataman.ndarray2storage(data, fpath)
+        os.utime(fpath, (0, 0))
+        testing.assert_allclose(dataman.storage2numpy(fpath)['q1'],
+                data['q1'], atol=1e-6)
+
+        # Least recently used entries are evicted.
+        cache.max_size = 0
+        dataman.storage2numpy(fpath, excess_header_entries=1)
+        assert cache.size() == 0
+
+        dataman.storage2numpy(fpath)
+        dataman.clear_parse_cache()
+        assert cache.size() == 0
+    finally:
+        dataman.disable_parse_cache()
+
+def _write_trc(fpath, n_frames, marker_names):
+    time = np.linspace(0, 1, n_frames)
+    trc = dataman.TRCFile(data_rate=100.0, camera_rate=100.0,
+            num_frames=n_frames, num_markers=0, units='mm',
+            orig_data_rate=100.0, orig_data_start_frame=1,
+            orig_num_frames=n_frames, time=time)
+    for i, name in enumerate(marker_names):
+        trc.add_marker(name, np.sin(time + i), np.cos(time + i), time * i)
+    trc.write(fpath)
+
+def test_trcfile_mmap(tmpdir):
+    fpath = str(tmpdir.join('markers.trc'))
+    _write_trc(fpath, 101, ['R.Hip', 'L.Hip', 'Sternum'])
+    text = dataman.TRCFile(fpath)
+    binary_fpath = dataman.trc2binary(fpath, chunk_rows=7)
+    assert binary_fpath == fpath + '.npy'
+    mapped = dataman.TRCFile(fpath, mmap=True)
+    assert isinstance(mapped.data, np.memmap)
+    assert mapped.num_frames == 101
+    assert mapped.marker_names == text.marker_names
+    assert mapped.markers.shape == (101, 3, 3)
+    testing.assert_array_equal(mapped.time, text.time)
+    for name in text.marker_names:
+        testing.assert_array_equal(mapped.marker(name), text.marker(name))
+        assert np.may_share_memory(mapped.marker(name), mapped.data)
+        for time in [-1.0, 0.0, 0.333, 0.5, 1.0, 2.0]:
+            testing.assert_allclose(mapped.marker_at(name, time),
+                    text.marker_at(name, time), atol=1e-12)
+        testing.assert_allclose(mapped.marker_at(name, [0.1, 0.25]),
+                text.marker_at(name, [0.1, 0.25]), atol=1e-12)
+        assert all(np.isscalar(v) for v in mapped.marker_at(name, 0.5))
+
+def test_trcfile_single_frame(tmpdir):
+    fpath = str(tmpdir.join('markers.trc'))
+    _write_trc(fpath, 1, ['R.Hip', 'Sternum'])
+    for mmap in [False, True]:
+        trc = dataman.TRCFile(fpath, mmap=mmap)
+        assert trc.num_frames == 1
+        expected = trc.marker('Sternum')[0]
+        for time in [-1.0, 0.0, 2.0]:
+            location = trc.marker_at('Sternum', time)
+            assert all(np.isscalar(v) for v in location)
+            testing.assert_allclose(location, expected)
+        location = trc.marker_at('Sternum', [0.0, 0.5])
+        assert np.shape(location) == (3, 2)
+        testing.assert_allclose(np.array(location).T, [expected, expected])
+        testing.assert_allclose(trc.markers_at(['Sternum'], [-1.0, 1.0]),
+                [[expected], [expected]])
+
+def test_trcfile_markers_at(tmpdir):
+    fpath = str(tmpdir.join('markers.trc'))
+    names = ['R.Hip', 'L.Hip', 'Sternum']
+    _write_trc(fpath, 101, names)
+    times = [-1.0, 0.0, 0.333, 0.5, 0.999, 1.0, 2.0]
+    for trc in [dataman.TRCFile(fpath), dataman.TRCFile(fpath, mmap=True)]:
+        locations = trc.markers_at(['Sternum', 'R.Hip'], times)
+        assert locations.shape == (len(times), 2, 3)
+        for imark, name in enumerate(['Sternum', 'R.Hip']):
+            for idim in range(3):
+                testing.assert_allclose(locations[:, imark, idim],
+                        np.interp(times, trc.time, trc.marker(name)[:, idim]),
+                        atol=1e-12)
+        assert trc.markers_at(names, 0.5).shape == (1, 3, 3)
+
+def test_ndarray2storage_round_trip(tmpdir):
+    fpath = str(tmpdir.join('out.sto'))
+    data = np.empty(2501, dtype=[('time', 'f8'), ('q1', 'f8'), ('q2', 'f4')])
+    data['time'] = np.linspace(0, 1, len(data))
+    data['q1'] = np.sin(data['time'])
+    data['q2'] = np.cos(data['time'])
+    dataman.ndarray2storage(data, fpath, fmt={'q1': '%.10e'})
+    read = dataman.storage2numpy(fpath)
+    assert read.dtype.names == data.dtype.names
+    testing.assert_allclose(read['time'], data['time'], atol=1e-6)
+    testing.assert_allclose(read['q1'], data['q1'], rtol=1e-10)
+    testing.assert_allclose(read['q2'], data['q2'], atol=1e-6)
+
+    fpath = str(tmpdir.join('out_dict.sto'))
+    dataman.dict2storage(collections.OrderedDict(
+        [('time', data['time']), ('q1', data['q1'])]), fpath, fmt='%.3f')
+    read = dataman.storage2numpy(fpath)
+    testing.assert_allclose(read['q1'], np.round(data['q1'], 3))
+
+def test_trcfile_write_round_trip(tmpdir):
+    fpath = str(tmpdir.join('markers.trc'))
+    _write_trc(fpath, 1234, ['R.Hip', 'Sternum'])
+    trc = dataman.TRCFile(fpath)
+    fpath2 = str(tmpdir.join('markers2.trc'))
+    trc.write(fpath2, marker_fmt={'Sternum': '%.6f'})
+    trc2 = dataman.TRCFile(fpath2)
+    assert trc2.marker_names == trc.marker_names
+    testing.assert_array_equal(trc2.data['frame_num'], np.arange(1234) + 1)
+    testing.assert_array_equal(trc2.time, trc.time)
+    testing.assert_array_equal(trc2.marker('R.Hip'), trc.marker('R.Hip'))
+    testing.assert_allclose(trc2.marker('Sternum'), trc.marker('Sternum'),
+            atol=1e-6)
+
+def test_trcfile_add_markers_and_noise(tmpdir):
+    fpath = str(tmpdir.join('markers.trc'))
+    _write_trc(fpath, 200, ['R.Hip'])
+    trc = dataman.TRCFile(fpath)
+    data = np.random.randn(200, 3)
+    trc.add_markers(collections.OrderedDict([
+        ('A', data), ('B', (data[:, 0], data[:, 1], data[:, 2]))]))
+    assert trc.marker_names == ['R.Hip', 'A', 'B']
+    assert trc.num_markers == 3
+    testing.assert_array_equal(trc.marker('A'), data)
+    testing.assert_array_equal(trc.marker('B'), data)
+    with pytest.raises(Exception):
+        trc.add_markers({'C': data[:10]})
+
+    original = np.array(trc.data)
+    copies = list(trc.noisy_copies(3, {'A': 0.5, 'B': 2.0}, rng=1))
+    assert len(copies) == 3
+    testing.assert_array_equal(trc.data, original)
+    for noisy in copies:
+        testing.assert_array_equal(noisy.marker('R.Hip'),
+                trc.marker('R.Hip'))
+        assert 0.3 < np.std(noisy.marker('A') - data) < 0.7
+        assert 1.5 < np.std(noisy.marker('B') - data) < 2.5
+    assert not np.allclose(copies[0].marker('A'), copies[1].marker('A'))
+    # Seeded noise is reproducible.
+    again = list(trc.noisy_copies(3, {'A': 0.5, 'B': 2.0}, rng=1))
+    testing.assert_array_equal(again[2].data, copies[2].data)
+    copies[0].write(str(tmpdir.join('noisy.trc')))
+
+    trc.add_noise(1.0, rng=np.random.RandomState(0))
+    assert 0.7 < np.std(trc.data['R.Hip_tx'] - original['R.Hip_tx']) < 1.3
+    assert not np.allclose(trc.marker('A'), data)
+
+def test_trcfile_add_marker_growth(tmpdir):
+    time = np.linspace(0, 1, 50)
+    trc = dataman.TRCFile(data_rate=100.0, camera_rate=100.0, num_frames=50,
+            num_markers=0, units='mm', orig_data_rate=100.0,
+            orig_data_start_frame=1, orig_num_frames=50, time=time)
+    buffers = list()
+    for i in range(100):
+        trc.add_marker('M%i' % i, time + i, time - i, time * i)
+        if len(buffers) == 0 or not np.may_share_memory(trc.data,
+                buffers[-1]):
+            buffers.append(trc.data)
+    # Capacity doubles, so the data is reallocated O(log(n_markers)) times.
+    assert len(buffers) <= 10
+    assert trc.num_markers == 100
+    assert trc.data.dtype.names[-3:] == ('M99_tx', 'M99_ty', 'M99_tz')
+    for i in [0, 37, 99]:
+        testing.assert_array_equal(trc.marker('M%i' % i),
+                np.array([time + i, time - i, time * i]).T)
+
+    # A shallow copy does not write into the original's spare room.
+    other = copy.copy(trc)
+    other.marker_names = list(trc.marker_names)
+    other.add_marker('Extra', time, time, time)
+    trc.add_marker('Last', -time, -time, -time)
+    testing.assert_array_equal(other.marker('Extra')[:, 0], time)
+    testing.assert_array_equal(trc.marker('Last')[:, 0], -time)
+    testing.assert_array_equal(trc.marker('M99'), other.marker('M99'))
+
+    fpath = str(tmpdir.join('markers.trc'))
+    trc.data = np.concatenate([trc.data[:25], trc.data[25:]])
+    trc.add_marker('Appended', time, time, time)
+    trc.write(fpath)
+    reread = dataman.TRCFile(fpath)
+    assert reread.marker_names == trc.marker_names
+    testing.assert_allclose(reread.marker('M5'), trc.marker('M5'), atol=1e-3)
+
+def test_setup_inputs_cache(tmpdir):
+    root = str(tmpdir.join('base'))
+    os.makedirs(root)
+    fpath = write_cmc_setup(root)
+
+    inputs = dataman.cmc_input_fpaths(fpath)
+    assert inputs['model'] == os.path.join(root, 'model.osim')
+    assert inputs['actuators'] == [os.path.join(root, 'actu1.xml'),
+            os.path.join(root, 'actu2.xml')]
+    assert inputs['force_plates'] == os.path.join(root, 'grf.mot')
+    assert inputs['extload_kinematics'] == None
+    assert dataman.cmc_input_fpaths(fpath) == inputs
+
+    # Editing the copied setup files must not alter the cached trees.
+    for i in range(2):
+        dest = str(tmpdir.join('cmc%i' % i))
+        old, new = dataman.copy_cmc_inputs(fpath, dest)
+        assert old == inputs
+        assert os.path.exists(os.path.join(dest, 'actu2.xml'))
+        text = open(new['setup']).read()
+        assert '<results_directory>results</results_directory>' in text
+    old, new = dataman.copy_so_inputs(fpath, str(tmpdir.join('so')))
+    assert old['coordinates_file'] == os.path.join(root, 'kinematics.mot')
+    assert 'out' == dataman._parse_xml(fpath).findall(
+            './/results_directory')[0].text
+
+    # A changed setup file is parsed again.
+    text = open(fpath).read().replace('tasks.xml', 'constraints.xml')
+    open(fpath, 'w').write(text + ' ' * 10)
+    assert (dataman.cmc_input_fpaths(fpath)['tasks'] ==
+            os.path.join(root, 'constraints.xml'))
+
+    # A file that has moved away is looked up again.
+    os.remove(os.path.join(root, 'grf.mot'))
+    with pytest.raises(Exception):
+        dataman.cmc_input_fpaths(fpath)
+
+def test_copy_cmc_inputs_strategies(tmpdir, monkeypatch):
+    root = str(tmpdir.join('base'))
+    os.makedirs(root)
+    fpath = write_cmc_setup(root)
+    model = os.path.join(root, 'model.osim')
+    store = str(tmpdir.join('store'))
+
+    for strategy in ['copy', 'hardlink', 'symlink', 'reflink', 'store']:
+        dest = str(tmpdir.join('dest_%s' % strategy))
+        # The second call finds the inputs already in place.
+        for i in range(2):
+            old, new = dataman.copy_cmc_inputs(fpath, dest,
+                    strategy=strategy, store=store)
+        assert open(new['model']).read() == '<a/>'
+        assert os.path.islink(new['model']) == (strategy == 'symlink')
+        if strategy in ['copy', 'reflink']:
+            assert not os.path.samefile(new['model'], model)
+        elif strategy in ['hardlink', 'symlink']:
+            assert os.path.samefile(new['model'], model)
+        else:
+            assert not os.path.samefile(new['model'], model)
+            assert os.stat(new['model']).st_nlink == 2
+
+    # Identical contents are stored once (per extension).
+    stored = [fname for dirpath, dirnames, fnames in os.walk(store)
+            for fname in fnames]
+    assert sorted(os.path.splitext(fname)[1] for fname in stored) == [
+            '.mot', '.osim', '.xml']
+
+    with pytest.raises(Exception):
+        dataman.copy_cmc_inputs(fpath, str(tmpdir.join('x')),
+                strategy='store')
+
+    # Falling back to a plain copy is not silent.
+    monkeypatch.setattr(dataman, '_FICLONE', 0)
+    dst = str(tmpdir.join('reflinked.osim'))
+    with pytest.warns(UserWarning, match='Could not reflink'):
+        dataman._copy_input(model, dst, strategy='reflink')
+    assert open(dst).read() == '<a/>'
+
+def test_populate_table(tmpdir):
+    fpath = str(tmpdir.join('so_force.sto'))
+    f = open(fpath, 'w')
+    f.write('so_force\nversion=1\nnRows=2\nnColumns=3\ninDegrees=no\n'
+            'endheader\n')
+    f.write('time\tsoleus_r\ttib_ant.r\tRight_GRF\n')
+    f.write('0.0\t1.5\t-2.0\n')
+    f.write('0.1\t1.6\t-2.1\n')
+    f.close()
+    h5file = tables.open_file(str(tmpdir.join('docked.h5')), mode='w')
+    try:
+        table = dataman._populate_table(h5file, h5file.root, 'force', fpath,
+                replacements={'_r$': '_right'})
+        assert table.colnames == ['soleus_right', 'tib_ant_right', 'time']
+        testing.assert_allclose(table.col('tib_ant_right'), [-2.0, -2.1])
+        testing.assert_allclose(table.cols.time[:], [0.0, 0.1])
+    finally:
+        h5file.close()
+
+def test_populate_table_duplicate_columns(tmpdir):
+    fpath = str(tmpdir.join('dup.sto'))
+    f = open(fpath, 'w')
+    f.write('dup\nversion=1\nnRows=2\nnColumns=4\ninDegrees=no\n'
+            'endheader\n')
+    f.write('time\ta\ta\tb\n')
+    f.write('0.0\t1.0\t2.0\t3.0\n')
+    f.write('0.1\t1.1\t2.1\t3.1\n')
+    f.close()
+    h5file = tables.open_file(str(tmpdir.join('docked.h5')), mode='w')
+    try:
+        table = dataman._populate_table(h5file, h5file.root, 'dup', fpath)
+        assert sorted(table.colnames) == ['a', 'b', 'time']
+        # The first column with a repeated name is kept.
+        testing.assert_allclose(table.col('a'), [1.0, 1.1])
+        testing.assert_allclose(table.col('b'), [3.0, 3.1])
+        testing.assert_allclose(table.col('time'), [0.0, 0.1])
+    finally:
+        h5file.close()
+
+def test_populate_table_profile(tmpdir):
+    fpath = os.path.join(parentdir, 'double_pendulum_states.sto')
+    expected = dataman.storage2numpy(fpath)
+    h5file = tables.open_file(str(tmpdir.join('docked.h5')), mode='w')
+    try:
+        table = dataman._populate_table(h5file, h5file.root, 'states', fpath,
+                profile='blosc')
+        assert table.filters.complevel == 5
+        testing.assert_allclose(table.cols.time[:], expected['time'],
+                rtol=1e-6)
+        table = dataman._populate_table(h5file, h5file.root, 'states64',
+                fpath, profile=dataman.DockProfile(float64=True))
+        assert table.filters.complevel == 0
+        testing.assert_array_equal(table.cols.time[:], expected['time'])
+    finally:
+        h5file.close()
+
+def test_populate_table_columns_layout(tmpdir):
+    fpath = os.path.join(parentdir, 'double_pendulum_states.sto')
+    h5fname = str(tmpdir.join('docked.h5'))
+    h5file = tables.open_file(h5fname, mode='w')
+    try:
+        rows = dataman._populate_table(h5file, h5file.root, 'rows', fpath)
+        columns = dataman._populate_table(h5file, h5file.root, 'columns',
+                fpath, profile='blosc', layout='columns')
+        assert sorted(columns.colnames) == sorted(rows.colnames)
+        assert columns.nrows == rows.nrows
+        for name in rows.colnames:
+            testing.assert_array_equal(columns.col(name), rows.col(name))
+        testing.assert_array_equal(columns.cols.time[2:5],
+                rows.cols.time[2:5])
+        testing.assert_array_equal(columns.read()['time'], rows.col('time'))
+    finally:
+        h5file.close()
+
+    h5file = tables.open_file(h5fname, mode='r')
+    try:
+        table = dataman.docked_table(h5file.root.columns)
+        assert isinstance(table, dataman.ColumnTable)
+        assert dataman.docked_table(h5file.root.rows) is h5file.root.rows
+        testing.assert_array_equal(table.col('time'),
+                h5file.root.rows.col('time'))
+    finally:
+        h5file.close()
+
+def _write_study(study_root, n_leaves):
+    states = os.path.join(parentdir, 'double_pendulum_states.sto')
+    for i in range(n_leaves):
+        output = os.path.join(study_root, 'subj%02i' % i, 'output')
+        os.makedirs(output)
+        shutil.copy(states, os.path.join(output, 'run_states.sto'))
+        if i != 1:
+            # Leaf 1 has only one Storage file, which is an error.
+            shutil.copy(states, os.path.join(output, 'run_controls.sto'))
+
+def test_dock_simulation_tree_in_pytable_n_workers(tmpdir):
+    study_root = str(tmpdir.join('study'))
+    _write_study(study_root, 5)
+    for n_workers in [1, 3]:
+        h5fname = str(tmpdir.join('study%i.h5' % n_workers))
+        dataman.dock_simulation_tree_in_pytable(h5fname, study_root,
+                ['study'], verbose=False, n_workers=n_workers, queue_depth=2,
+                overwrite_if_newer=True)
+        # Nothing is newer, so nothing is rewritten.
+        dataman.dock_simulation_tree_in_pytable(h5fname, study_root,
+                ['study'], verbose=False, n_workers=n_workers,
+                overwrite_if_newer=True)
+    serial = tables.open_file(str(tmpdir.join('study1.h5')))
+    parallel = tables.open_file(str(tmpdir.join('study3.h5')))
+    try:
+        for i in [0, 2, 3, 4]:
+            for name in ['states', 'controls']:
+                table_path = '/study/subj%02i/%s' % (i, name)
+                testing.assert_array_equal(
+                        parallel.get_node(table_path)[:],
+                        serial.get_node(table_path)[:])
+                assert (parallel.get_node(table_path).attrs.mtime ==
+                        serial.get_node(table_path).attrs.mtime)
+        assert len(parallel.get_node('/study/subj01')._v_children) == 0
+    finally:
+        serial.close()
+        parallel.close()
+
+    # The worker processes are shut down if the pyTables file can't be
+    # opened.
+    with pytest.raises(IOError):
+        dataman.dock_simulation_tree_in_pytable(
+                str(tmpdir.join('no_such_dir', 'study.h5')), study_root,
+                ['study'], verbose=False, n_workers=3)
+    assert multiprocessing.active_children() == []
+
+def test_dock_simulation_tree_in_pytable_incremental(tmpdir):
+    study_root = str(tmpdir.join('study'))
+    _write_study(study_root, 4)
+    h5fname = str(tmpdir.join('study.h5'))
+    dataman.dock_simulation_tree_in_pytable(h5fname, study_root, ['study'],
+            verbose=False)
+
+    # Change one leaf, add one, and delete one.
+    states = os.path.join(study_root, 'subj02', 'output', 'run_states.sto')
+    data = dataman.storage2numpy(states)
+    data['q1'] += 1.0
+    dataman.ndarray2storage(data, states)
+    os.utime(states, (0, 0))
+    _write_study(str(tmpdir.join('more')), 6)
+    shutil.move(str(tmpdir.join('more', 'subj05')),
+            os.path.join(study_root, 'subj05'))
+    shutil.rmtree(os.path.join(study_root, 'subj03'))
+
+    changes = dataman.dock_simulation_tree_in_pytable(h5fname, study_root,
+            ['study'], verbose=False, dry_run=True)
+    assert changes['changed'] == [os.path.dirname(states)]
+    assert changes['deleted'] == [
+            os.path.join(study_root, 'subj03', 'output')]
+    assert changes['new'] == [os.path.join(study_root, 'subj05', 'output')]
+    # subj01 has only one Storage file; it failed, and hasn't changed since.
+    subj01 = os.path.join(study_root, 'subj01', 'output')
+    assert changes['failed'] == [subj01]
+
+    h5file = tables.open_file(h5fname)
+    assert '/study/subj05' not in h5file
+    h5file.close()
+
+    dataman.dock_simulation_tree_in_pytable(h5fname, study_root, ['study'],
+            verbose=False, incremental=True, remove_deleted=True)
+    h5file = tables.open_file(h5fname)
+    try:
+        # The changed table is rewritten, even though it's older.
+        testing.assert_allclose(h5file.root.study.subj02.states.col('q1'),
+                data['q1'], rtol=1e-5)
+        assert '/study/subj05/controls' in h5file
+        assert '/study/subj03/states' not in h5file
+    finally:
+        h5file.close()
+
+    changes = dataman.dock_simulation_tree_in_pytable(h5fname, study_root,
+            ['study'], verbose=False, dry_run=True)
+    assert changes['changed'] == []
+    assert changes['deleted'] == []
+    assert changes['new'] == []
+    assert changes['failed'] == [subj01]
+    h5file = tables.open_file(h5fname)
+    try:
+        failures = h5file.root.dock_failures.read()
+        assert list(failures['leaf']) == [subj01]
+        assert len(failures['error'][0]) > 0
+    finally:
+        h5file.close()
+
+    # Fixing the failed leaf makes it a changed leaf, which is docked.
+    shutil.copy(states, os.path.join(subj01, 'run_controls.sto'))
+    changes = dataman.dock_simulation_tree_in_pytable(h5fname, study_root,
+            ['study'], verbose=False, incremental=True)
+    assert changes['changed'] == [subj01]
+    assert changes['failed'] == []
+    h5file = tables.open_file(h5fname)
+    try:
+        assert '/study/subj01/controls' in h5file
+        assert len(h5file.root.dock_failures) == 0
+    finally:
+        h5file.close()
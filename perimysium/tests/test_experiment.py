@@ -0,0 +1,86 @@
+import os
+import threading
+
+from perimysium import experiment
+
+from helpers import write_cmc_setup
+
+def test_run_experiments(tmpdir):
+    root = str(tmpdir.join('base'))
+    os.makedirs(root)
+    setup_fpath = write_cmc_setup(root)
+    parent_dir = str(tmpdir.join('experiments'))
+    curdir = os.path.abspath(os.curdir)
+
+    attempts = dict()
+    lock = threading.Lock()
+    def edit_model(name, fail):
+        def fcn(cmc_input):
+            with lock:
+                attempts[name] = attempts.get(name, 0) + 1
+            if fail:
+                raise Exception('Could not edit the model.')
+            open(cmc_input['model'], 'w').write('<%s/>' % name)
+        return fcn
+    specs = [('exp%i' % i, 'experiment %i' % i, edit_model('exp%i' % i,
+        i == 3)) for i in range(6)]
+
+    # The command's arguments are '-S setup.xml'; `ls` succeeds.
+    results = experiment.run_experiments(setup_fpath, parent_dir, specs,
+            run_command='ls', n_workers=3, verbose=False)
+    assert os.path.abspath(os.curdir) == curdir
+    assert [r['status'] for r in results] == 3 * ['succeeded'] + [
+            'failed'] + 2 * ['succeeded']
+    assert 'Could not edit the model.' in results[3]['error']
+    assert results[0]['exit_code'] == 0
+    destination = os.path.join(parent_dir, 'exp0')
+    assert open(os.path.join(destination, 'stdout.txt')).read() == \
+            'setup.xml\n'
+    assert open(os.path.join(destination, 'model.osim')).read() == '<exp0/>'
+    readme = open(os.path.join(destination, 'README.txt')).read()
+    assert "Ran 'ls': exit code 0, wall time" in readme
+
+    # Resume: only the experiment that failed is prepared and run again.
+    specs[3] = ('exp3', 'experiment 3', edit_model('exp3', False))
+    results = experiment.run_experiments(setup_fpath, parent_dir, specs,
+            run_command='ls', n_workers=3, verbose=False)
+    assert [r['status'] for r in results] == 3 * ['skipped'] + [
+            'succeeded'] + 2 * ['skipped']
+    assert attempts == dict(('exp%i' % i, 1 + (i == 3)) for i in range(6))
+
+    # A failing run is recorded, and run again (without preparing) next time.
+    results = experiment.run_experiments(setup_fpath,
+            str(tmpdir.join('failing')), specs[:2],
+            run_command='ls --no-such-option', verbose=False)
+    assert [r['status'] for r in results] == ['failed', 'failed']
+    assert results[0]['exit_code'] != 0
+    results = experiment.run_experiments(setup_fpath,
+            str(tmpdir.join('failing')), specs[:2], run_command='ls',
+            verbose=False)
+    assert [r['status'] for r in results] == ['succeeded', 'succeeded']
+    assert attempts['exp0'] == 2
+
+    # The command is not run through a shell.
+    results = experiment.run_experiments(setup_fpath,
+            str(tmpdir.join('no_shell')), specs[:1],
+            run_command='ls; echo shell', verbose=False)
+    assert results[0]['exit_code'] != 0
+    assert 'shell' not in open(os.path.join(results[0]['destination'],
+        'stdout.txt')).read()
+    results = experiment.run_experiments(setup_fpath,
+            str(tmpdir.join('no_shell')), specs[:1],
+            run_command='no-such-executable', verbose=False)
+    assert results[0]['status'] == 'failed'
+    assert 'OSError' in results[0]['error']
+
+def test_run_tool_shell(tmpdir):
+    destination = str(tmpdir)
+    setup_fpath = os.path.join(destination, 'setup.xml')
+    open(setup_fpath, 'w').write('<a/>')
+    # Through the shell, as `experiment` runs its tool, redirects work.
+    assert experiment.run_tool('ls > listing.txt; true', setup_fpath,
+            destination, shell=True) == 0
+    assert 'setup.xml' in open(os.path.join(destination,
+        'listing.txt')).read()
+    assert experiment.run_tool('no-such-executable', setup_fpath,
+            destination, shell=True) == 127
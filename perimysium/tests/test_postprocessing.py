@@ -1,10 +1,17 @@
 import os
+import threading
 
 import numpy as np
+import pytest
+import tables
 from numpy import testing
+from scipy.signal import butter, sosfilt
 
+from perimysium import dataman
 from perimysium import postprocessing as pproc
 
+from helpers import gait_landmarks_loop, synthetic_grf, write_anc
+
 parentdir = os.path.abspath(os.path.dirname(__file__))
 
 def test_filter_emg():
@@ -15,6 +22,49 @@ def test_filter_emg():
     filtered = pproc.filter_emg(raw, sampling_rate)
     testing.assert_allclose(filtered, filtered_des, atol=0.001)
 
+def _filter_critically_damped_loop(data, sampling_rate,
+        lowpass_cutoff_frequency, order=4):
+    # The original per-sample recurrence, as a reference.
+    Clp = (2.0 ** (1.0 / (2.0 * order)) - 1.0) ** (-0.5)
+    wolp = np.tan(np.pi * Clp * lowpass_cutoff_frequency / sampling_rate)
+    K1lp = 2.0 * wolp
+    K2lp = wolp ** 2
+    a0lp = K2lp / (1.0 + K1lp + K2lp)
+    a1lp = 2.0 * a0lp
+    a2lp = a0lp
+    b1lp = 2.0 * a0lp  * (1.0 / K2lp - 1.0)
+    b2lp = 1.0 - (a0lp + a1lp + a2lp + b1lp)
+    num_rows = len(data)
+    for n_pass in range(order):
+        temp_filtered = np.zeros(num_rows)
+        for i in range(2, num_rows):
+            temp_filtered[i] = (a0lp * data[i] + a1lp * data[i - 1] +
+                    a2lp * data[i - 2] + b1lp * temp_filtered[i - 1] +
+                    b2lp * temp_filtered[i - 2])
+        data = np.flipud(temp_filtered)
+    return data
+
+def test_filter_critically_damped():
+    dat = np.loadtxt(os.path.join(parentdir, 'emg_raw_and_filtered.txt'))
+    raw = np.abs(dat[:, 0])
+    sampling_rate = 2000
+    for order in [1, 2, 4]:
+        testing.assert_allclose(
+                pproc.filter_critically_damped(raw, sampling_rate, 15.0,
+                    order=order),
+                _filter_critically_damped_loop(raw, sampling_rate, 15.0,
+                    order=order), rtol=1e-9, atol=1e-12)
+
+    # All channels at once, along either axis.
+    channels = np.column_stack([raw, 2 * raw[::-1], raw + 1])
+    filtered = pproc.filter_critically_damped(channels, sampling_rate, 15.0)
+    for i in range(channels.shape[1]):
+        testing.assert_allclose(filtered[:, i],
+                pproc.filter_critically_damped(channels[:, i],
+                    sampling_rate, 15.0))
+    testing.assert_allclose(pproc.filter_critically_damped(channels.T,
+        sampling_rate, 15.0, axis=1), filtered.T)
+
 def test_shift_data_to_cycle():
 
     ordinate = np.array([2.0, 1., 2., 3., 4., 5., 6.])
@@ -151,6 +201,223 @@ def test_shift_data_to_cycle_for_less_than_full_cycle():
     # Case 3: data starts late AND ends early.
     # TODO
 
+def _emg_channels(emg):
+    # Channels 'A', 'B', ... from the columns of `emg`.
+    data = np.empty(len(emg), dtype=[(chr(ord('A') + i), 'f8')
+        for i in range(emg.shape[1])])
+    for i, name in enumerate(data.dtype.names):
+        data[name] = emg[:, i]
+    return data
+
+def test_filter_emg_many(tmpdir, monkeypatch):
+    dat = np.loadtxt(os.path.join(parentdir, 'emg_raw_and_filtered.txt'))
+    raw = dat[:, 0]
+    sampling_rate = 2000
+    emg = np.column_stack([raw, raw[::-1], 3 * raw])
+    expected = np.column_stack([pproc.filter_emg(emg[:, i], sampling_rate)
+        for i in range(emg.shape[1])])
+    testing.assert_allclose(expected[:, 0], dat[:, 1], atol=0.001)
+    for n_workers in [1, 2, 4]:
+        testing.assert_allclose(pproc.filter_emg_many(emg, sampling_rate,
+            n_workers=n_workers), expected)
+    testing.assert_allclose(pproc.filter_emg_many(emg.T, sampling_rate,
+        axis=1), expected.T)
+    # The worker threads are shut down, even after an exception.
+    def fail(design, signals):
+        raise Exception('Filter failed.')
+    monkeypatch.setattr(pproc, '_filter_emg', fail)
+    n_threads = threading.active_count()
+    with pytest.raises(Exception):
+        pproc.filter_emg_many(emg, sampling_rate, n_workers=4)
+    assert threading.active_count() == n_threads
+    monkeypatch.undo()
+    assert (pproc._emg_filter_design(sampling_rate) is
+            pproc._emg_filter_design(sampling_rate))
+
+    # From an ANC file.
+    fpath = str(tmpdir.join('emg.anc'))
+    write_anc(fpath, _emg_channels(emg[:, [0, 2]]), 2000, 10000)
+    anc = dataman.ANCFile(fpath)
+    filtered = pproc.filter_emg_many(anc)
+    assert filtered.dtype.names == ('time', 'A', 'B')
+    testing.assert_allclose(filtered['time'], anc.time)
+    testing.assert_allclose(filtered['B'], pproc.filter_emg(anc.data['B'],
+        sampling_rate))
+
+def test_emg_filter_blocks(tmpdir):
+    dat = np.loadtxt(os.path.join(parentdir, 'emg_raw_and_filtered.txt'))
+    emg = np.column_stack([dat[:, 0], 2 * dat[:, 0][::-1] + 10])
+    sampling_rate = 2000
+
+    # The output does not depend on how the signal is split up.
+    whole = pproc.EMGFilter(sampling_rate, 2).filter(emg)
+    emg_filter = pproc.EMGFilter(sampling_rate, 2)
+    blocks = [emg_filter.filter(emg[i:i + 37])
+            for i in range(0, len(emg), 37)]
+    testing.assert_allclose(np.concatenate(blocks), whole)
+    emg_filter.reset()
+    testing.assert_allclose(emg_filter.filter(emg), whole)
+
+    # Causal filters, in series; the bandpass starts in steady state.
+    nyquist = 0.5 * sampling_rate
+    bandpass = butter(6, [50 / nyquist, 500 / nyquist], btype='bandpass',
+            output='sos')
+    lowpass = butter(4, 7.5 / nyquist, output='sos')
+    b, a = pproc._critically_damped_coefficients(sampling_rate, 15.0, 4)
+    expected = np.abs(sosfilt(bandpass, emg - emg[0], axis=0))
+    expected = sosfilt(lowpass, expected, axis=0)
+    for i in range(4):
+        expected = sosfilt(np.concatenate([b, a])[None], expected, axis=0)
+    testing.assert_allclose(whole, expected, atol=1e-9)
+
+    # From an ANC file.
+    fpath = str(tmpdir.join('emg.anc'))
+    write_anc(fpath, _emg_channels(emg), 2000, 10000)
+    counts = np.loadtxt(fpath, skiprows=8)[:, 1:]
+    blocks = list(pproc.filter_emg_stream(fpath, names=['B'],
+        chunk_rows=500))
+    assert blocks[0].dtype.names == ('time', 'B')
+    assert len(blocks[0]) == 500
+    testing.assert_allclose(np.concatenate(blocks)['B'],
+            pproc.EMGFilter(sampling_rate, 1).filter(counts[:, 1:])[:, 0])
+
+def test_gait_landmarks_from_grf(tmpdir):
+    data = synthetic_grf(10.0)
+    rng = np.random.RandomState(0)
+    data['ground_force_vy'] += np.where(data['ground_force_vy'] > 0, 0,
+            rng.uniform(-2, 2, len(data)))
+    fpath = str(tmpdir.join('grf.mot'))
+    dataman.ndarray2storage(data, fpath)
+    data = dataman.storage2numpy(fpath)
+    time = data['time']
+
+    for min_time, max_time, threshold in [(None, None, 1e-5),
+            (2.05, 7.3, 1e-5), (None, None, 5.0)]:
+        landmarks = pproc.gait_landmarks_from_grf(fpath, threshold=threshold,
+                min_time=min_time, max_time=max_time)
+        min_idx = 1 if min_time == None else pproc.nearest_index(time,
+                min_time)
+        max_idx = len(time) if max_time == None else pproc.nearest_index(
+                time, max_time)
+        right = gait_landmarks_loop(time, data['ground_force_vy'],
+                threshold, min_idx, max_idx)
+        left = gait_landmarks_loop(time, data['1_ground_force_vy'],
+                threshold, min_idx, max_idx)
+        for actual, expected in zip(landmarks,
+                [right[0], left[0], right[1], left[1]]):
+            testing.assert_array_equal(actual, expected)
+
+    # The noise on the right leg creates spurious events; hysteresis or
+    # debouncing removes them (except at the very end of the data, for
+    # debouncing).
+    rfs, lfs, rto, lto = pproc.gait_landmarks_from_grf(fpath, threshold=5.0)
+    assert len(rfs) == len(lfs) == 9
+    rfs, lfs, rto, lto = pproc.gait_landmarks_from_grf(fpath, threshold=1.0)
+    assert len(rfs) > 100
+    for kwargs in [dict(hysteresis=5.0), dict(min_duration=0.05)]:
+        rfs, lfs, rto, lto = pproc.gait_landmarks_from_grf(fpath,
+                threshold=1.0, max_time=9.9, **kwargs)
+        assert len(rfs) == len(lfs) == 9
+        assert len(rto) == len(lto) == 9
+        testing.assert_allclose(np.diff(rfs), 1.1, atol=0.0011)
+
+    # Interpolated times are within a sample of the true crossings.
+    rfs, lfs, rto, lto = pproc.gait_landmarks_from_grf(fpath, threshold=5.0,
+            interpolate=True)
+    crossing = np.arcsin(5.0 / 800) / np.pi * 0.66
+    testing.assert_allclose(lfs, 0.65 + 1.1 * np.arange(9) + crossing,
+            atol=1e-4)
+    testing.assert_allclose(lto, 0.21 + 1.1 * np.arange(9) - crossing,
+            atol=1e-4)
+
+def test_index_gait_cycles(tmpdir):
+    study = str(tmpdir.join('study'))
+    trials = ['subj01/walk1_grf.mot', 'subj01/walk2_grf.mot',
+            'subj02/walk1_grf.mot']
+    for i, trial in enumerate(trials):
+        if not os.path.exists(os.path.join(study, os.path.dirname(trial))):
+            os.makedirs(os.path.join(study, os.path.dirname(trial)))
+        dataman.ndarray2storage(synthetic_grf(5.0 + i),
+                os.path.join(study, trial))
+    open(os.path.join(study, 'subj01', 'notes.txt'), 'w').write('')
+
+    index = pproc.index_gait_cycles(study, verbose=False)
+    assert index.trials() == trials
+    with pytest.raises(Exception) as excinfo:
+        pproc.index_gait_cycles(study, verbose=False, treshold=5.0)
+    assert 'treshold' in str(excinfo.value)
+    cycles = index.select(trial=trials[0], primary_leg='right')
+    # Right strikes at 0.1, 1.2, ..., 4.5; left cycles start at 0.65.
+    testing.assert_allclose(cycles['cycle_start'], [0.1, 1.2, 2.3, 3.4],
+            atol=0.0011)
+    testing.assert_allclose(cycles['cycle_end'] - cycles['cycle_start'], 1.1,
+            atol=0.0011)
+    testing.assert_allclose(cycles['right_toeoff'] - cycles['cycle_start'],
+            0.66, atol=0.0011)
+    testing.assert_allclose(cycles['left_strike'] - cycles['cycle_start'],
+            0.55, atol=0.0011)
+
+    # Every pair of consecutive strikes is a complete cycle in these trials.
+    for trial in trials:
+        rfs, lfs, rto, lto = pproc.gait_landmarks_from_grf(
+                os.path.join(study, trial))
+        cycles = index.select(trial=trial, primary_leg='left')
+        testing.assert_array_equal(cycles['cycle_start'], lfs[:-1])
+        testing.assert_array_equal(cycles['cycle_end'], lfs[1:])
+        assert np.all(np.in1d(cycles['right_toeoff'], rto))
+        assert len(index.select(trial=trial, primary_leg='right')) == \
+                len(rfs) - 1
+
+    # In parallel, and saved and loaded without the GRF files.
+    for ext in ['.npz', '.h5']:
+        fpath = str(tmpdir.join('gait_cycles' + ext))
+        parallel = pproc.index_gait_cycles(study, index_fpath=fpath,
+                n_workers=2, verbose=False)
+        loaded = dataman.GaitCycleIndex(fpath)
+        assert loaded.data.dtype == index.data.dtype
+        for name in index.data.dtype.names:
+            testing.assert_array_equal(parallel.data[name], index.data[name])
+            testing.assert_array_equal(loaded.data[name], index.data[name])
+
+    gls = loaded.gait_landmarks(trial=trials[1], primary_leg='right')
+    assert len(gls) == 5
+    assert gls[1].primary_leg == 'right'
+    time = np.linspace(0, 6, 601)
+    pgc, ys = pproc.data_by_pgc(time, np.sin(time), gls[1], side='right')
+    assert pgc.min() >= 0 and pgc.max() <= 100
+
+    # From tables in an HDF5 file.
+    h5fname = str(tmpdir.join('study.h5'))
+    h5file = tables.open_file(h5fname, mode='w')
+    for i, trial in enumerate(trials):
+        group = h5file.create_group('/', 'trial%i' % i, createparents=True)
+        h5file.create_table(group, 'grf', obj=dataman.storage2numpy(
+            os.path.join(study, trial)))
+    h5file.create_table('/', 'other', obj=np.zeros(3, dtype=[('time', 'f8')]))
+    h5file.close()
+    from_h5 = pproc.index_gait_cycles(h5fname, verbose=False)
+    assert from_h5.trials() == ['/trial0/grf', '/trial1/grf', '/trial2/grf']
+    for name in index.landmark_names:
+        testing.assert_array_equal(from_h5.data[name], index.data[name])
+
+def test_verify_simulation_columns_layout(tmpdir, capsys):
+    fpath = os.path.join(parentdir, 'double_pendulum_states.sto')
+    h5file = tables.open_file(str(tmpdir.join('docked.h5')), mode='w')
+    try:
+        outputs = dict()
+        for layout in ['rows', 'columns']:
+            group = h5file.create_group('/', layout)
+            for table_name in ['pErr', 'Actuation_force']:
+                dataman._populate_table(h5file, group, table_name, fpath,
+                        layout=layout)
+            pproc.verify_simulation(group)
+            outputs[layout] = capsys.readouterr()[0]
+        assert isinstance(h5file.root.columns.pErr, tables.Group)
+        assert 'Kinematics:' in outputs['columns']
+        assert outputs['columns'] == outputs['rows']
+    finally:
+        h5file.close()
+
 if __name__ == '__main__':
     #import pylab as pl
     #test_shift_data_to_cycle_for_less_than_full_cycle()